@@ -0,0 +1,113 @@
+"""
+Per-frame eye classification latency: one model.predict() call per eye,
+as the scripts did, against both eyes in one (2, 24, 24, 1) batch with
+EyeClassifier (eye_classifier.py), called eagerly and through tf.function.
+
+Each path gets the same frames and eye boxes and is timed from the eye
+crops to the class of each eye, preprocessing included. Without --model
+the network of model.py is built with random weights: the timing doesn't
+depend on the weights, and the trained models/cnncat2.h5 isn't part of the
+repository. predict() runs with verbose=0 so it doesn't print a progress
+bar per call. Exits 1 if the batched paths' probabilities differ from
+predict()'s by more than --atol.
+
+Usage:
+    python benchmarks/bench_eye_inference.py [--model models/cnncat2.h5] [--frames 300]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import cv2
+import numpy as np
+from keras.models import Sequential, load_model
+from keras.layers import Dropout, Conv2D, Flatten, Dense, MaxPooling2D, Input
+from eye_classifier import EyeClassifier
+
+# Eye boxes (x, y, w, h) in a 640x480 frame, about where a face at arm's length puts them
+RIGHT_EYE = np.array([[250, 170, 50, 50]])
+LEFT_EYE = np.array([[340, 170, 50, 50]])
+
+
+def build_model():
+    # The network trained by model.py
+    return Sequential([
+        Input((24, 24, 1)),
+        Conv2D(32, kernel_size=(3, 3), activation='relu'),
+        MaxPooling2D(pool_size=(1, 1)),
+        Conv2D(32, (3, 3), activation='relu'),
+        MaxPooling2D(pool_size=(1, 1)),
+        Conv2D(64, (3, 3), activation='relu'),
+        MaxPooling2D(pool_size=(1, 1)),
+        Dropout(0.25),
+        Flatten(),
+        Dense(128, activation='relu'),
+        Dropout(0.5),
+        Dense(2, activation='softmax'),
+    ])
+
+
+def two_predict_calls(model, frame, right_eye, left_eye):
+    # The scripts' former per-eye path
+    preds = []
+    for (x, y, w, h) in (right_eye[0], left_eye[0]):
+        eye = cv2.cvtColor(frame[y:y + h, x:x + w], cv2.COLOR_BGR2GRAY)
+        eye = cv2.resize(eye, (24, 24))
+        eye = eye / 255
+        eye = np.reshape(eye, (24, 24, -1))
+        eye = np.expand_dims(eye, axis=0)
+        preds.append(model.predict(eye, verbose=0)[0])
+    return preds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', help='Trained model file; the model.py network with random weights when not given')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--atol', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    model = load_model(args.model) if args.model else build_model()
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (480, 640, 3), dtype=np.uint8) for _ in range(8)]
+
+    paths = {
+        "2 x predict()": lambda frame: two_predict_calls(model, frame, RIGHT_EYE, LEFT_EYE),
+        "batch, eager": EyeClassifier(model, compiled=False).predict,
+        "batch, tf.function": EyeClassifier(model, compiled=True).predict,
+    }
+    for name, path in list(paths.items())[1:]:
+        paths[name] = lambda frame, path=path: path(frame, RIGHT_EYE, LEFT_EYE)
+
+    latencies = {name: [] for name in paths}
+    largest_difference = {name: 0.0 for name in paths}
+    for i in range(args.warmup + args.frames):
+        frame = frames[i % len(frames)]
+        outputs = {}
+        # Interleaved, so load from the rest of the machine falls on every path alike
+        for name, path in paths.items():
+            start = time.perf_counter()
+            outputs[name] = path(frame)
+            if i >= args.warmup:
+                latencies[name].append(time.perf_counter() - start)
+        reference = np.stack(outputs["2 x predict()"])
+        for name, output in outputs.items():
+            largest_difference[name] = max(largest_difference[name], float(np.abs(np.stack(output) - reference).max()))
+
+    print(f"{args.frames} frames, both eyes per frame ({'model ' + args.model if args.model else 'untrained model.py network'})")
+    print(f"{'path':>20} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max diff':>9}")
+    for name, values in latencies.items():
+        p50, p90, p99 = np.percentile(np.array(values) * 1e3, [50, 90, 99])
+        print(f"{name:>20} {p50:>8.2f} {p90:>8.2f} {p99:>8.2f} {largest_difference[name]:>9.1e}")
+    baseline = np.median(latencies["2 x predict()"])
+    for name in list(paths)[1:]:
+        print(f"{name}: {baseline / np.median(latencies[name]):.1f}x faster than 2 x predict()")
+    sys.exit(0 if max(largest_difference.values()) <= args.atol else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Frames per second of the detection stage with eyes searched in the whole
+frame against only in the upper half of each face (eye_detection.py).
+
+Runs on recorded video files instead of a webcam. Every frame goes through
+the scripts' detection steps (grayscale, face cascade, eye cascades) once
+per mode, so both modes see the same frames. Decoding is not timed. For
+each mode it reports the frames per second the detection stage sustains,
+the time spent in the eye cascades alone and how many frames got a left
+and a right eye to classify. Exits 1 if 'face' mode is slower than 'frame'.
+
+Usage:
+    python benchmarks/bench_eye_search.py video.mp4 [video2.avi ...] [--max-frames 300]
+"""
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, HERE)
+
+import cv2
+from eye_detection import EYE_SEARCH_MODES, detect_eyes
+
+CASCADES = os.path.join(HERE, 'haar cascade files')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('videos', nargs='+', help='Recorded video files')
+    parser.add_argument('--max-frames', type=int, default=0, help='Frames per video (0: all)')
+    parser.add_argument('--cascades', default=CASCADES, help='Directory of the Haar cascade files')
+    args = parser.parse_args()
+
+    face = cv2.CascadeClassifier(os.path.join(args.cascades, 'haarcascade_frontalface_alt.xml'))
+    leye = cv2.CascadeClassifier(os.path.join(args.cascades, 'haarcascade_lefteye_2splits.xml'))
+    reye = cv2.CascadeClassifier(os.path.join(args.cascades, 'haarcascade_righteye_2splits.xml'))
+
+    frames = frames_with_face = 0
+    shared_seconds = 0.0
+    eye_seconds = {mode: 0.0 for mode in EYE_SEARCH_MODES}
+    both_eyes = {mode: 0 for mode in EYE_SEARCH_MODES}
+    for video in args.videos:
+        cap = cv2.VideoCapture(video)
+        if not cap.isOpened():
+            parser.error(f"Could not open {video}")
+        count = 0
+        while not args.max_frames or count < args.max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            count += 1
+
+            start = time.perf_counter()
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            faces = face.detectMultiScale(gray, minNeighbors=5, scaleFactor=1.1, minSize=(25, 25))
+            shared_seconds += time.perf_counter() - start
+            frames_with_face += len(faces) > 0
+
+            for mode in EYE_SEARCH_MODES:
+                start = time.perf_counter()
+                left_eye, right_eye = detect_eyes(gray, faces, leye, reye, mode)
+                eye_seconds[mode] += time.perf_counter() - start
+                both_eyes[mode] += len(left_eye) > 0 and len(right_eye) > 0
+        cap.release()
+        frames += count
+
+    if not frames:
+        parser.error("No frames read")
+    print(f"{frames} frames from {len(args.videos)} video(s), {frames_with_face} with a face; "
+          f"grayscale + face cascade {shared_seconds / frames * 1e3:.1f} ms/frame")
+    print(f"{'mode':>6} {'fps':>8} {'eyes ms':>8} {'both eyes':>10}")
+    fps = {}
+    for mode in EYE_SEARCH_MODES:
+        fps[mode] = frames / (shared_seconds + eye_seconds[mode])
+        print(f"{mode:>6} {fps[mode]:>8.1f} {eye_seconds[mode] / frames * 1e3:>8.2f} {both_eyes[mode]:>10}")
+    print(f"\n'face' mode: {fps['face'] / fps['frame']:.2f}x the frame rate of 'frame' mode")
+    sys.exit(0 if fps['face'] >= fps['frame'] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Throughput and glass-to-alarm latency of the scripts' sequential loop
+against the pipelined runtime (pipeline.py), on recorded video.
+
+The video is played as a camera would deliver it: frame k becomes
+available at k / fps seconds (its "glass" time) into a device queue of
+--device-buffers frames. A frame that arrives while the queue is full is
+lost, as V4L2 drops frames while the application holds every buffer, and
+read() returns the oldest queued frame. Frames are decoded up front, so
+decoding isn't timed. Both runtimes run without a window:
+
+    sequential  read(), then detection, classification and score, in a loop
+    pipelined   DrowsinessPipeline(render=False): a capture thread keeps
+                only the newest frame for the worker
+
+For each it reports frames processed per second, camera frames never
+processed, and the time from a processed frame's glass time to its
+decision: the moment the alarm would go off had that frame raised the
+score over the threshold. Those latencies are also reported for frames
+that actually had the alarm on. Without --model the network of model.py
+is used with random weights (bench_eye_inference.py), which doesn't
+change the timing but makes alarms a matter of chance. Exits 1 if the
+pipelined runtime's median latency isn't lower than the sequential loop's.
+
+Usage:
+    python benchmarks/bench_pipeline.py video.mp4 [--model models/cnncat2.h5] [--max-frames 300]
+"""
+import argparse
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import cv2
+import numpy as np
+from keras.models import load_model
+from bench_eye_inference import build_model
+from drowsiness import DrowsinessDetector, load_cascades
+from eye_classifier import EyeClassifier
+from eye_detection import EYE_SEARCH_MODES
+from pipeline import DrowsinessPipeline
+
+
+class PacedCamera:
+    """Delivers decoded frames at fps into a device queue of `buffers` frames; read() like cv2.VideoCapture's."""
+
+    def __init__(self, frames, fps, buffers):
+        self.frames = frames
+        self.interval = 1.0 / fps
+        self.buffers = buffers
+        self.queue = collections.deque()
+        self.next_frame = 0
+        self.lost = 0
+        self.glass = []  # glass time of the frame returned by each read()
+        self.start = None
+
+    def _arrive(self, now):
+        while self.next_frame < len(self.frames) and self.start + self.next_frame * self.interval <= now:
+            if len(self.queue) < self.buffers:
+                self.queue.append(self.next_frame)
+            else:
+                self.lost += 1
+            self.next_frame += 1
+
+    def read(self):
+        if self.start is None:
+            self.start = time.monotonic()
+        self._arrive(time.monotonic())
+        if not self.queue:
+            if self.next_frame >= len(self.frames):
+                return False, None
+            time.sleep(max(0.0, self.start + self.next_frame * self.interval - time.monotonic()))
+            self._arrive(time.monotonic())
+        index = self.queue.popleft()
+        self.glass.append(self.start + index * self.interval)
+        return True, self.frames[index].copy()
+
+
+def run_sequential(camera, detector):
+    decisions = []
+    while True:
+        ret, frame = camera.read()
+        if not ret:
+            break
+        analysis = detector.process(frame)
+        decisions.append((len(camera.glass) - 1, time.monotonic(), analysis.alarm))
+    return decisions
+
+
+def run_pipelined(camera, detector):
+    decisions = []
+    pipeline = DrowsinessPipeline(camera, detector, render=False,
+                                  on_result=lambda r: decisions.append((r.frame.index, r.decided, r.analysis.alarm)))
+    pipeline.run()
+    return decisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', help='Recorded video file')
+    parser.add_argument('--model', help='Trained model file; the model.py network with random weights when not given')
+    parser.add_argument('--max-frames', type=int, default=300)
+    parser.add_argument('--fps', type=float, help="Camera frame rate; the video's when not given")
+    parser.add_argument('--device-buffers', type=int, default=4, help='Frames the camera driver queues')
+    parser.add_argument('--eye-search', choices=EYE_SEARCH_MODES, default='face')
+    args = parser.parse_args()
+
+    cap = cv2.VideoCapture(args.video)
+    if not cap.isOpened():
+        parser.error(f"Could not open {args.video}")
+    fps = args.fps or cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frames = []
+    while len(frames) < args.max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        parser.error("No frames read")
+
+    model = load_model(args.model) if args.model else build_model()
+    cascades = load_cascades()
+    classifier = EyeClassifier(model)
+    # Traces the compiled model call, so neither runtime pays for it
+    DrowsinessDetector(model, cascades, args.eye_search, classifier=classifier).process(frames[0])
+
+    print(f"{len(frames)} frames at {fps:.0f} fps ({len(frames) / fps:.1f} s), {args.device_buffers} device buffers")
+    medians = {}
+    print(f"{'runtime':>10} {'proc/s':>7} {'unused':>7} {'p50 ms':>8} {'p90 ms':>8} {'max ms':>8} {'alarms':>7} {'alarm p50':>10}")
+    for name, runtime in (("sequential", run_sequential), ("pipelined", run_pipelined)):
+        camera = PacedCamera(frames, fps, args.device_buffers)
+        detector = DrowsinessDetector(model, cascades, args.eye_search, classifier=classifier)
+        start = time.monotonic()
+        decisions = runtime(camera, detector)
+        elapsed = time.monotonic() - start
+        latency = np.array([decided - camera.glass[index] for index, decided, _ in decisions]) * 1e3
+        alarms = np.array([decided - camera.glass[index] for index, decided, alarm in decisions if alarm]) * 1e3
+        p50, p90 = np.percentile(latency, [50, 90])
+        medians[name] = p50
+        alarm_p50 = f"{np.median(alarms):>10.0f}" if alarms.size else f"{'-':>10}"
+        print(f"{name:>10} {len(decisions) / elapsed:>7.1f} {len(frames) - len(decisions):>7} "
+              f"{p50:>8.0f} {p90:>8.0f} {latency.max():>8.0f} {alarms.size:>7} {alarm_p50}")
+    sys.exit(0 if medians["pipelined"] < medians["sequential"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Throughput of the headless service (drowsiness_service.py) with several
+recorded videos at once, for different numbers of worker processes.
+
+--streams sources are made by cycling through the given videos, and each
+is processed frame by frame to its end. For every --workers count it
+reports the time until all streams were open (process start and model
+loading), the frames processed per second over all streams and per stream,
+and the alarm events. With more workers than cores, or on a single core,
+the aggregate rate can't grow; it is there to show how it scales where the
+cores exist. Without --model the network of model.py is saved with random
+weights and used (bench_eye_inference.py). Exits 1 if a stream reported an
+error or ended with frames unprocessed.
+
+Usage:
+    python benchmarks/bench_service.py video.mp4 [video2.avi ...] [--streams 4] [--workers 1,2,4]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from bench_eye_inference import build_model
+from drowsiness import ALARM_SCORE
+from drowsiness_service import run_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('videos', nargs='+', help='Recorded video files')
+    parser.add_argument('--streams', type=int, default=4)
+    parser.add_argument('--workers', default=f"1,{os.cpu_count() or 1}", help='Comma-separated worker counts to run')
+    parser.add_argument('--model', help='Trained model file; the model.py network with random weights when not given')
+    parser.add_argument('--eye-search', default='face')
+    args = parser.parse_args()
+
+    sources = [os.path.abspath(args.videos[i % len(args.videos)]) for i in range(args.streams)]
+    worker_counts = sorted({int(n) for n in args.workers.split(',') if n.strip()})
+    workdir = tempfile.mkdtemp(prefix='bench_service_')
+    try:
+        model_path = args.model
+        if not model_path:
+            model_path = os.path.join(workdir, 'model.keras')
+            build_model().save(model_path)
+
+        print(f"{len(sources)} streams from {len(args.videos)} video(s), {os.cpu_count()} cores")
+        print(f"{'workers':>7} {'open s':>7} {'total fps':>10} {'stream fps':>11} {'alarms':>7} {'errors':>7}")
+        ok = True
+        for workers in worker_counts:
+            options = argparse.Namespace(model=os.path.abspath(model_path), workers=workers, threads=1,
+                                         eye_search=args.eye_search, alarm_score=ALARM_SCORE, snapshot_dir=None)
+            events = []
+            start = time.monotonic()
+            run_service(sources, options, lambda event: events.append((time.monotonic(), event)))
+            elapsed = time.monotonic() - start
+
+            started = [t for t, e in events if e['event'] == 'stream_started']
+            ended = [e for _, e in events if e['event'] == 'stream_ended']
+            errors = [e for _, e in events if e['event'] == 'stream_error']
+            alarms = sum(e['event'] == 'alarm' for _, e in events)
+            processed = sum(e['processed'] for e in ended)
+            stream_fps = np.median([e['processed'] / e['seconds'] for e in ended]) if ended else 0.0
+            opened = (max(started) - start) if started else float('nan')
+            print(f"{workers:>7} {opened:>7.1f} {processed / (elapsed - opened):>10.1f} {stream_fps:>11.1f} "
+                  f"{alarms:>7} {len(errors):>7}")
+            for e in errors:
+                print(f"  stream {e['stream']}: {e['message']}")
+            ok = ok and not errors and len(ended) == len(sources) and all(e['processed'] == e['frames'] for e in ended)
+    finally:
+        shutil.rmtree(workdir)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
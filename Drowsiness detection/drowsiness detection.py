@@ -4,6 +4,8 @@ from keras.models import load_model
 import numpy as np
 from pygame import mixer
 import time
+from eye_detection import detect_eyes
+from eye_classifier import EyeClassifier
 
 
 mixer.init()
@@ -17,7 +19,11 @@ reye = cv2.CascadeClassifier('haar cascade files\haarcascade_righteye_2splits.xm
 
 lbl=['Close','Open']
 
+# 'face': eyes searched in the upper half of each face only, 'frame': in the whole frame
+eye_search = os.getenv('EYE_SEARCH', 'face')
+
 model = load_model('models/cnncat2.h5')
+eyes = EyeClassifier(model)
 path = os.getcwd()
 cap = cv2.VideoCapture(0)
 font = cv2.FONT_HERSHEY_COMPLEX_SMALL
@@ -34,43 +40,23 @@ while(True):
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     
     faces = face.detectMultiScale(gray,minNeighbors=5,scaleFactor=1.1,minSize=(25,25))
-    left_eye = leye.detectMultiScale(gray)
-    right_eye =  reye.detectMultiScale(gray)
+    left_eye, right_eye = detect_eyes(gray, faces, leye, reye, eye_search)
 
     cv2.rectangle(frame, (0,height-50) , (200,height) , (0,0,0) , thickness=cv2.FILLED )
 
     for (x,y,w,h) in faces:
         cv2.rectangle(frame, (x,y) , (x+w,y+h) , (100,100,100) , 1 )
 
-    for (x,y,w,h) in right_eye:
-        r_eye=frame[y:y+h,x:x+w]
+    # Both eyes in one model call; an eye that isn't found keeps its last prediction
+    r_class, l_class = eyes.classify(frame, right_eye, left_eye)
+    if r_class is not None:
         count=count+1
-        r_eye = cv2.cvtColor(r_eye,cv2.COLOR_BGR2GRAY)
-        r_eye = cv2.resize(r_eye,(24,24))
-        r_eye= r_eye/255
-        r_eye=  r_eye.reshape(24,24,-1)
-        r_eye = np.expand_dims(r_eye,axis=0)
-        rpred = model.predict_classes(r_eye)
-        if(rpred[0]==1):
-            lbl='Open' 
-        if(rpred[0]==0):
-            lbl='Closed'
-        break
-
-    for (x,y,w,h) in left_eye:
-        l_eye=frame[y:y+h,x:x+w]
+        rpred=[r_class]
+        lbl = 'Open' if r_class==1 else 'Closed'
+    if l_class is not None:
         count=count+1
-        l_eye = cv2.cvtColor(l_eye,cv2.COLOR_BGR2GRAY)  
-        l_eye = cv2.resize(l_eye,(24,24))
-        l_eye= l_eye/255
-        l_eye=l_eye.reshape(24,24,-1)
-        l_eye = np.expand_dims(l_eye,axis=0)
-        lpred = model.predict_classes(l_eye)
-        if(lpred[0]==1):
-            lbl='Open'   
-        if(lpred[0]==0):
-            lbl='Closed'
-        break
+        lpred=[l_class]
+        lbl = 'Open' if l_class==1 else 'Closed'
 
     if(rpred[0]==0 and lpred[0]==0):
         score=score+1
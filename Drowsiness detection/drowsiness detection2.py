@@ -4,6 +4,8 @@ from keras.models import load_model
 import numpy as np
 import pygame.mixer as mixer
 import time
+from eye_detection import detect_eyes
+from eye_classifier import EyeClassifier
 
 # Initialize Pygame Mixer for sound
 mixer.init()
@@ -17,9 +19,15 @@ reye = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_righteye_2spli
 # Labels for eye status
 lbl = ['Close', 'Open']
 
+# Where to look for eyes: 'face' (upper half of each detected face) or 'frame' (whole frame)
+eye_search = os.getenv('EYE_SEARCH', 'face')
+
 # Load the pre-trained CNN model for eye state classification
 model = load_model('models/cnncat2.h5')
 
+# Batched (2, 24, 24, 1) inference on preallocated buffers
+eyes = EyeClassifier(model)
+
 # Get the current working directory
 path = os.getcwd()
 
@@ -48,9 +56,8 @@ while True:
     # Detect faces in the grayscale frame
     faces = face.detectMultiScale(gray, minNeighbors=5, scaleFactor=1.1, minSize=(25, 25))
     
-    # Detect left and right eyes in the grayscale frame
-    left_eye = leye.detectMultiScale(gray)
-    right_eye = reye.detectMultiScale(gray)
+    # Detect left and right eyes; in 'face' mode only within the faces, none if there is no face
+    left_eye, right_eye = detect_eyes(gray, faces, leye, reye, eye_search)
 
     # Draw a black rectangle at the bottom of the frame
     cv2.rectangle(frame, (0, height - 50), (200, height), (0, 0, 0), thickness=cv2.FILLED)
@@ -59,40 +66,20 @@ while True:
     for (x, y, w, h) in faces:
         cv2.rectangle(frame, (x, y), (x + w, y + h), (100, 100, 100), 1)
 
-    # Detect and classify right eye status
-    for (x, y, w, h) in right_eye:
-        r_eye = frame[y:y + h, x:x + w]
+    # Classify the first right and left eye found, both in one model call.
+    # An eye that isn't found this frame keeps its last prediction.
+    r_class, l_class = eyes.classify(frame, right_eye, left_eye)
+    if r_class is not None:
         count += 1
-        r_eye = cv2.cvtColor(r_eye, cv2.COLOR_BGR2GRAY)
-        r_eye = cv2.resize(r_eye, (24, 24))
-        r_eye = r_eye / 255
-        r_eye = np.reshape(r_eye, (24, 24, -1))
-        r_eye = np.expand_dims(r_eye, axis=0)
-        rpred = model.predict(r_eye)
-        if np.argmax(rpred) == 1:
-            lbl = 'Open'
-        if np.argmax(rpred) == 0:
-            lbl = 'Closed'
-        break
-
-    # Detect and classify left eye status
-    for (x, y, w, h) in left_eye:
-        l_eye = frame[y:y + h, x:x + w]
+        rpred = [r_class]
+        lbl = 'Open' if r_class == 1 else 'Closed'
+    if l_class is not None:
         count += 1
-        l_eye = cv2.cvtColor(l_eye, cv2.COLOR_BGR2GRAY)
-        l_eye = cv2.resize(l_eye, (24, 24))
-        l_eye = l_eye / 255
-        l_eye = np.reshape(l_eye, (24, 24, -1))
-        l_eye = np.expand_dims(l_eye, axis=0)
-        lpred = model.predict(l_eye)
-        if np.argmax(lpred) == 1:
-            lbl = 'Open'
-        if np.argmax(lpred) == 0:
-            lbl = 'Closed'
-        break
+        lpred = [l_class]
+        lbl = 'Open' if l_class == 1 else 'Closed'
 
     # Check and update the score based on eye status
-    if np.argmax(rpred) == 0 and np.argmax(lpred) == 0:
+    if rpred[0] == 0 and lpred[0] == 0:
         score += 1
         cv2.putText(frame, "Closed", (10, height - 20), font, 1, (255, 255, 255), 1, cv2.LINE_AA)
     else:
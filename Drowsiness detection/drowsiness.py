@@ -0,0 +1,90 @@
+"""
+The per-frame steps of the drowsiness detection scripts, for runtimes that
+don't run the scripts' own loop: face and eye detection with the Haar
+cascades (eye_detection.py), eye state with the CNN (eye_classifier.py)
+and the score that raises the alarm.
+"""
+import os
+from collections import namedtuple
+
+import cv2
+
+from eye_detection import detect_eyes
+from eye_classifier import EyeClassifier
+
+CASCADE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'haar cascade files')
+
+# The alarm goes off while the score is above this
+ALARM_SCORE = 15
+
+# What process() found in a frame
+Analysis = namedtuple('Analysis', 'faces left_eye right_eye closed score alarm')
+
+
+def load_cascades(directory=CASCADE_DIRECTORY):
+    """Returns the face, left eye and right eye cv2.CascadeClassifier."""
+    return tuple(cv2.CascadeClassifier(os.path.join(directory, name)) for name in (
+        'haarcascade_frontalface_alt.xml', 'haarcascade_lefteye_2splits.xml', 'haarcascade_righteye_2splits.xml'))
+
+
+class DrowsinessScore:
+    """
+    The scripts' score: up one for every frame in which both eyes were last
+    seen closed, down one otherwise, never below zero. An eye that isn't
+    found in a frame keeps its last class.
+
+    Args:
+        alarm_score (int): Score above which alarm is set.
+    """
+
+    def __init__(self, alarm_score=ALARM_SCORE):
+        self.alarm_score = alarm_score
+        self.score = 0
+        self.rpred = None
+        self.lpred = None
+
+    def update(self, r_class, l_class):
+        """Takes the frame's eye classes (None for an eye not found) and returns whether both eyes count as closed."""
+        if r_class is not None:
+            self.rpred = r_class
+        if l_class is not None:
+            self.lpred = l_class
+        closed = self.rpred == 0 and self.lpred == 0
+        self.score = self.score + 1 if closed else max(0, self.score - 1)
+        return closed
+
+    @property
+    def alarm(self):
+        return self.score > self.alarm_score
+
+
+class DrowsinessDetector:
+    """
+    Runs the scripts' detection, classification and scoring on one frame
+    at a time and keeps the score between frames, so there is one per
+    video stream.
+
+    Args:
+        model: The Keras eye state model.
+        cascades (tuple): Face, left eye and right eye classifiers; loaded
+            from the repository's cascade files when not given.
+        eye_search (str): 'face' or 'frame', see eye_detection.py.
+        alarm_score (int): Score above which the alarm goes off.
+        classifier (EyeClassifier): Shared with other detectors, e.g. in one
+            process; made from model when not given.
+    """
+
+    def __init__(self, model, cascades=None, eye_search='face', alarm_score=ALARM_SCORE, classifier=None):
+        self.face, self.leye, self.reye = cascades or load_cascades()
+        self.eye_search = eye_search
+        self.classifier = classifier or EyeClassifier(model)
+        self.state = DrowsinessScore(alarm_score)
+
+    def process(self, frame):
+        """Returns the Analysis of a BGR frame, updating the score."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        faces = self.face.detectMultiScale(gray, minNeighbors=5, scaleFactor=1.1, minSize=(25, 25))
+        left_eye, right_eye = detect_eyes(gray, faces, self.leye, self.reye, self.eye_search)
+        r_class, l_class = self.classifier.classify(frame, right_eye, left_eye)
+        closed = self.state.update(r_class, l_class)
+        return Analysis(faces, left_eye, right_eye, closed, self.state.score, self.state.alarm)
@@ -0,0 +1,276 @@
+"""
+Headless drowsiness monitoring of many video streams.
+
+Takes any number of sources (video files, RTSP/HTTP URLs or camera
+numbers) and runs the detection, classification and score of the scripts
+(drowsiness.py) on each, with a score per stream. There is no window and
+no sound: when a stream's score goes over the threshold an event is
+written instead, one JSON object per line on stdout or to --events:
+
+    {"event": "alarm", "stream": 2, "source": "rtsp://cab2/live", "frame": 153, "score": 16, "time": 1718000000.12}
+
+Event types:
+    stream_started  the source was opened
+    alarm           the score went over --alarm-score ("snapshot": the
+                    frame as a JPEG in --snapshot-dir, if given)
+    alarm_cleared   the score came back down to --alarm-score
+    stream_ended    the source ended or the service stopped; with the
+                    frames read, processed and dropped, and the seconds run
+    stream_error    the source could not be opened or processing failed
+
+Streams are spread over a pool of --workers processes (one per core by
+default), each loading the model once and serving its streams in turn.
+Live sources are read by a thread per stream that keeps only the newest
+frame, so a busy worker skips frames instead of falling behind; video
+files are processed frame by frame. SIGINT/SIGTERM stop every stream.
+
+Usage:
+    python drowsiness_service.py SOURCE [SOURCE ...] [--model models/cnncat2.h5] [--workers N]
+                                 [--events events.jsonl] [--snapshot-dir alarms/]
+"""
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import SyncManager
+
+import cv2
+
+from drowsiness import ALARM_SCORE, DrowsinessDetector, load_cascades
+from eye_detection import EYE_SEARCH_MODES
+from pipeline import Frame, LatestFrame
+
+
+def ignore_stop_signals():
+    """
+    Initializer of the service's child processes. systemd and a kill of the
+    process group signal them too, which would end them without their
+    stream_ended events; the service process handles the signals instead.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def open_source(source):
+    """Returns a cv2.VideoCapture for a camera number, file or URL."""
+    return cv2.VideoCapture(int(source) if source.isdigit() else source)
+
+
+class Stream:
+    """
+    One video source with its own score state.
+
+    Args:
+        stream_id (int): Number of the stream in the service's sources.
+        source (str): Camera number, file or URL.
+        detector (DrowsinessDetector): The stream's detector.
+    """
+
+    def __init__(self, stream_id, source, detector):
+        self.stream_id = stream_id
+        self.source = source
+        self.detector = detector
+        self.live = not os.path.isfile(source)
+        self.cap = open_source(source)
+        if not self.cap.isOpened():
+            self.cap.release()
+            raise OSError(f"Could not open {source}")
+        self.read = 0
+        self.processed = 0
+        self.alarm = False
+        self.ended = False
+        self.started = time.monotonic()
+        self.frames = None
+        self._capture_thread = None
+        if self.live:
+            self.frames = LatestFrame()
+            self._capture_thread = threading.Thread(target=self._capture, name=f'capture_{stream_id}', daemon=True)
+            self._capture_thread.start()
+
+    def _capture(self):
+        try:
+            while not self.ended:
+                ret, image = self.cap.read()
+                if not ret:
+                    break
+                self.frames.put(Frame(self.read, time.monotonic(), image))
+                self.read += 1
+        finally:
+            self.frames.close()
+
+    def next_frame(self):
+        """Returns the next Frame to process, or None if there is none yet; sets ended once the source is done."""
+        if not self.live:
+            ret, image = self.cap.read()
+            if not ret:
+                self.ended = True
+                return None
+            self.read += 1
+            return Frame(self.read - 1, time.monotonic(), image)
+        frame = self.frames.get(timeout=0)
+        if frame is None and self.frames.closed:
+            self.ended = True
+        return frame
+
+    def close(self):
+        self.ended = True
+        if self._capture_thread is not None:
+            # Let the capture thread return from read() before the capture goes away
+            self._capture_thread.join(timeout=2.0)
+        self.cap.release()
+
+    @property
+    def dropped(self):
+        return self.frames.dropped if self.frames is not None else 0
+
+
+def monitor_streams(streams, options, events, stop_event):
+    """
+    Worker process: serves streams [(stream_id, source)] until they end or
+    stop_event is set, putting event dicts on events.
+    """
+    # Each worker keeps to its share of the cores
+    cv2.setNumThreads(options.threads)
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(options.threads)
+        tf.config.threading.set_inter_op_parallelism_threads(options.threads)
+    except (ImportError, RuntimeError):
+        # Not the backend, or already initialized in this process
+        pass
+    from keras.models import load_model
+    from eye_classifier import EyeClassifier
+
+    def emit(event, stream_id, source, **fields):
+        events.put(dict(event=event, stream=stream_id, source=source, time=time.time(), **fields))
+
+    model = load_model(options.model)
+    cascades = load_cascades()
+    # One compiled model and one set of cascades for every stream of this process
+    classifier = EyeClassifier(model)
+
+    active = []
+    for stream_id, source in streams:
+        try:
+            detector = DrowsinessDetector(model, cascades, options.eye_search, options.alarm_score, classifier=classifier)
+            stream = Stream(stream_id, source, detector)
+        except OSError as e:
+            emit('stream_error', stream_id, source, message=str(e))
+            continue
+        active.append(stream)
+        emit('stream_started', stream_id, source, live=stream.live)
+
+    def finish(stream):
+        stream.close()
+        emit('stream_ended', stream.stream_id, stream.source, frames=stream.read, processed=stream.processed, dropped=stream.dropped,
+             seconds=round(time.monotonic() - stream.started, 3))
+
+    try:
+        while active and not stop_event.is_set():
+            progressed = False
+            for stream in list(active):
+                try:
+                    frame = stream.next_frame()
+                    if frame is None:
+                        if stream.ended:
+                            active.remove(stream)
+                            finish(stream)
+                        continue
+                    progressed = True
+                    analysis = stream.detector.process(frame.image)
+                except Exception as e:
+                    active.remove(stream)
+                    emit('stream_error', stream.stream_id, stream.source, message=repr(e))
+                    finish(stream)
+                    continue
+                stream.processed += 1
+                if analysis.alarm and not stream.alarm:
+                    fields = {}
+                    if options.snapshot_dir:
+                        fields['snapshot'] = os.path.join(options.snapshot_dir, f"stream{stream.stream_id}_{frame.index}.jpg")
+                        cv2.imwrite(fields['snapshot'], frame.image)
+                    emit('alarm', stream.stream_id, stream.source, frame=frame.index, score=analysis.score, **fields)
+                elif stream.alarm and not analysis.alarm:
+                    emit('alarm_cleared', stream.stream_id, stream.source, frame=frame.index, score=analysis.score)
+                stream.alarm = analysis.alarm
+            if not progressed:
+                # Only live streams without a new frame yet
+                time.sleep(0.005)
+    finally:
+        for stream in active:
+            finish(stream)
+
+
+def run_service(sources, options, on_event, stop_event=None):
+    """
+    Monitors sources across options.workers processes, calling on_event
+    with each event dict, until every stream has ended or stop_event (a
+    threading.Event) is set.
+    """
+    workers = max(1, min(options.workers or os.cpu_count() or 1, len(sources)))
+    # spawn: TensorFlow's threads don't survive a fork
+    context = multiprocessing.get_context('spawn')
+    # The service process handles the signals and sets worker_stop
+    manager = SyncManager(ctx=context)
+    manager.start(ignore_stop_signals)
+    try:
+        events = manager.Queue()
+        worker_stop = manager.Event()
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=ignore_stop_signals) as pool:
+            futures = [pool.submit(monitor_streams, list(enumerate(sources))[w::workers], options, events, worker_stop)
+                       for w in range(workers)]
+            while True:
+                if stop_event is not None and stop_event.is_set():
+                    worker_stop.set()
+                try:
+                    on_event(events.get(timeout=0.2))
+                except queue.Empty:
+                    if all(future.done() for future in futures):
+                        break
+            while not events.empty():
+                on_event(events.get())
+            for future in futures:
+                future.result()
+    finally:
+        manager.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='+', help='Camera numbers, video files or stream URLs')
+    parser.add_argument('--model', default='models/cnncat2.h5')
+    parser.add_argument('--workers', type=int, default=0, help='Worker processes (0: one per core)')
+    parser.add_argument('--threads', type=int, default=1, help='OpenCV/TensorFlow threads per worker')
+    parser.add_argument('--eye-search', choices=EYE_SEARCH_MODES, default=os.getenv('EYE_SEARCH', 'face'))
+    parser.add_argument('--alarm-score', type=int, default=ALARM_SCORE)
+    parser.add_argument('--events', help='File to append events to (stdout when not given)')
+    parser.add_argument('--snapshot-dir', help='Directory for a JPEG of the frame that raised each alarm')
+    args = parser.parse_args()
+    args.model = os.path.abspath(args.model)
+    if args.snapshot_dir:
+        os.makedirs(args.snapshot_dir, exist_ok=True)
+
+    out = open(args.events, 'a') if args.events else sys.stdout
+
+    def write_event(event):
+        out.write(json.dumps(event) + '\n')
+        out.flush()
+
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop_event.set())
+    try:
+        run_service(args.sources, args, write_event, stop_event)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Pipelined runtime for drowsiness detection.
+
+The scripts read a frame, detect, classify, draw and show it one step
+after another, so the camera waits while the model runs and every frame
+the camera buffers meanwhile is stale by the time it is read. Here:
+
+    capture thread  reads the camera as fast as it delivers into a
+                    LatestFrame, which holds only the newest frame: one
+                    the worker hasn't taken yet is replaced (dropped)
+    worker thread   detection, classification and the score
+                    (drowsiness.py) on the newest frame; raises the alarm
+    main thread     draws and shows the newest result, unless --no-render
+
+So the frame the worker picks up is never older than one camera interval,
+and capture and drawing overlap with inference.
+
+Usage:
+    python pipeline.py [--source 0|video file|rtsp url] [--model models/cnncat2.h5]
+                       [--eye-search face|frame] [--no-render]
+"""
+import os
+import time
+import logging
+import argparse
+import threading
+from collections import namedtuple
+
+import cv2
+
+from drowsiness import DrowsinessDetector
+from eye_detection import EYE_SEARCH_MODES
+
+logger = logging.getLogger(__name__)
+
+# A frame as read: its number in the capture, the time it was read and the image
+Frame = namedtuple('Frame', 'index captured image')
+
+# A processed frame and the time its Analysis was ready
+Result = namedtuple('Result', 'frame analysis decided')
+
+
+class LatestFrame:
+    """
+    Buffer of one item: put() replaces an item nobody has taken yet, so
+    get() always returns the newest. Replaced items are counted in dropped.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Returns the newest item, waiting up to timeout; None on timeout or once closed and empty."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._item is not None or self._closed, timeout)
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        """Whether close() was called; get() may still return the last item put."""
+        return self._closed
+
+
+class Renderer:
+    """The scripts' overlay: face boxes, eye state, score and, during an alarm, a pulsing red border."""
+
+    def __init__(self, alarm_image=None):
+        self.alarm_image = alarm_image
+        self.font = cv2.FONT_HERSHEY_COMPLEX_SMALL
+        self.thicc = 2
+
+    def draw(self, frame, analysis):
+        height, width = frame.shape[:2]
+        cv2.rectangle(frame, (0, height - 50), (200, height), (0, 0, 0), thickness=cv2.FILLED)
+        for (x, y, w, h) in analysis.faces:
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (100, 100, 100), 1)
+        state = "Closed" if analysis.closed else "Open"
+        cv2.putText(frame, state, (10, height - 20), self.font, 1, (255, 255, 255), 1, cv2.LINE_AA)
+        cv2.putText(frame, 'Score:' + str(analysis.score), (100, height - 20), self.font, 1, (255, 255, 255), 1, cv2.LINE_AA)
+        if analysis.alarm:
+            if self.alarm_image:
+                cv2.imwrite(self.alarm_image, frame)
+            if self.thicc < 16:
+                self.thicc += 2
+            else:
+                self.thicc = max(2, self.thicc - 2)
+            cv2.rectangle(frame, (0, 0), (width, height), (0, 0, 255), self.thicc)
+        return frame
+
+
+class DrowsinessPipeline:
+    """
+    Runs capture and processing in their own threads and, optionally,
+    shows the results.
+
+    Args:
+        cap: Anything with cv2.VideoCapture's read(), e.g. one.
+        detector (DrowsinessDetector): Processing and score state.
+        render (bool): Draw and show the results in a window.
+        on_alarm (callable): Called with the Result of each frame that has
+            the alarm on, from the worker thread.
+        on_result (callable): Called with every Result, from the worker thread.
+        renderer (Renderer): Overlay to draw; the scripts' when not given.
+    """
+
+    def __init__(self, cap, detector, render=True, on_alarm=None, on_result=None, renderer=None):
+        self.cap = cap
+        self.detector = detector
+        self.render = render
+        self.on_alarm = on_alarm
+        self.on_result = on_result
+        self.renderer = renderer or Renderer()
+        self.frames = LatestFrame()
+        self.results = LatestFrame()
+        self.stop_event = threading.Event()
+        self.captured = 0
+        self.processed = 0
+        self._threads = [
+            threading.Thread(target=self._capture, name='capture', daemon=True),
+            threading.Thread(target=self._work, name='worker', daemon=True),
+        ]
+
+    def _capture(self):
+        try:
+            while not self.stop_event.is_set():
+                ret, image = self.cap.read()
+                if not ret:
+                    break
+                self.frames.put(Frame(self.captured, time.monotonic(), image))
+                self.captured += 1
+        finally:
+            self.frames.close()
+
+    def _work(self):
+        try:
+            while not self.stop_event.is_set():
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                analysis = self.detector.process(frame.image)
+                result = Result(frame, analysis, time.monotonic())
+                self.processed += 1
+                if analysis.alarm and self.on_alarm is not None:
+                    self.on_alarm(result)
+                if self.on_result is not None:
+                    self.on_result(result)
+                if self.render:
+                    self.results.put(result)
+        except Exception:
+            logger.exception("Processing failed, stopping the pipeline")
+        finally:
+            # Without a worker the capture thread would read a live camera forever
+            self.stop()
+            self.results.close()
+
+    def _show(self):
+        # imshow/waitKey stay in the main thread, where every GUI backend allows them
+        while True:
+            result = self.results.get()
+            if result is None:
+                break
+            cv2.imshow('frame', self.renderer.draw(result.frame.image, result.analysis))
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                self.stop()
+                break
+        cv2.destroyAllWindows()
+
+    def run(self):
+        """Processes frames until the source ends, 'q' is pressed or stop() is called."""
+        for thread in self._threads:
+            thread.start()
+        if self.render:
+            self._show()
+        for thread in self._threads:
+            thread.join()
+
+    def stop(self):
+        self.stop_event.set()
+        self.frames.close()
+
+    def join(self, timeout=None):
+        """Waits up to timeout per thread for the capture and worker threads to return, e.g. after stop()."""
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join(timeout)
+
+    @property
+    def dropped(self):
+        return self.frames.dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default='0', help='Camera number, video file or stream URL')
+    parser.add_argument('--model', default='models/cnncat2.h5')
+    parser.add_argument('--eye-search', choices=EYE_SEARCH_MODES, default=os.getenv('EYE_SEARCH', 'face'))
+    parser.add_argument('--no-render', dest='render', action='store_false', help='Run without a window')
+    args = parser.parse_args()
+
+    from keras.models import load_model
+    from pygame import mixer
+
+    mixer.init()
+    sound = mixer.Sound('alarm.wav')
+
+    def alarm(result):
+        try:
+            sound.play()
+        except Exception:
+            pass
+
+    cap = cv2.VideoCapture(int(args.source) if args.source.isdigit() else args.source)
+    detector = DrowsinessDetector(load_model(args.model), eye_search=args.eye_search)
+    pipeline = DrowsinessPipeline(cap, detector, render=args.render, on_alarm=alarm,
+                                  renderer=Renderer(os.path.join(os.getcwd(), 'image.jpg')))
+    try:
+        pipeline.run()
+    except KeyboardInterrupt:
+        pipeline.stop()
+        # Let the capture thread return from read() before the capture goes away
+        pipeline.join(timeout=2.0)
+    finally:
+        cap.release()
+    print(f"{pipeline.captured} frames captured, {pipeline.processed} processed, {pipeline.dropped} dropped as stale")
+
+
+if __name__ == "__main__":
+    main()
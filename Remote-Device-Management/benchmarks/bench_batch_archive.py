@@ -0,0 +1,114 @@
+"""
+Throughput and bytes-on-wire of archive uploads (N batches per gzip tar
+object) against one S3 object per batch.
+
+Requests and request body bytes are counted with a botocore before-send
+hook while uploading to a local moto S3 server. Requires `moto[server]`.
+
+Usage:
+    python benchmarks/bench_batch_archive.py [--batches 60] [--per-archive 10]
+"""
+import argparse
+import glob
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SAMPLE_BATCHES = os.path.join(ROOT, 'data', 'raw', 'ADC_Batches')
+sys.path.insert(0, os.path.join(ROOT, 'src', 'modules'))
+
+from moto.server import ThreadedMotoServer
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_batches(directory, count):
+    samples = sorted(glob.glob(os.path.join(SAMPLE_BATCHES, '*.csv')))
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"BFA1_Batch{i + 1}_2025-03-13_14-{i // 60 % 60:02d}-{i % 60:02d}.csv")
+        shutil.copyfile(samples[i % len(samples)], path)
+        paths.append(path)
+    return paths
+
+
+class WireCounter:
+    """Counts S3 requests and request body bytes sent by a client."""
+
+    def __init__(self, client):
+        self.requests = 0
+        self.body_bytes = 0
+        client.meta.events.register('before-send.s3.*', self)
+
+    def __call__(self, request, **kwargs):
+        self.requests += 1
+        self.body_bytes += int(request.headers.get('Content-Length') or 0)
+
+
+def run(paths, per_archive, staging_dir):
+    from s3_uploader import S3Uploader
+    from batch_archiver import BatchArchiver
+
+    uploader = S3Uploader(os.environ['S3_BUCKET_NAME'], max_workers=4)
+    uploader.ensure_folders()
+    counter = WireCounter(uploader.client)
+
+    start = time.perf_counter()
+    if per_archive:
+        archiver = BatchArchiver(uploader, staging_dir, max_batches=per_archive)
+        futures = [archiver.add(path) for path in paths] + [archiver.flush()]
+    else:
+        futures = [uploader.submit(path) for path in paths]
+    ok = all(f.result() for f in futures if f is not None)
+    uploader.shutdown()
+    elapsed = time.perf_counter() - start
+    assert ok, "upload failed"
+    return elapsed, counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batches', type=int, default=60)
+    parser.add_argument('--per-archive', type=int, default=10)
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    port = free_port()
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix='bench_archive_')
+    os.environ.update({
+        'AWS_ENDPOINT_URL': f'http://127.0.0.1:{port}',
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'AWS_REGION': 'us-east-1',
+        'S3_BUCKET_NAME': 'bench-datalogger',
+    })
+    try:
+        import boto3
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=os.environ['S3_BUCKET_NAME'])
+        paths = make_batches(workdir, args.batches)
+        raw_bytes = sum(os.path.getsize(p) for p in paths)
+        print(f"{args.batches} batches, {raw_bytes / 1024:.0f} KiB of CSV")
+
+        for label, per_archive in (("one object per batch", 0), (f"archive of {args.per_archive}", args.per_archive)):
+            elapsed, counter = run(paths, per_archive, os.path.join(workdir, 'staging'))
+            print(f"{label:>22}: {args.batches / elapsed:8.1f} batches/s, "
+                  f"{counter.requests:4d} requests, {counter.body_bytes / 1024:8.0f} KiB sent "
+                  f"({100 * counter.body_bytes / raw_bytes:5.1f}% of raw)")
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Startup cost of finding the next batch number: listing and regex-matching the
+batch directory (the old get_last_batch_number) against one lookup in the
+batch catalog.
+
+Usage:
+    python benchmarks/bench_batch_catalog.py [--batches 20000 50000 100000] [--repeat 5]
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src', 'modules'))
+
+from batch_catalog import BatchCatalog
+
+
+def scan_last_batch_number(output_folder):
+    # The directory scan adc_batch_generation.py did on every start
+    batch_numbers = []
+    for file_name in os.listdir(output_folder):
+        match = re.search(r"BFA1_Batch(\d+)_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}\.csv", file_name)
+        if match:
+            batch_numbers.append(int(match.group(1)))
+    return max(batch_numbers) if batch_numbers else 0
+
+
+def make_batches(directory, count):
+    for n in range(1, count + 1):
+        # Empty files: only the directory entries matter for the scan
+        open(os.path.join(directory, f"BFA1_Batch{n}_2024-11-20_12-{n // 60 % 60:02d}-{n % 60:02d}.csv"), 'w').close()
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batches', type=int, nargs='+', default=[20000, 50000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'batches':>8}  {'dir scan':>10}  {'import':>10}  {'catalog':>10}  {'speedup':>8}")
+    for count in args.batches:
+        workdir = tempfile.mkdtemp(prefix='bench_catalog_')
+        try:
+            batch_dir = os.path.join(workdir, 'ADC_Batches')
+            os.makedirs(batch_dir)
+            make_batches(batch_dir, count)
+
+            scan_time, scanned = timed(lambda: scan_last_batch_number(batch_dir), args.repeat)
+
+            catalog = BatchCatalog(os.path.join(workdir, 'catalog.sqlite3'))
+            start = time.perf_counter()
+            catalog.import_directory(batch_dir)
+            import_time = time.perf_counter() - start
+            catalog.close()
+
+            # A fresh process opens the catalog and looks up one row
+            def lookup():
+                c = BatchCatalog(os.path.join(workdir, 'catalog.sqlite3'))
+                try:
+                    return c.last_batch_number("BFA1")
+                finally:
+                    c.close()
+
+            lookup_time, looked_up = timed(lookup, args.repeat)
+            if scanned != looked_up:
+                print(f"Mismatch: scan found {scanned}, catalog has {looked_up}", file=sys.stderr)
+                sys.exit(1)
+            print(f"{count:>8}  {scan_time * 1e3:>8.1f}ms  {import_time * 1e3:>8.1f}ms  "
+                  f"{lookup_time * 1e3:>8.2f}ms  {scan_time / lookup_time:>7.0f}x")
+        finally:
+            shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Size and parse time of the binary .adcb batch format against the text CSV
+batches in data/raw/ADC_Batches.
+
+Usage:
+    python benchmarks/bench_batch_format.py [--repeat 20]
+"""
+import argparse
+import csv
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SAMPLE_BATCHES = os.path.join(ROOT, 'data', 'raw', 'ADC_Batches')
+sys.path.insert(0, os.path.join(ROOT, 'src', 'modules'))
+
+import numpy as np
+from batch_format import csv_to_batch, read_batch, parse_csv_timestamps
+
+
+def parse_csv(path):
+    # What a downstream consumer has to do to get numbers out of a CSV batch
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        rows = list(reader)
+    timestamps = parse_csv_timestamps([r[0] for r in rows], tz='UTC')
+    voltages = np.array([r[1] for r in rows], dtype=np.float32)
+    return float(voltages.sum()) + float(timestamps[-1])
+
+
+def parse_binary(path):
+    _, timestamps, voltages = read_batch(path, mmap=True)
+    return float(voltages.sum()) + float(timestamps[-1])
+
+
+def timed(fn, paths, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            fn(path)
+    return (time.perf_counter() - start) / (repeat * len(paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    csv_paths = sorted(glob.glob(os.path.join(SAMPLE_BATCHES, '*.csv')))
+    workdir = tempfile.mkdtemp(prefix='bench_format_')
+    try:
+        binary_paths = [csv_to_batch(p, os.path.join(workdir, os.path.basename(p)[:-4] + '.adcb'), tz='UTC') for p in csv_paths]
+        samples = sum(read_batch(p)[0]["count"] for p in binary_paths)
+        csv_bytes = sum(os.path.getsize(p) for p in csv_paths)
+        binary_bytes = sum(os.path.getsize(p) for p in binary_paths)
+
+        print(f"{len(csv_paths)} batches, {samples} samples")
+        print(f"   csv: {csv_bytes / samples:6.2f} bytes/sample, {1000 * timed(parse_csv, csv_paths, args.repeat):7.3f} ms/batch to parse")
+        print(f"binary: {binary_bytes / samples:6.2f} bytes/sample, {1000 * timed(parse_binary, binary_paths, args.repeat):7.3f} ms/batch to parse")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Achievable sample rate of single-shot vs continuous-conversion acquisition,
+against a simulated ADS1015 so no I2C hardware is needed.
+
+The simulated converter free-runs at --data-rate. A single-shot read costs
+--single-read seconds (config write, conversion, ready polling, result read);
+a continuous-mode read is one fast conversion-register read costing
+--fast-read seconds. Each read returns the index of the latest completed
+conversion so repeated conversions can be counted.
+
+Usage:
+    python benchmarks/bench_continuous.py [--rates 100 500 1000 2000] [--samples 3000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+import numpy as np
+from adc_sampler import BatchSampler, ContinuousBackend, SingleShotBackend, ADS_MODE_SINGLE
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class SimulatedADS1015:
+    def __init__(self, data_rate):
+        self.data_rate = data_rate
+        self.mode = ADS_MODE_SINGLE
+        self.t0 = time.perf_counter()
+
+    def latest_conversion(self):
+        return int((time.perf_counter() - self.t0) * self.data_rate)
+
+
+class SimulatedAnalogIn:
+    def __init__(self, ads, single_read, fast_read):
+        self.ads = ads
+        self.single_read = single_read
+        self.fast_read = fast_read
+
+    @property
+    def voltage(self):
+        busy_wait(self.fast_read if self.ads.mode != ADS_MODE_SINGLE else self.single_read)
+        return float(self.ads.latest_conversion())
+
+
+def measure(backend, samples):
+    sampler = BatchSampler(backend, samples)
+    buffer = sampler.new_buffer()
+    backend.start()
+    start = time.perf_counter()
+    sampler.fill(buffer)
+    elapsed = time.perf_counter() - start
+    backend.stop()
+    unique = len(np.unique(buffer.voltages[:buffer.count]))
+    return samples / elapsed, unique / samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rates', type=float, nargs='+', default=[100, 500, 1000, 2000])
+    parser.add_argument('--samples', type=int, default=3000)
+    parser.add_argument('--data-rate', type=int, default=3300)
+    parser.add_argument('--single-read', type=float, default=0.001)
+    parser.add_argument('--fast-read', type=float, default=0.00015)
+    args = parser.parse_args()
+
+    ads = SimulatedADS1015(args.data_rate)
+    chan = SimulatedAnalogIn(ads, args.single_read, args.fast_read)
+    print(f"{'target Hz':>10} {'single-shot Hz':>15} {'continuous Hz':>14} {'distinct conversions':>21}")
+    for rate in args.rates:
+        single_rate, _ = measure(SingleShotBackend(chan, 1.0 / rate), args.samples)
+        continuous_rate, distinct = measure(ContinuousBackend(ads, chan, sample_rate=rate), args.samples)
+        print(f"{rate:10.0f} {single_rate:15.1f} {continuous_rate:14.1f} {100 * distinct:20.1f}%")
+
+
+if __name__ == '__main__':
+    main()
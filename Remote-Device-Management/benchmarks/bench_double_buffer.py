@@ -0,0 +1,83 @@
+"""
+Checks that DoubleBufferedSampler produces gap-free batches against a
+simulated ADC, and shows the gap the old write-inline loop leaves.
+
+The writer sleeps for --write-delay seconds per batch to stand in for the
+CSV write, the .env set_key and the queue put. For every batch boundary the
+gap between the last sample of batch k and the first sample of batch k+1 is
+compared with the sampling interval. Exits with status 1 if the
+double-buffered sampler leaves any gap longer than --tolerance intervals.
+
+Usage:
+    python benchmarks/bench_double_buffer.py [--batches 5] [--batch-size 300] [--write-delay 0.2]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+import numpy as np
+from adc_sampler import BatchSampler, DoubleBufferedSampler, SimulatedChannel
+
+
+def boundary_gaps(bounds):
+    # bounds: [(first, last), ...] wall timestamps per batch
+    return np.array([bounds[i + 1][0] - bounds[i][1] for i in range(len(bounds) - 1)])
+
+
+def run_inline(sampler, batches, write_delay):
+    buffer = sampler.new_buffer()
+    bounds = []
+    next_deadline = None
+    for _ in range(batches):
+        next_deadline = sampler.fill(buffer, next_deadline)
+        wall = buffer.wall_timestamps()
+        bounds.append((wall[0], wall[-1]))
+        time.sleep(write_delay)
+    return boundary_gaps(bounds)
+
+
+def run_double_buffered(sampler, batches, write_delay, buffers):
+    bounds = []
+
+    def writer(buffer):
+        wall = buffer.wall_timestamps()
+        bounds.append((wall[0], wall[-1]))
+        time.sleep(write_delay)
+        if len(bounds) >= batches:
+            acquisition.stop()
+
+    acquisition = DoubleBufferedSampler(sampler, writer, buffers=buffers)
+    acquisition.run()
+    return boundary_gaps(bounds[:batches])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batches', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=300)
+    parser.add_argument('--interval', type=float, default=0.01)
+    parser.add_argument('--write-delay', type=float, default=0.2)
+    parser.add_argument('--buffers', type=int, default=2)
+    parser.add_argument('--tolerance', type=float, default=2.0, help='Allowed gap, in sampling intervals')
+    args = parser.parse_args()
+
+    sampler = BatchSampler(SimulatedChannel(read_delay=0.0005), args.batch_size, args.interval)
+    interval_ms = args.interval * 1000
+
+    inline = run_inline(sampler, args.batches, args.write_delay) * 1000
+    print(f"   write inline: boundary gap max {inline.max():8.2f} ms (interval {interval_ms:.1f} ms)")
+
+    double = run_double_buffered(sampler, args.batches, args.write_delay, args.buffers) * 1000
+    print(f"double-buffered: boundary gap max {double.max():8.2f} ms (interval {interval_ms:.1f} ms)")
+
+    if double.max() > args.tolerance * interval_ms:
+        print(f"FAIL: double-buffered gap exceeds {args.tolerance} sampling intervals")
+        sys.exit(1)
+    print("OK: double-buffered batches are gap-free")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Throughput of the batch summary stage (batch_summary.py) on the recorded
+batches in data/raw/ADC_Batches.
+
+Each CSV is also converted to the binary format, and both are summarized
+--loops times. Reported per format: time to load a batch, time to summarize
+it (decimation + envelope + stats), batches/s and samples/s end to end, and
+the summary's size against the batch it replaces in the upload.
+
+Usage:
+    python benchmarks/bench_downsampling.py [--loops 200] [--rate 10] [--window 1.0]
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SAMPLE_BATCHES = os.path.join(ROOT, 'data', 'raw', 'ADC_Batches')
+sys.path.insert(0, os.path.join(ROOT, 'src', 'modules'))
+
+from batch_format import csv_to_batch, load_batch
+from batch_summary import summarize, summarize_batch
+
+
+def measure(paths, loops, options):
+    load_time = summarize_time = 0.0
+    samples = 0
+    for _ in range(loops):
+        for path in paths:
+            start = time.perf_counter()
+            timestamps, voltages = load_batch(path)
+            loaded = time.perf_counter()
+            summarize(timestamps, voltages, **options)
+            summarize_time += time.perf_counter() - loaded
+            load_time += loaded - start
+            samples += len(voltages)
+    return load_time, summarize_time, samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--loops', type=int, default=200, help='Times each batch is summarized')
+    parser.add_argument('--rate', type=float, default=10.0, help='Decimated rate in Hz')
+    parser.add_argument('--window', type=float, default=1.0, help='Envelope window in seconds')
+    args = parser.parse_args()
+    options = {"target_rate": args.rate, "envelope_window": args.window}
+
+    csv_paths = sorted(glob.glob(os.path.join(SAMPLE_BATCHES, '*.csv')))
+    if not csv_paths:
+        sys.exit(f"No sample batches in {SAMPLE_BATCHES}")
+    workdir = tempfile.mkdtemp(prefix='bench_downsampling_')
+    try:
+        binary_paths = [csv_to_batch(p, os.path.join(workdir, os.path.basename(p)[:-4] + '.adcb')) for p in csv_paths]
+
+        print(f"{len(csv_paths)} batches, {args.loops} loops, decimated to {args.rate:g} Hz, {args.window:g} s envelope")
+        print(f"{'format':>6} {'load ms':>8} {'summ. ms':>9} {'batches/s':>10} {'samples/s':>12}")
+        for label, paths in (("csv", csv_paths), ("adcb", binary_paths)):
+            load_time, summarize_time, samples = measure(paths, args.loops, options)
+            calls = len(paths) * args.loops
+            total = load_time + summarize_time
+            print(f"{label:>6} {load_time / calls * 1e3:>8.3f} {summarize_time / calls * 1e3:>9.3f} "
+                  f"{calls / total:>10,.0f} {samples / total:>12,.0f}")
+
+        csv_bytes = sum(os.path.getsize(p) for p in csv_paths)
+        binary_bytes = sum(os.path.getsize(p) for p in binary_paths)
+        summary_bytes = sum(len(json.dumps(summarize_batch(p, **options), separators=(',', ':'))) for p in binary_paths)
+        print(f"\nupload size per batch: csv {csv_bytes / len(csv_paths):,.0f} B, adcb {binary_bytes / len(csv_paths):,.0f} B, "
+              f"summary {summary_bytes / len(csv_paths):,.0f} B ({csv_bytes / summary_bytes:.0f}x smaller than csv)")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
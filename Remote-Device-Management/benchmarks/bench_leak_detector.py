@@ -0,0 +1,103 @@
+"""
+Throughput and detection latency of the streaming NPW leak detector on the
+recorded batches in data/raw/ADC_Batches.
+
+The CSVs are replayed back to back on a continuous 100 Hz time grid (--loops
+times) and fed to the detector the way adc_batch_generation.py does, one
+3000-sample batch per call, and in 64-sample acquisition blocks:
+
+    throughput   samples/s and time per batch call
+    clean        detections on the recorded data, which has no leaks
+    injected     pressure drops of several sizes added at known samples;
+                 detection latency is from the drop's onset to the sample
+                 the detector flags it at
+
+Usage:
+    python benchmarks/bench_leak_detector.py [--loops 20] [--drops 0.03 0.05 0.1 0.2]
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SAMPLE_BATCHES = os.path.join(ROOT, 'data', 'raw', 'ADC_Batches')
+sys.path.insert(0, os.path.join(ROOT, 'src', 'modules'))
+
+from leak_detector import NPWDetector, BatchClassifier
+
+SAMPLE_RATE = 100.0
+BATCH_SIZE = 3000
+
+
+def load_voltages():
+    voltages = []
+    for path in sorted(glob.glob(os.path.join(SAMPLE_BATCHES, '*.csv'))):
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            voltages.append(np.array([float(row[1]) for row in reader]))
+    return np.concatenate(voltages)
+
+
+def replay(voltages, block_size):
+    classifier = BatchClassifier(NPWDetector(SAMPLE_RATE))
+    timestamps = np.arange(len(voltages)) / SAMPLE_RATE
+    flagged = []
+    start = time.perf_counter()
+    for i in range(0, len(voltages), block_size):
+        _, detections = classifier.classify(timestamps[i:i + block_size], voltages[i:i + block_size])
+        flagged += [i + d.index for d in detections]
+    return time.perf_counter() - start, flagged
+
+
+def inject(voltages, onset, amplitude, fall_time=0.05):
+    # Sharp pressure drop that then holds, as a leak opening does
+    out = voltages.copy()
+    t = np.arange(len(out) - onset) / SAMPLE_RATE
+    out[onset:] -= amplitude * (1 - np.exp(-t / fall_time))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--loops', type=int, default=20, help='Times the recorded batches are replayed')
+    parser.add_argument('--drops', type=float, nargs='+', default=[0.03, 0.05, 0.1, 0.2], help='Injected drops in volts')
+    parser.add_argument('--trials', type=int, default=10, help='Injections per drop size')
+    args = parser.parse_args()
+
+    recorded = load_voltages()
+    stream = np.tile(recorded, args.loops)
+    print(f"{len(recorded)} recorded samples, replayed {args.loops}x = {len(stream)} samples ({len(stream) / SAMPLE_RATE / 3600:.1f} h at 100 Hz)")
+
+    for block_size in (BATCH_SIZE, 64):
+        elapsed, flagged = replay(stream, block_size)
+        calls = -(-len(stream) // block_size)
+        print(f"block {block_size:>5}: {len(stream) / elapsed:>12,.0f} samples/s, {elapsed / calls * 1e3:.3f} ms per call, "
+              f"{len(flagged)} detections on clean data")
+
+    print(f"\n{'drop (V)':>8} {'detected':>9} {'latency p50':>12} {'latency max':>12}")
+    rng = np.random.default_rng(0)
+    base = stream[:len(recorded) * 3]
+    for amplitude in args.drops:
+        latencies = []
+        for _ in range(args.trials):
+            # After the detector's 20 s warm-up, away from the end of the stream
+            onset = int(rng.integers(int(30 * SAMPLE_RATE), len(base) - int(60 * SAMPLE_RATE)))
+            _, flagged = replay(inject(base, onset, amplitude), BATCH_SIZE)
+            hits = [f for f in flagged if 0 <= f - onset < 10 * SAMPLE_RATE]
+            if hits:
+                latencies.append((hits[0] - onset) / SAMPLE_RATE * 1e3)
+        detected = f"{len(latencies)}/{args.trials}"
+        if latencies:
+            print(f"{amplitude:>8.3f} {detected:>9} {np.median(latencies):>10.0f}ms {max(latencies):>10.0f}ms")
+        else:
+            print(f"{amplitude:>8.3f} {detected:>9} {'-':>12} {'-':>12}")
+
+
+if __name__ == "__main__":
+    main()
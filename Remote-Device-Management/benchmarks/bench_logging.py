@@ -0,0 +1,108 @@
+"""
+Per-call cost of logging inside the ADC sampling loop.
+
+A stand-in sampling loop (a few array writes per sample, as
+adc_sampler.BatchSampler does) makes a logging call every --every samples
+and times each call. Configurations:
+
+    disabled  logger.debug() below the logger's level
+    sync      logging.FileHandler on the service logger (the old setup):
+              the record is formatted and written in the sampling thread
+    shared    log_setup.setup_logging(): QueueHandler on the root logger,
+              formatted and written by the QueueListener thread
+
+Each is run with a normal disk and with --disk-latency-ms added to every
+write, standing in for an SD card stalled on writeback. Reported: mean,
+p99 and max time per call, and the slowest sampling iteration.
+
+Usage:
+    python benchmarks/bench_logging.py [--samples 200000] [--every 100] [--disk-latency-ms 5]
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+import log_setup
+
+
+def slow(handler, latency):
+    # Adds a fixed delay to every write the handler makes
+    if latency:
+        emit = handler.emit
+
+        def delayed(record):
+            time.sleep(latency)
+            emit(record)
+        handler.emit = delayed
+    return handler
+
+
+def sampling_loop(log_call, samples, every):
+    voltages = np.zeros(3000, dtype=np.float32)
+    timestamps = np.zeros(3000)
+    call_times = []
+    slowest = 0
+    for i in range(samples):
+        start = time.perf_counter_ns()
+        j = i % 3000
+        voltages[j] = 0.6
+        timestamps[j] = start
+        if i % every == 0:
+            call_start = time.perf_counter_ns()
+            log_call(i)
+            call_times.append(time.perf_counter_ns() - call_start)
+        slowest = max(slowest, time.perf_counter_ns() - start)
+    return np.array(call_times), slowest
+
+
+def report(label, latency_ms, call_times, slowest):
+    print(f"{label:>9} {latency_ms:>7.1f} {call_times.mean() / 1e3:>9.2f} {np.percentile(call_times, 99) / 1e3:>9.2f} "
+          f"{call_times.max() / 1e3:>10.1f} {slowest / 1e3:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=200000)
+    parser.add_argument('--every', type=int, default=100, help='Samples between logging calls')
+    parser.add_argument('--disk-latency-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_logging_')
+    try:
+        print(f"{args.samples} samples, a logging call every {args.every}")
+        print(f"{'config':>9} {'disk ms':>7} {'mean us':>9} {'p99 us':>9} {'max us':>10} {'slowest it.':>12}")
+        for latency_ms in (0.0, args.disk_latency_ms):
+            latency = latency_ms / 1e3
+
+            logger = logging.getLogger(f'bench_sync_{latency_ms}')
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            report('disabled', latency_ms, *sampling_loop(lambda i: logger.debug("sample %d", i), args.samples, args.every))
+
+            handler = slow(logging.FileHandler(os.path.join(workdir, f'sync_{latency_ms}.log')), latency)
+            handler.setFormatter(logging.Formatter(log_setup.TEXT_FORMAT))
+            logger.addHandler(handler)
+            report('sync', latency_ms, *sampling_loop(lambda i: logger.info("sample %d", i), args.samples, args.every))
+            logger.removeHandler(handler)
+            handler.close()
+
+            os.environ['LOG_DIRECTORY'] = workdir
+            shared = log_setup.setup_logging(f'bench_shared_{latency_ms}', f'shared_{latency_ms}.log')
+            for h in log_setup._listener.handlers:
+                slow(h, latency)
+            report('shared', latency_ms, *sampling_loop(lambda i: shared.info("sample %d", i), args.samples, args.every))
+            log_setup.stop_logging()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Overhead of the metrics registry (metrics.py) and whether exposing it
+disturbs the 10 ms sampling loop.
+
+Part 1 times each operation the services make: counter inc, histogram
+observe, a timer() block, observe_many() over a batch's sample intervals,
+the same updates from --threads threads at once, and render() of the
+registry with every service module's metrics defined.
+
+Part 2 runs DoubleBufferedSampler against a simulated single-shot ADC at
+--interval, alternating --rounds times between two configurations of
+--seconds each (alternating, so load from the rest of the machine falls on
+both alike):
+
+    off   the writer formats and writes each batch as CSV
+    on    the writer also makes adc_batch_generation's metric updates, and
+          another process scrapes the HTTP endpoint every --scrape-interval
+          (far more often than Prometheus would) while a snapshot file is
+          rewritten every second
+
+and reports how far the sample intervals stray from --interval (p50, p90,
+p99, max). Exits 1 if 'on' adds more than --tolerance-us to the median; the
+tail is reported but not checked, since on a busy or single-core machine
+it is set by the scheduler rather than by either configuration.
+
+Usage:
+    python benchmarks/bench_metrics.py [--rounds 4] [--seconds 10] [--interval 0.01] [--scrape-interval 0.1]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+import numpy as np
+import metrics
+from adc_sampler import BatchSampler, DoubleBufferedSampler, SimulatedChannel, SingleShotBackend
+# Define the metrics of the instrumented library modules, as a service process would
+import queue_consumer, spool_queue, s3_uploader, resumable_upload, publish_pipeline  # noqa: F401
+
+
+def per_call(func, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - start) / n
+
+
+def timer_block(histogram):
+    with histogram.timer():
+        pass
+
+
+def contended(func, n, threads):
+    # Wall time per call with `threads` threads calling func together
+    workers = [threading.Thread(target=lambda: [func() for _ in range(n)]) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return (time.perf_counter() - start) / (n * threads)
+
+
+def operation_costs(n, threads, batch_size):
+    registry = metrics.REGISTRY
+    counter = registry.counter('bench_ops_total', 'Benchmark counter')
+    histogram = registry.histogram('bench_seconds', 'Benchmark histogram')
+    # The rest of adc_batch_generation's metrics, so render() sees a full service registry
+    for name in ('write', 'classify', 'event_publish', 'latency'):
+        registry.histogram(f'bench_adc_{name}_seconds', 'Stand-in ADC histogram').observe(0.01)
+    registry.gauge('queue_depth', 'Events waiting', {"queue": "s3_events"}, func=lambda: 3)
+    intervals = np.abs(np.random.default_rng(1).normal(0, 2e-4, batch_size))
+
+    print(f"{'operation':>28} {'us/call':>9}")
+    rows = [
+        ("counter.inc()", per_call(counter.inc, n)),
+        ("histogram.observe()", per_call(lambda: histogram.observe(0.003), n)),
+        ("with histogram.timer()", per_call(lambda: timer_block(histogram), n)),
+        (f"observe_many({batch_size})", per_call(lambda: histogram.observe_many(intervals), max(1, n // 100))),
+        (f"counter.inc(), {threads} threads", contended(counter.inc, n // threads, threads)),
+        (f"observe(), {threads} threads", contended(lambda: histogram.observe(0.003), n // threads, threads)),
+    ]
+    text = registry.render()
+    rows.append((f"render() {len(text.splitlines())} lines", per_call(registry.render, max(1, n // 1000))))
+    for label, seconds in rows:
+        print(f"{label:>28} {seconds * 1e6:>9.3f}")
+
+
+SCRAPER = """
+import sys, time, urllib.request
+url, interval, until = sys.argv[1], float(sys.argv[2]), time.time() + float(sys.argv[3])
+scrapes = 0
+while time.time() < until:
+    time.sleep(interval)
+    try:
+        urllib.request.urlopen(url).read()
+        scrapes += 1
+    except OSError:
+        break
+print(scrapes)
+"""
+
+
+def sampling_run(seconds, interval, batch_size, workdir, instrumented, scrape_interval):
+    backend = SingleShotBackend(SimulatedChannel(), interval)
+    sampler = BatchSampler(backend, batch_size)
+    intervals = []
+    batches = int(seconds / (interval * batch_size))
+    registry = metrics.REGISTRY
+    write_seconds = registry.histogram('bench_batch_write_seconds', 'Stand-in batch write time')
+    jitter = registry.histogram('bench_sample_jitter_seconds', 'Stand-in sample jitter',
+                                buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1))
+    written = registry.counter('bench_batches_total', 'Stand-in batches')
+
+    def writer(buffer):
+        timestamps = buffer.timestamps[:buffer.count].copy()
+        intervals.append(np.diff(timestamps))
+        path = os.path.join(workdir, f"batch{len(intervals)}.csv")
+        if instrumented:
+            jitter.observe_many(np.abs(np.diff(timestamps) - interval))
+            with write_seconds.timer():
+                buffer.write_csv(path)
+            written.inc()
+        else:
+            buffer.write_csv(path)
+        if len(intervals) >= batches:
+            acquisition.stop()
+
+    acquisition = DoubleBufferedSampler(sampler, writer)
+    exporter = scraper = None
+    if instrumented:
+        exporter = metrics.MetricsExporter(registry, port=0, snapshot_file=os.path.join(workdir, 'adc.prom'), interval=1.0)
+        url = f"http://127.0.0.1:{exporter.server.server_port}/metrics"
+        scraper = subprocess.Popen([sys.executable, '-c', SCRAPER, url, str(scrape_interval), str(seconds)],
+                                   stdout=subprocess.PIPE, text=True)
+    try:
+        acquisition.run()
+    finally:
+        scrapes = int(scraper.communicate()[0] or 0) if scraper is not None else 0
+        if exporter is not None:
+            exporter.stop()
+    deviation = np.abs(np.concatenate(intervals) - interval)
+    return deviation, scrapes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200000, help='Calls per timed operation')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10.0, help='Sampling time per configuration and round')
+    parser.add_argument('--interval', type=float, default=0.01, help='Sampling interval in seconds')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--scrape-interval', type=float, default=0.1)
+    parser.add_argument('--tolerance-us', type=float, default=50.0, help='Allowed increase of the median deviation')
+    args = parser.parse_args()
+
+    operation_costs(args.calls, args.threads, args.batch_size)
+
+    workdir = tempfile.mkdtemp(prefix='bench_metrics_')
+    try:
+        deviations = {"off": [], "on": []}
+        scrapes = 0
+        for _ in range(args.rounds):
+            for label, instrumented in (("off", False), ("on", True)):
+                deviation, count = sampling_run(args.seconds, args.interval, args.batch_size, workdir, instrumented,
+                                                args.scrape_interval)
+                deviations[label].append(deviation)
+                scrapes += count
+    finally:
+        shutil.rmtree(workdir)
+
+    print(f"\nSampling at {args.interval * 1e3:.0f} ms, {args.rounds} x {args.seconds:.0f} s per configuration "
+          f"({scrapes} scrapes); deviation of each interval from {args.interval * 1e3:.0f} ms:")
+    print(f"{'config':>6} {'p50 us':>8} {'p90 us':>8} {'p99 us':>8} {'max us':>9}")
+    median = {}
+    for label, parts in deviations.items():
+        deviation = np.concatenate(parts)
+        p50, p90, p99 = np.percentile(deviation, [50, 90, 99])
+        median[label] = p50
+        print(f"{label:>6} {p50 * 1e6:>8.0f} {p90 * 1e6:>8.0f} {p99 * 1e6:>8.0f} {deviation.max() * 1e6:>9.0f}")
+    added = (median["on"] - median["off"]) * 1e6
+    print(f"\nmedian deviation change with metrics on: {added:+.1f} us")
+    sys.exit(0 if added <= args.tolerance_us else 1)
+
+
+if __name__ == "__main__":
+    main()
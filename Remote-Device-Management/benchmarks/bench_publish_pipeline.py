@@ -0,0 +1,146 @@
+"""
+PublishPipeline against a simulated MQTT link that degrades and drops.
+
+A stand-in connection acknowledges QoS1 publishes after a configurable
+PUBACK delay and records the order messages reach the broker. The producer
+publishes at a fixed rate through four phases:
+
+    good          PUBACK after --good-ms
+    degraded      PUBACK after --degraded-ms
+    disconnected  on_connection_interrupted; publishes go to the outbox
+    resumed       on_connection_resumed; the outbox drains
+
+Reported: peak publishes awaiting a PUBACK (bounded by --max-inflight, where
+calling connection.publish directly grows without limit), outbox use, ack
+latency percentiles, and whether every message reached the broker in order.
+Exits 1 if the in-flight bound is exceeded or a message is lost.
+
+Usage:
+    python benchmarks/bench_publish_pipeline.py [--rate 200] [--phase-seconds 2] [--max-inflight 10]
+"""
+import argparse
+import heapq
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+from publish_pipeline import PublishPipeline
+
+
+class SimulatedConnection:
+    """Acknowledges publishes after ack_delay seconds from a timer thread."""
+
+    def __init__(self):
+        self.ack_delay = 0.02
+        self.received = []
+        self.outstanding = 0
+        self.peak_outstanding = 0
+        self._timers = []
+        self._lock = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def publish(self, topic, payload, qos):
+        future = Future()
+        with self._lock:
+            self.received.append(payload)
+            self.outstanding += 1
+            self.peak_outstanding = max(self.peak_outstanding, self.outstanding)
+            heapq.heappush(self._timers, (time.monotonic() + self.ack_delay, id(future), future))
+            self._lock.notify()
+        return future, len(self.received)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._stopped and (not self._timers or self._timers[0][0] > time.monotonic()):
+                    self._lock.wait(self._timers[0][0] - time.monotonic() if self._timers else None)
+                if self._stopped:
+                    return
+                _, _, future = heapq.heappop(self._timers)
+                self.outstanding -= 1
+            future.set_result({"packet_id": 0})
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._lock.notify()
+
+
+def run_phases(publish, connection, pipeline, rate, phase_seconds, good, degraded):
+    count = 0
+    interval = 1.0 / rate
+    for phase in ("good", "degraded", "disconnected", "resumed"):
+        connection.ack_delay = degraded if phase == "degraded" else good
+        if pipeline is not None:
+            if phase == "disconnected":
+                pipeline.on_disconnected()
+            elif phase == "resumed":
+                pipeline.on_connected()
+        end = time.monotonic() + phase_seconds
+        next_publish = time.monotonic()
+        while time.monotonic() < end:
+            publish(b"%08d" % count)
+            count += 1
+            next_publish += interval
+            delay = next_publish - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=200.0, help='Publishes per second')
+    parser.add_argument('--phase-seconds', type=float, default=2.0)
+    parser.add_argument('--max-inflight', type=int, default=10)
+    parser.add_argument('--good-ms', type=float, default=20.0)
+    parser.add_argument('--degraded-ms', type=float, default=500.0)
+    args = parser.parse_args()
+    good, degraded = args.good_ms / 1e3, args.degraded_ms / 1e3
+
+    # Calling connection.publish directly, as pubsub2 used to
+    direct = SimulatedConnection()
+    run_phases(lambda p: direct.publish("update", p, 1), direct, None, args.rate, args.phase_seconds, good, degraded)
+    direct.stop()
+
+    workdir = tempfile.mkdtemp(prefix='bench_outbox_')
+    try:
+        connection = SimulatedConnection()
+        pipeline = PublishPipeline(connection, os.path.join(workdir, 'outbox'), max_inflight=args.max_inflight, publish_timeout=0.05)
+        pipeline.on_connected()
+        sent = run_phases(lambda p: pipeline.publish("update", p, 1), connection, pipeline, args.rate,
+                          args.phase_seconds, good, degraded)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            m = pipeline.metrics()
+            if m["outbox"] == 0 and m["inflight"] == 0:
+                break
+            time.sleep(0.05)
+        pipeline.close()
+        connection.stop()
+        metrics = pipeline.metrics()
+    finally:
+        shutil.rmtree(workdir)
+
+    delivered = [int(p) for p in connection.received]
+    in_order = delivered == sorted(delivered)
+    missing = set(range(sent)) - set(delivered)
+    print(f"{sent} publishes at {args.rate:.0f}/s, PUBACK {args.good_ms:.0f} ms / {args.degraded_ms:.0f} ms degraded")
+    print(f"direct:   peak awaiting PUBACK {direct.peak_outstanding}")
+    print(f"pipeline: peak awaiting PUBACK {connection.peak_outstanding} (max_inflight {args.max_inflight})")
+    print(f"          {metrics}")
+    print(f"          delivered {len(set(delivered))}/{sent}, {'in order' if in_order else 'out of order'}")
+    ok = connection.peak_outstanding <= args.max_inflight and not missing
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
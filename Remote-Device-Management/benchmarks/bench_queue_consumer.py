@@ -0,0 +1,166 @@
+"""
+Idle CPU and end-to-end latency of the s3_events consumer loop.
+
+Compares the old `while True: if not queue.empty(): queue.get()` loop with
+QueueConsumer's blocking batched gets. A QueueManager server is started on
+localhost, a producer puts events the same way adc_batch_generation.py does
+(`s3_events_queue.put(json.dumps(...))`) and the consumer records the
+delay until each event is handled.
+
+Usage:
+    python benchmarks/bench_queue_consumer.py [--idle-seconds 5] [--events 200]
+"""
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+# queue_server reads its configuration from the environment at import time
+os.environ.setdefault('LOG_DIRECTORY', tempfile.mkdtemp(prefix='bench_logs_'))
+os.environ.setdefault('LOG_FILE_QUEUE_SERVER', 'queue_server.log')
+os.environ.setdefault('FILE_EVENTS_ID', 'file_events')
+os.environ.setdefault('IOT_EVENTS_ID', 'iot_events')
+os.environ.setdefault('S3_EVENTS_ID', 's3_events')
+os.environ.setdefault('QUEUE_BACKEND', 'memory')
+
+from queue_server import QueueManager
+from queue_consumer import QueueConsumer
+
+AUTHKEY = b'bench'
+S3_EVENTS_ID = os.environ['S3_EVENTS_ID']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve(address):
+    QueueManager(address=address, authkey=AUTHKEY).get_server().serve_forever()
+
+
+def connect(address):
+    manager = QueueManager(address=address, authkey=AUTHKEY)
+    manager.connect()
+    return manager
+
+
+def proc_cpu_seconds(pid):
+    # utime + stime from /proc/<pid>/stat, None where /proc is not available
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def polling_consumer(address, duration, latencies, expected):
+    queue = getattr(connect(address), S3_EVENTS_ID)()
+    cpu_start = time.process_time()
+    deadline = time.time() + duration
+    while time.time() < deadline and len(latencies) < expected:
+        if not queue.empty():
+            message = queue.get()
+            latencies.append(time.time() - json.loads(message)['sent_at'])
+    return time.process_time() - cpu_start
+
+
+def blocking_consumer(address, duration, latencies, expected):
+    queue = getattr(connect(address), S3_EVENTS_ID)()
+
+    def handle(message):
+        latencies.append(time.time() - json.loads(message)['sent_at'])
+        if len(latencies) >= expected:
+            consumer.stop()
+
+    quiet = logging.getLogger('bench_queue_consumer')
+    quiet.setLevel(logging.WARNING)
+    consumer = QueueConsumer(queue, handle, timeout=0.5, log=quiet)
+    cpu_start = time.process_time()
+    deadline = time.time() + duration
+    consumer.on_idle = lambda: time.time() >= deadline and consumer.stop()
+    consumer.run()
+    return time.process_time() - cpu_start
+
+
+CONSUMERS = {'poll': polling_consumer, 'blocking': blocking_consumer}
+
+
+def consumer_process(mode, address, duration, expected, result_queue):
+    latencies = []
+    cpu = CONSUMERS[mode](address, duration, latencies, expected)
+    result_queue.put((cpu, latencies))
+
+
+def producer_process(address, events, interval):
+    queue = getattr(connect(address), S3_EVENTS_ID)()
+    for _ in range(events):
+        event_message = {
+            "file_path": "/tmp/BFA1_Batch1_2025-01-01_00-00-00.csv",
+            "event_type": "ADC_BATCH_CREATED",
+            "sent_at": time.time(),
+        }
+        queue.put(json.dumps(event_message))
+        time.sleep(interval)
+
+
+def run_mode(mode, address, server_pid, idle_seconds, events, interval):
+    results = mp.Queue()
+
+    # Idle phase: nothing is produced, so all CPU is loop overhead
+    server_cpu = proc_cpu_seconds(server_pid)
+    consumer = mp.Process(target=consumer_process, args=(mode, address, idle_seconds, 1, results))
+    consumer.start()
+    idle_cpu, _ = results.get()
+    consumer.join()
+    if server_cpu is not None:
+        server_cpu = proc_cpu_seconds(server_pid) - server_cpu
+
+    # Latency phase
+    consumer = mp.Process(target=consumer_process, args=(mode, address, events * interval + 10, events, results))
+    consumer.start()
+    time.sleep(0.5)
+    producer = mp.Process(target=producer_process, args=(address, events, interval))
+    producer.start()
+    _, latencies = results.get()
+    producer.join()
+    consumer.join()
+
+    latencies_ms = sorted(l * 1000 for l in latencies)
+    p99 = latencies_ms[min(len(latencies_ms) - 1, int(len(latencies_ms) * 0.99))] if latencies_ms else float('nan')
+    print(f"{mode:>8}: idle consumer CPU {100 * idle_cpu / idle_seconds:6.1f}%"
+          + (f", idle server CPU {100 * server_cpu / idle_seconds:6.1f}%" if server_cpu is not None else "")
+          + f" | latency p50 {statistics.median(latencies_ms) if latencies_ms else float('nan'):.2f} ms"
+          + f" p99 {p99:.2f} ms over {len(latencies_ms)} events")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--idle-seconds', type=float, default=5.0)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.01, help='Seconds between produced events')
+    args = parser.parse_args()
+
+    address = ('127.0.0.1', free_port())
+    server = mp.Process(target=serve, args=(address,), daemon=True)
+    server.start()
+    time.sleep(0.5)
+    try:
+        for mode in CONSUMERS:
+            run_mode(mode, address, server.pid, args.idle_seconds, args.events, args.interval)
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Messages per second and latency of the two queue_server transports:
+QueueManager proxies over TCP and the Unix domain socket in queue_socket.py.
+
+A server process serves the same in-memory queue on both transports. For
+each transport a producer process puts events the way adc_batch_generation.py
+does and a QueueConsumer (get, drain, task_done) handles them:
+
+    put      puts/s from one producer, nothing consuming
+    stream   end-to-end msgs/s with the producer putting as fast as it can
+    paced    put-to-handled latency at --rate msgs/s, where queueing doesn't
+             dominate
+
+Usage:
+    python benchmarks/bench_queue_transport.py [--events 20000] [--rate 500]
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+# queue_server reads its configuration from the environment at import time
+os.environ.setdefault('LOG_DIRECTORY', tempfile.mkdtemp(prefix='bench_logs_'))
+os.environ.setdefault('LOG_FILE_QUEUE_SERVER', 'queue_server.log')
+os.environ.setdefault('FILE_EVENTS_ID', 'file_events')
+os.environ.setdefault('IOT_EVENTS_ID', 'iot_events')
+os.environ.setdefault('S3_EVENTS_ID', 's3_events')
+os.environ.setdefault('QUEUE_BACKEND', 'memory')
+
+from queue_server import QueueManager, get_queue
+from queue_socket import SocketQueueServer, SocketQueueClient
+from queue_consumer import QueueConsumer
+
+AUTHKEY = b'bench'
+S3_EVENTS_ID = os.environ['S3_EVENTS_ID']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve(address, socket_path):
+    queue = get_queue('s3_events')
+    socket_server = SocketQueueServer(socket_path, {S3_EVENTS_ID: queue})
+    threading.Thread(target=socket_server.serve_forever, daemon=True).start()
+    QueueManager(address=address, authkey=AUTHKEY).get_server().serve_forever()
+
+
+def connect(transport, address, socket_path):
+    if transport == 'socket':
+        return SocketQueueClient(socket_path, S3_EVENTS_ID)
+    manager = QueueManager(address=address, authkey=AUTHKEY)
+    manager.connect()
+    return getattr(manager, S3_EVENTS_ID)()
+
+
+def produce(transport, address, socket_path, events, rate):
+    queue = connect(transport, address, socket_path)
+    interval = 1.0 / rate if rate else 0.0
+    next_put = time.monotonic()
+    for n in range(events):
+        if interval:
+            next_put += interval
+            while time.monotonic() < next_put:
+                pass
+        # CLOCK_MONOTONIC is system-wide, so the consumer can compare it
+        queue.put(json.dumps({"file_path": f"/data/BFA1_Batch{n}.csv", "event_type": "ADC_BATCH_CREATED", "sent_at": time.monotonic()}))
+
+
+def consume(queue, events):
+    latencies = []
+
+    def handle(message):
+        latencies.append(time.monotonic() - json.loads(message)['sent_at'])
+        if len(latencies) >= events:
+            consumer.stop()
+
+    consumer = QueueConsumer(queue, handle, max_batch=64, timeout=0.2)
+    start = time.perf_counter()
+    consumer.run()
+    return events / (time.perf_counter() - start), np.array(latencies) * 1e3
+
+
+def bench(transport, address, socket_path, events, rate):
+    queue = connect(transport, address, socket_path)
+
+    start = time.perf_counter()
+    for n in range(events):
+        queue.put(json.dumps({"file_path": f"/data/BFA1_Batch{n}.csv", "event_type": "ADC_BATCH_CREATED"}))
+    put_rate = events / (time.perf_counter() - start)
+    for _ in range(events):
+        queue.get()
+        queue.task_done()
+
+    results = {"put": put_rate}
+    for mode, mode_rate, mode_events in (("stream", 0, events), ("paced", rate, min(events, rate * 5))):
+        producer = mp.Process(target=produce, args=(transport, address, socket_path, mode_events, mode_rate))
+        producer.start()
+        results[mode] = consume(queue, mode_events)
+        producer.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--rate', type=int, default=500, help='Producer rate for the latency run, msgs/s')
+    args = parser.parse_args()
+
+    address = ('127.0.0.1', free_port())
+    socket_path = os.path.join(tempfile.mkdtemp(prefix='bench_sock_'), 'queue.sock')
+    server = mp.Process(target=serve, args=(address, socket_path), daemon=True)
+    server.start()
+    for _ in range(50):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.1)
+    time.sleep(0.2)
+
+    try:
+        print(f"{'transport':<10} {'put/s':>8} {'stream/s':>9} {'paced p50':>10} {'paced p99':>10} {'stream p99':>11}")
+        for transport in ('manager', 'socket'):
+            r = bench(transport, address, socket_path, args.events, args.rate)
+            stream_rate, stream_lat = r["stream"]
+            _, paced_lat = r["paced"]
+            print(f"{transport:<10} {r['put']:>8.0f} {stream_rate:>9.0f} {np.percentile(paced_lat, 50):>8.3f}ms "
+                  f"{np.percentile(paced_lat, 99):>8.3f}ms {np.percentile(stream_lat, 99):>9.1f}ms")
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Fault-injection check of ResumableUploader against moto's in-process S3.
+
+Failures are injected into chosen calls with a botocore before-call
+handler, so they come out of the client (and out of any boto3 helper
+wrapping it) as S3's own errors would:
+
+    transient  a share (--fault-rate) of UploadPart / PutObject calls
+               fail with a 503 SlowDown; retries must hide them
+    crash      the process "dies" (an exception retries don't catch) after
+               --crash-after parts; a fresh uploader, as after a reboot,
+               resumes from the checkpoint and sends only the missing parts
+    expired    as crash, but the multipart upload is aborted in S3 meanwhile
+               (lifecycle rule); the resume starts over
+    fatal      AccessDenied is not retried and leaves the checkpoint; for a
+               small file the upload fails without an exception
+
+Each scenario checks the object in S3 byte for byte against the file and
+reports the retries, parts sent/skipped and bytes re-sent. Retry delays are
+recorded instead of slept. Exits 1 if any check fails.
+
+Usage:
+    python benchmarks/bench_resumable_upload.py [--size-mb 40] [--part-mb 5] [--fault-rate 0.3]
+"""
+import argparse
+import hashlib
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3
+from botocore.awsrequest import AWSResponse
+from moto import mock_aws
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+from resumable_upload import ResumableUploader, MB
+
+BUCKET = 'bench-resumable'
+
+
+class SimulatedCrash(Exception):
+    pass
+
+
+class FaultyClient:
+    """
+    A fresh S3 client whose PutObject and UploadPart calls fail as
+    configured. The failure is returned from a before-call handler in place
+    of S3's response, so botocore raises it as it would S3's own error.
+    """
+
+    def __init__(self, fault_rate=0.0, crash_after=None, fatal=False, seed=0):
+        self._client = boto3.client('s3', region_name='us-east-1')
+        self.fault_rate = fault_rate
+        self.crash_after = crash_after
+        self.fatal = fatal
+        self.rng = random.Random(seed)
+        self.parts_received = 0
+        self.bytes_received = 0
+        self.faults = 0
+        for operation in ('PutObject', 'UploadPart'):
+            self._client.meta.events.register(f'before-call.s3.{operation}', self._inject)
+
+    def _inject(self, model, **kwargs):
+        if self.fatal:
+            code, status = 'AccessDenied', 403
+        elif self.rng.random() < self.fault_rate:
+            code, status = 'SlowDown', 503
+        else:
+            return None
+        self.faults += 1
+        return AWSResponse(f'https://{BUCKET}.s3.amazonaws.com', status, {}, None), {
+            "Error": {"Code": code, "Message": "injected"}, "ResponseMetadata": {"HTTPStatusCode": status}}
+
+    def upload_part(self, **kwargs):
+        if self.crash_after is not None and self.parts_received >= self.crash_after:
+            raise SimulatedCrash()
+        response = self._client.upload_part(**kwargs)
+        self.parts_received += 1
+        self.bytes_received += len(kwargs["Body"])
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def make_uploader(client, checkpoint_dir, args, delays):
+    return ResumableUploader(
+        client, BUCKET, checkpoint_dir,
+        part_size=int(args.part_mb * MB), multipart_threshold=int(args.part_mb * MB),
+        max_concurrency=1, max_attempts=8, sleep=delays.append,
+    )
+
+
+def object_matches(s3, key, digest):
+    body = s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+    return hashlib.sha256(body).hexdigest() == digest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=40.0, help='Size of the multipart test file')
+    parser.add_argument('--part-mb', type=float, default=5.0, help='Part size (S3 minimum is 5)')
+    parser.add_argument('--fault-rate', type=float, default=0.3, help='Share of calls failing in the transient scenario')
+    parser.add_argument('--crash-after', type=int, default=3, help='Parts sent before the simulated crash')
+    args = parser.parse_args()
+    # Retries and failures are expected here; the table reports them
+    logging.getLogger('resumable_upload').setLevel(logging.CRITICAL)
+
+    workdir = tempfile.mkdtemp(prefix='bench_resumable_')
+    ok = True
+    try:
+        large = os.path.join(workdir, 'BFA1_Batch1_2025-03-13_14-07-54.tar')
+        small = os.path.join(workdir, 'BFA1_Batch2_2025-03-13_14-08-24.adcb')
+        with open(large, 'wb') as f:
+            f.write(os.urandom(int(args.size_mb * MB)))
+        with open(small, 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+        large_digest = hashlib.sha256(open(large, 'rb').read()).hexdigest()
+        small_digest = hashlib.sha256(open(small, 'rb').read()).hexdigest()
+        size = os.path.getsize(large)
+
+        print(f"{'scenario':>10} {'result':>7} {'faults':>7} {'retries':>8} {'sent':>5} {'skipped':>8} {'MB sent':>8}")
+
+        def report(name, passed, client, uploaders, delays):
+            nonlocal ok
+            ok = ok and passed
+            sent = sum(u.stats["parts_sent"] for u in uploaders)
+            skipped = sum(u.stats["parts_skipped"] for u in uploaders)
+            retries = sum(u.stats["retries"] for u in uploaders)
+            print(f"{name:>10} {'ok' if passed else 'FAILED':>7} {client.faults:>7} {retries:>8} {sent:>5} {skipped:>8} "
+                  f"{client.bytes_received / MB:>8.1f}   (backoff {sum(delays):.1f}s)")
+
+        with mock_aws():
+            s3 = boto3.client('s3', region_name='us-east-1')
+            s3.create_bucket(Bucket=BUCKET)
+
+            # Transient faults on every kind of upload
+            checkpoints = os.path.join(workdir, 'transient')
+            delays = []
+            client = FaultyClient(fault_rate=args.fault_rate, seed=1)
+            uploader = make_uploader(client, checkpoints, args, delays)
+            passed = (uploader.upload(large, 'transient/large') and uploader.upload(small, 'transient/small')
+                      and object_matches(s3, 'transient/large', large_digest)
+                      and object_matches(s3, 'transient/small', small_digest)
+                      and not uploader.pending())
+            report('transient', passed, client, [uploader], delays)
+
+            # Crash part way, then resume in a new uploader
+            for name in ('crash', 'expired'):
+                checkpoints = os.path.join(workdir, name)
+                delays = []
+                client = FaultyClient(crash_after=args.crash_after)
+                first = make_uploader(client, checkpoints, args, delays)
+                try:
+                    first.upload(large, f'{name}/large')
+                    crashed = False
+                except SimulatedCrash:
+                    crashed = True
+                checkpoint = first.pending()[0] if first.pending() else None
+                if name == 'expired' and checkpoint:
+                    s3.abort_multipart_upload(Bucket=BUCKET, Key=checkpoint["key"], UploadId=checkpoint["upload_id"])
+                client.crash_after = None
+                second = make_uploader(client, checkpoints, args, delays)
+                results = second.resume_pending()
+                expected_skipped = args.crash_after if name == 'crash' else 0
+                passed = (crashed and checkpoint is not None and results == [(large, f'{name}/large', True)]
+                          and second.stats["parts_skipped"] == expected_skipped
+                          and object_matches(s3, f'{name}/large', large_digest) and not second.pending())
+                report(name, passed, client, [first, second], delays)
+
+            # Non-retryable error: no retries, checkpoint kept
+            checkpoints = os.path.join(workdir, 'fatal')
+            delays = []
+            client = FaultyClient(fatal=True)
+            uploader = make_uploader(client, checkpoints, args, delays)
+            passed = (not uploader.upload(large, 'fatal/large') and not uploader.upload(small, 'fatal/small')
+                      and uploader.stats["retries"] == 0 and len(uploader.pending()) == 1)
+            report('fatal', passed, client, [uploader], delays)
+
+        print(f"\n{size / MB:.0f} MB file in {args.part_mb:g} MB parts; a restart without a checkpoint re-sends "
+              f"{args.crash_after * args.part_mb:g} MB the resume skips")
+    finally:
+        shutil.rmtree(workdir)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Cost of the retention manager (batch_retention.py) on a directory of
+--batches synthetic batches, one every 30 s up to now (100k is ~35 days).
+
+Batch files are small CSVs (--rows rows, default 40, ~1.4 KB) so the
+directory fits anywhere; real batches are ~100 KB, which scales the
+compression step but not the catalog or directory work. The catalog
+records --pending-share of them PENDING, --local-share LOCAL and the rest
+UPLOADED, and LOCAL batches are included (evict_local). Steps, timed one
+by one:
+
+    compress  gzip every uploaded/LOCAL batch in place
+    roll      append past days' compressed batches to daily tars
+    evict     with a stand-in disk sized so usage is at --fill, delete
+              oldest first down to the low watermark
+    steady    a run with nothing left to do (the cost every interval)
+
+Checks that every PENDING batch is still on disk, unmodified, and that
+usage ends below the low watermark. Exits 1 otherwise.
+
+Usage:
+    python benchmarks/bench_retention.py [--batches 100000] [--fill 0.95]
+"""
+import argparse
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+from batch_catalog import BatchCatalog, PENDING, UPLOADED, LOCAL, EVICTED
+from batch_retention import RetentionManager
+
+DiskUsage = collections.namedtuple('DiskUsage', 'total used free')
+
+
+def directory_bytes(*directories):
+    return sum(entry.stat().st_size for d in directories for entry in os.scandir(d) if entry.is_file())
+
+
+class StandInDisk:
+    """Disk of a fixed size whose use is the bytes in the batch directories."""
+
+    def __init__(self, total, directories):
+        self.total = total
+        self.directories = directories
+        self.seconds = 0.0
+
+    def __call__(self, path):
+        start = time.perf_counter()
+        used = directory_bytes(*self.directories)
+        self.seconds += time.perf_counter() - start
+        return DiskUsage(self.total, used, self.total - used)
+
+
+def make_batches(directory, catalog, count, rows, pending_share, local_share):
+    now = time.time()
+    lines = ''.join(f'"2025-03-13 14:07:54,{i % 1000:03d}",0.{594000 + i:06d}\n' for i in range(rows))
+    body = "Timestamp,Voltage\n" + lines
+    pending_every = int(1 / pending_share) if pending_share else 0
+    local_every = int(1 / local_share) if local_share else 0
+    pending = []
+    for n in range(1, count + 1):
+        end = now - (count - n) * 30
+        stamp = datetime.fromtimestamp(end).strftime('%Y-%m-%d_%H-%M-%S')
+        path = os.path.join(directory, f"BFA1_Batch{n}_{stamp}.csv")
+        with open(path, 'w') as f:
+            f.write(body)
+        if pending_every and n % pending_every == 0:
+            state = PENDING
+            pending.append(path)
+        elif local_every and n % local_every == 1:
+            state = LOCAL
+        else:
+            state = UPLOADED
+        catalog.add_batch("BFA1", n, path, end - 30, end, state=state)
+    return pending, len(body)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batches', type=int, default=100000)
+    parser.add_argument('--rows', type=int, default=40, help='Rows per synthetic CSV batch')
+    parser.add_argument('--pending-share', type=float, default=0.05)
+    parser.add_argument('--local-share', type=float, default=0.05)
+    parser.add_argument('--fill', type=float, default=0.95, help='Stand-in disk usage before eviction')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_retention_')
+    ok = True
+    try:
+        batches = os.path.join(workdir, 'ADC_Batches')
+        archives = os.path.join(batches, 'daily')
+        os.makedirs(batches)
+        catalog = BatchCatalog(os.path.join(workdir, 'catalog.sqlite3'))
+        start = time.perf_counter()
+        pending, batch_bytes = make_batches(batches, catalog, args.batches, args.rows, args.pending_share, args.local_share)
+        print(f"{args.batches} batches of {batch_bytes} B ({len(pending)} pending) written in {time.perf_counter() - start:.1f}s")
+
+        disk = StandInDisk(1 << 60, [batches, archives])
+        manager = RetentionManager(catalog, batches, archives, high_watermark=0.85, low_watermark=0.70,
+                                   compress_after=0, evict_local=True, batch_limit=args.batches, disk_usage=disk,
+                                   clock=lambda: time.time() + 1)
+
+        before = directory_bytes(batches)
+        compressed, t_compress = timed(manager.compress)
+        after_compress = directory_bytes(batches)
+        archived, t_roll = timed(manager.roll_daily_archives)
+        after = directory_bytes(batches, archives)
+        days = len(os.listdir(archives))
+
+        # Size the stand-in disk so the batches fill it to --fill, then evict
+        disk.total = int(after / args.fill)
+        disk.seconds = 0.0
+        freed, t_evict = timed(manager.evict)
+        t_evict -= disk.seconds
+        usage = manager.usage()
+        disk.total = 1 << 60
+        steady, t_steady = timed(manager.run_once)
+
+        print(f"\n{'step':>9} {'seconds':>8} {'batches/s':>10}  result")
+        print(f"{'compress':>9} {t_compress:>8.2f} {compressed / t_compress:>10,.0f}  {compressed} batches, "
+              f"directory {before / 1e6:.1f} MB -> {after_compress / 1e6:.1f} MB")
+        # Tar headers are 512 B a member, a third of these tiny batches; under 1% of a real one
+        print(f"{'roll':>9} {t_roll:>8.2f} {archived / t_roll:>10,.0f}  {archived} batches into {days} daily archives, "
+              f"{after / 1e6:.1f} MB")
+        evicted = len(catalog.batches(EVICTED))
+        print(f"{'evict':>9} {t_evict:>8.2f} {evicted / max(t_evict, 1e-9):>10,.0f}  {evicted} batches, {freed / 1e6:.1f} MB freed, "
+              f"usage {args.fill:.0%} -> {usage:.1%} (disk stand-in walk excluded)")
+        print(f"{'steady':>9} {t_steady * 1e3:>7.1f}ms {'':>10}  {steady}")
+
+        untouched = all(os.path.exists(p) and os.path.getsize(p) == batch_bytes for p in pending)
+        still_pending = len(catalog.batches(PENDING)) == len(pending)
+        print(f"\npending batches intact: {untouched and still_pending}")
+        ok = untouched and still_pending and usage < 0.70
+    finally:
+        shutil.rmtree(workdir)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Batches-per-second of the in-process S3Uploader against the old
+one-interpreter-per-file path (`python s3_upload.py <file>`).
+
+Both paths upload to a local moto S3 server, so no AWS account or network
+is needed. Requires `moto[server]`.
+
+Usage:
+    python benchmarks/bench_s3_uploader.py [--batches 50] [--workers 4]
+"""
+import argparse
+import glob
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MODULES = os.path.join(ROOT, 'src', 'modules')
+SAMPLE_BATCHES = os.path.join(ROOT, 'data', 'raw', 'ADC_Batches')
+sys.path.insert(0, MODULES)
+
+from moto.server import ThreadedMotoServer
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_batches(directory, count):
+    # Copies of the sample CSVs under fresh BFA1_BatchN names
+    samples = sorted(glob.glob(os.path.join(SAMPLE_BATCHES, '*.csv')))
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"BFA1_Batch{i + 1}_2025-03-13_14-{i // 60 % 60:02d}-{i % 60:02d}.csv")
+        shutil.copyfile(samples[i % len(samples)], path)
+        paths.append(path)
+    return paths
+
+
+def bench_subprocess(paths):
+    script = os.path.join(MODULES, 's3_upload.py')
+    start = time.perf_counter()
+    for path in paths:
+        subprocess.run([sys.executable, script, path], check=True, cwd=MODULES)
+    return time.perf_counter() - start
+
+
+def bench_in_process(paths, workers):
+    from s3_uploader import S3Uploader
+
+    start = time.perf_counter()
+    uploader = S3Uploader(os.environ['S3_BUCKET_NAME'], max_workers=workers)
+    futures = [uploader.submit(path) for path in paths]
+    ok = all(f.result() for f in futures)
+    uploader.shutdown()
+    assert ok, "in-process upload failed"
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batches', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    port = free_port()
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix='bench_s3_')
+    os.environ.update({
+        'AWS_ENDPOINT_URL': f'http://127.0.0.1:{port}',
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'AWS_REGION': 'us-east-1',
+        'S3_BUCKET_NAME': 'bench-datalogger',
+        'LOG_DIRECTORY': workdir,
+        'LOG_FILE_S3_UPLOAD': 's3_upload.log',
+        'LOGGER_S3_UPLOAD': 's3_upload',
+    })
+    try:
+        import boto3
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=os.environ['S3_BUCKET_NAME'])
+        paths = make_batches(workdir, args.batches)
+
+        elapsed = bench_subprocess(paths)
+        print(f"subprocess per file : {args.batches / elapsed:8.2f} batches/s ({elapsed:.2f} s)")
+        elapsed = bench_in_process(paths, args.workers)
+        print(f"in-process, {args.workers} workers: {args.batches / elapsed:8.2f} batches/s ({elapsed:.2f} s)")
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Jitter and throughput of the ADC sampling loop, run against a simulated
+AnalogIn channel so no I2C hardware is needed.
+
+"legacy" is the per-sample loop adc_batch_generation.py used to run
+(strftime + Decimal quantize + list append + relative sleep); "buffered" is
+adc_sampler.BatchSampler.
+
+Usage:
+    python benchmarks/bench_sampler.py [--samples 1000] [--interval 0.01] [--read-delay 0.001]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+import numpy as np
+from adc_sampler import BatchSampler, SimulatedChannel
+
+
+def legacy_loop(chan, batch_size, sampling_interval):
+    samples = []
+    times = []
+    for i in range(batch_size):
+        current_time = time.time()
+        formatted_timestamp = datetime.fromtimestamp(current_time).strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
+        voltage = "{:.6f}".format(Decimal(str(chan.voltage)).quantize(Decimal('0.000000'), rounding=ROUND_HALF_UP))
+        samples.append([formatted_timestamp, voltage])
+        times.append(current_time)
+        time.sleep(max(0, sampling_interval - (time.time() - current_time)))
+    return np.array(times)
+
+
+def buffered_loop(chan, batch_size, sampling_interval):
+    sampler = BatchSampler(chan, batch_size, sampling_interval)
+    buffer = sampler.new_buffer()
+    sampler.fill(buffer)
+    return buffer.wall_timestamps()
+
+
+def report(name, times, interval):
+    diffs = np.diff(times) * 1000
+    # Error of each timestamp against the ideal grid t0 + i * interval
+    grid_error = np.abs(times - times[0] - interval * np.arange(len(times))) * 1000
+    print(f"{name:>9}: interval mean {diffs.mean():7.3f} ms, std {diffs.std():6.3f} ms | "
+          f"grid error p50 {np.percentile(grid_error, 50):7.3f} ms, p99 {np.percentile(grid_error, 99):7.3f} ms, "
+          f"end of batch {grid_error[-1]:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--interval', type=float, default=0.01)
+    parser.add_argument('--read-delay', type=float, default=0.001, help='Simulated I2C read time in seconds')
+    args = parser.parse_args()
+
+    chan = SimulatedChannel(read_delay=args.read_delay)
+    print(f"Jitter at {args.interval * 1000:.1f} ms interval, {args.samples} samples:")
+    report("legacy", legacy_loop(chan, args.samples, args.interval), args.interval)
+    report("buffered", buffered_loop(chan, args.samples, args.interval), args.interval)
+
+    # Unpaced throughput with an instantaneous channel isolates the per-sample overhead
+    fast = SimulatedChannel()
+    n = 50000
+    print(f"Unpaced throughput, {n} samples:")
+    for name, loop in (("legacy", legacy_loop), ("buffered", buffered_loop)):
+        start = time.perf_counter()
+        loop(fast, n, 0.0)
+        print(f"{name:>9}: {n / (time.perf_counter() - start):10.0f} samples/s")
+
+    # Cost moved out of the loop: formatting and writing one 3000-sample batch
+    sampler = BatchSampler(fast, 3000, 0.0)
+    buffer = sampler.new_buffer()
+    sampler.fill(buffer)
+    with tempfile.TemporaryDirectory() as d:
+        start = time.perf_counter()
+        buffer.write_csv(os.path.join(d, 'batch.csv'))
+        csv_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        buffer.write_binary(os.path.join(d, 'batch.adcb'), 1, 'BFA1', 100.0)
+        binary_ms = (time.perf_counter() - start) * 1000
+    print(f"Flush of 3000 samples: csv {csv_ms:.2f} ms, binary {binary_ms:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Publish count of pubsub2's shadow updates with and without coalescing.
+
+A stand-in for the AWS IoT broker counts QoS1 publishes (each one costs a
+PUBACK) and applies each document to a device shadow the way the shadow
+service merges `reported` state. The same event stream, GPS fixes plus
+MONITORING results that mostly repeat, is replayed through:
+
+    per-event  the old process_iot_event: one publish per GPS_UPDATE, two
+               (status + serial number) per MONITORING event
+    coalesced  ShadowPublisher driven from QueueConsumer's idle hook
+
+Both must leave the broker's shadow in the same final state; the script
+exits 1 if they don't or if the rate limit is exceeded.
+
+Usage:
+    python benchmarks/bench_shadow_coalescing.py [--seconds 5] [--gps-rate 20] [--monitoring-rate 5] [--max-rate 2]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from queue import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+from queue_consumer import QueueConsumer
+from shadow_publisher import ShadowPublisher
+from shadow_payloads import gps_fragment, monitoring_fragment, account_fragment
+
+ACCOUNT = account_fragment("1420224231942", "BFA-1")
+
+
+class BrokerStandIn:
+    """Counts publishes and merges them into a shadow document."""
+
+    def __init__(self):
+        self.publishes = 0
+        self.bytes = 0
+        self.times = []
+        self.shadow = {}
+        self.lock = threading.Lock()
+
+    def publish(self, topic, payload, qos):
+        with self.lock:
+            self.publishes += 1
+            self.bytes += len(payload)
+            self.times.append(time.monotonic())
+            for section, fields in json.loads(payload)["state"]["reported"].items():
+                self.shadow.setdefault(section, {}).update(fields)
+
+
+def make_events(seconds, gps_rate, monitoring_rate):
+    events = []
+    for i in range(int(seconds * gps_rate)):
+        # The GPS fix only moves every 10th reading
+        events.append((i / gps_rate, {"event_type": "GPS_UPDATE", "time": f"2024-11-20 12:00:{int(i // gps_rate):02d}",
+                                      "latitude": 18.52 + (i // 10) * 1e-5, "longitude": 73.85,
+                                      "maps_link": "https://maps.google.com/?q=18.52,73.85"}))
+    for i in range(int(seconds * monitoring_rate)):
+        leaked = i % 20 == 19
+        events.append((i / monitoring_rate, {"event_type": "MONITORING", "LEAK": "YES" if leaked else "NO",
+                                             "classification": "LEAKED" if leaked else "NORMAL",
+                                             "file_path": f"/data/ADC_Batches/BFA1_Batch{i}_2024-11-20_12-00-{i % 60:02d}.csv"}))
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+def per_event(broker, events):
+    for _, event in events:
+        if event["event_type"] == "GPS_UPDATE":
+            broker.publish("update", json.dumps({"state": {"reported": gps_fragment(event)}}).encode(), 1)
+        else:
+            broker.publish("update", json.dumps({"state": {"reported": monitoring_fragment(event)}}).encode(), 1)
+            broker.publish("update", json.dumps({"state": {"reported": ACCOUNT}}).encode(), 1)
+
+
+def coalesced(broker, events, flush_window, max_rate):
+    queue = Queue()
+    shadow = ShadowPublisher(lambda payload: broker.publish("update", payload, 1), flush_window=flush_window, max_rate=max_rate)
+
+    def handle(message):
+        event = json.loads(message)
+        if event["event_type"] == "GPS_UPDATE":
+            shadow.update(gps_fragment(event))
+        else:
+            shadow.update(monitoring_fragment(event))
+            shadow.update(ACCOUNT)
+
+    consumer = QueueConsumer(queue, handle, timeout=0.05, on_idle=shadow.flush_if_due)
+    thread = threading.Thread(target=consumer.run)
+    thread.start()
+    start = time.monotonic()
+    for at, event in events:
+        delay = start + at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        queue.put(json.dumps(event))
+    queue.join()
+    consumer.stop()
+    thread.join()
+    shadow.flush()
+    return shadow.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--gps-rate', type=float, default=20.0, help='GPS_UPDATE events per second')
+    parser.add_argument('--monitoring-rate', type=float, default=5.0, help='MONITORING events per second')
+    parser.add_argument('--flush-window', type=float, default=0.5)
+    parser.add_argument('--max-rate', type=float, default=2.0, help='Maximum shadow updates per second')
+    args = parser.parse_args()
+
+    events = make_events(args.seconds, args.gps_rate, args.monitoring_rate)
+    old, new = BrokerStandIn(), BrokerStandIn()
+    per_event(old, events)
+    stats = coalesced(new, events, args.flush_window, args.max_rate)
+
+    print(f"{len(events)} events over {args.seconds:.0f} s")
+    print(f"per-event: {old.publishes:>6} publishes {old.bytes:>8} bytes")
+    print(f"coalesced: {new.publishes:>6} publishes {new.bytes:>8} bytes  "
+          f"({stats['unchanged_fields']} unchanged fields dropped)")
+
+    ok = True
+    if old.shadow != new.shadow:
+        print("Final shadow differs:\n", old.shadow, "\n", new.shadow)
+        ok = False
+    # The final flush on shutdown is exempt from the rate limit
+    gaps = [b - a for a, b in zip(new.times, new.times[1:-1])]
+    if gaps and min(gaps) < 1.0 / args.max_rate * 0.95:
+        print(f"Rate limit exceeded: {min(gaps) * 1e3:.0f} ms between publishes")
+        ok = False
+    print("Final shadow matches, rate limit held." if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
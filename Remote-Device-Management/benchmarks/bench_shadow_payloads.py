@@ -0,0 +1,118 @@
+"""
+Events per second through pubsub2's event handling, before and after the
+payload-encoding layer in shadow_payloads.py.
+
+    per-event  the old process_iot_event: nested dicts and
+               json.dumps(...).encode('utf-8') for every publish, the date
+               regex compiled from a string per message and the constant
+               serial number payload re-serialized per MONITORING event
+    templated  fragments merged by ShadowPublisher, updates encoded by
+               ReportedEncoder's cached templates, flushing every --flush-every
+               events
+    encode     encoding alone: json.dumps vs ReportedEncoder for one GPS and
+               one MONITORING update
+
+Publishing is a no-op, so only the CPU work on the device is measured.
+
+Usage:
+    python benchmarks/bench_shadow_payloads.py [--events 50000] [--flush-every 50]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+from shadow_publisher import ShadowPublisher
+from shadow_payloads import ReportedEncoder, gps_fragment, monitoring_fragment, account_fragment
+
+SERIAL_NUMBER_PAYLOAD = {"state": {"reported": account_fragment("1420224231942", "BFA-1")}}
+
+
+def make_messages(count):
+    messages = []
+    for i in range(count):
+        if i % 4:
+            messages.append(json.dumps({"event_type": "GPS_UPDATE", "time": f"2024-11-20 12:{i // 60 % 60:02d}:{i % 60:02d}",
+                                        "latitude": 18.52 + i * 1e-6, "longitude": 73.85 - i * 1e-6,
+                                        "maps_link": f"https://maps.google.com/?q={18.52 + i * 1e-6},{73.85 - i * 1e-6}"}))
+        else:
+            leaked = i % 40 == 0
+            messages.append(json.dumps({"event_type": "MONITORING", "LEAK": "YES" if leaked else "NO",
+                                        "classification": "LEAKED" if leaked else "NORMAL",
+                                        "file_path": f"/data/ADC_Batches/BFA1_Batch{i}_2024-11-20_12-00-{i % 60:02d}.csv"}))
+    return messages
+
+
+def per_event(messages, publish):
+    for message in messages:
+        event_data = json.loads(message)
+        if event_data["event_type"] == 'GPS_UPDATE':
+            gps_payload = {"state": {"reported": {"GPS": {
+                "LAST_REPORTED": event_data.get("time"), "LATITUDE": event_data.get("latitude"),
+                "LONGITUDE": event_data.get("longitude"), "MAPS_LINK": event_data.get("maps_link")}}}}
+            publish(json.dumps(gps_payload).encode('utf-8'))
+        else:
+            match = re.search(r"(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})", os.path.basename(event_data.get("file_path")))
+            date_time = match.group(1) if event_data.get("classification") == 'LEAKED' else "NO LEAK"
+            status_payload = {"state": {"reported": {"MONITORING": {
+                "LEAK": event_data.get("LEAK"), "LAST_LEAK_REPORTED_TIME": date_time}}}}
+            publish(json.dumps(status_payload).encode('utf-8'))
+            publish(json.dumps(SERIAL_NUMBER_PAYLOAD).encode('utf-8'))
+
+
+def templated(messages, publish, flush_every):
+    shadow = ShadowPublisher(publish, flush_window=0, max_rate=0)
+    account = SERIAL_NUMBER_PAYLOAD["state"]["reported"]
+    for n, message in enumerate(messages, 1):
+        event_data = json.loads(message)
+        if event_data["event_type"] == 'GPS_UPDATE':
+            shadow.update(gps_fragment(event_data))
+        else:
+            shadow.update(monitoring_fragment(event_data))
+            shadow.update(account)
+        if n % flush_every == 0:
+            shadow.flush()
+    shadow.flush()
+
+
+def rate(fn, count, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return count / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=50000)
+    parser.add_argument('--flush-every', type=int, default=50, help='Events per shadow flush in the templated run')
+    args = parser.parse_args()
+
+    messages = make_messages(args.events)
+    noop = lambda payload: None
+    old = rate(lambda: per_event(messages, noop), args.events)
+    new = rate(lambda: templated(messages, noop, 1), args.events)
+    coalesced = rate(lambda: templated(messages, noop, args.flush_every), args.events)
+    print(f"per-event               {old:>10.0f} events/s")
+    print(f"templated, flush each   {new:>10.0f} events/s  ({new / old:.1f}x)")
+    print(f"templated, flush / {args.flush_every:<4} {coalesced:>10.0f} events/s  ({coalesced / old:.1f}x)")
+
+    encoder = ReportedEncoder()
+    updates = [gps_fragment(json.loads(messages[1])), monitoring_fragment(json.loads(messages[0]))]
+    for reported in updates:
+        assert json.loads(encoder.encode(reported)) == {"state": {"reported": reported}}
+    n = 100000
+    dumps = rate(lambda: [json.dumps({"state": {"reported": r}}).encode('utf-8') for _ in range(n // 2) for r in updates], n)
+    template = rate(lambda: [encoder.encode(r) for _ in range(n // 2) for r in updates], n)
+    print(f"\nencode json.dumps       {dumps:>10.0f} docs/s")
+    print(f"encode templates        {template:>10.0f} docs/s  ({template / dumps:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
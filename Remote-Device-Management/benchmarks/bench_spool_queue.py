@@ -0,0 +1,140 @@
+"""
+Enqueue and dequeue throughput of the durable SpoolQueue against the
+in-memory queue.Queue, for each fsync mode, plus a restart check: events put
+and events got but not acknowledged must be replayed when the spool is
+reopened.
+
+Usage:
+    python benchmarks/bench_spool_queue.py [--events 20000] [--manager]
+
+--manager also measures both backends through a QueueManager server, the way
+the services use them (one round-trip per call).
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from multiprocessing.managers import BaseManager
+from queue import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+from spool_queue import SpoolQueue, FSYNC_ALWAYS, FSYNC_BATCH, FSYNC_NEVER
+
+AUTHKEY = b'bench'
+
+
+def event(n):
+    # Same shape as the s3_events messages published by adc_batch_generation.py
+    return json.dumps({"file_path": f"/data/ADC_Batches/BFA1_Batch{n}_2024-11-20_12-00-00.csv", "event_type": "ADC_BATCH_CREATED"})
+
+
+def run(queue, events):
+    messages = [event(n) for n in range(events)]
+    start = time.perf_counter()
+    for message in messages:
+        queue.put(message)
+    put_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(events):
+        queue.get()
+        queue.task_done()
+    get_time = time.perf_counter() - start
+    return events / put_time, events / get_time
+
+
+def check_replay(workdir):
+    directory = os.path.join(workdir, 'replay')
+    spool = SpoolQueue(directory, segment_bytes=4096)
+    for n in range(1000):
+        spool.put(event(n))
+    for _ in range(400):
+        spool.get()
+        spool.task_done()
+    # Handed out but never acknowledged: must come back after the restart
+    for _ in range(100):
+        spool.get()
+    spool.close()
+
+    reopened = SpoolQueue(directory, segment_bytes=4096)
+    replayed = [reopened.get_nowait() for _ in range(reopened.qsize())]
+    reopened.close()
+    expected = [event(n) for n in range(400, 1000)]
+    return replayed == expected, len(replayed)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class BenchManager(BaseManager):
+    pass
+
+
+def serve(address, backend, directory):
+    queue = Queue() if backend == 'memory' else SpoolQueue(directory)
+    BenchManager.register('events', callable=lambda: queue)
+    BenchManager(address=address, authkey=AUTHKEY).get_server().serve_forever()
+
+
+def run_via_manager(backend, directory, events):
+    address = ('127.0.0.1', free_port())
+    server = mp.Process(target=serve, args=(address, backend, directory), daemon=True)
+    server.start()
+    BenchManager.register('events')
+    manager = BenchManager(address=address, authkey=AUTHKEY)
+    for _ in range(50):
+        try:
+            manager.connect()
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    try:
+        return run(manager.events(), events)
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--manager', action='store_true', help='Also measure through a QueueManager server')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_spool_')
+    try:
+        print(f"{'backend':<22} {'put/s':>10} {'get+ack/s':>10}")
+        put_rate, get_rate = run(Queue(), args.events)
+        print(f"{'memory':<22} {put_rate:>10.0f} {get_rate:>10.0f}")
+
+        for fsync in (FSYNC_NEVER, FSYNC_BATCH, FSYNC_ALWAYS):
+            events = args.events if fsync != FSYNC_ALWAYS else min(args.events, 2000)
+            spool = SpoolQueue(os.path.join(workdir, fsync), fsync=fsync)
+            put_rate, get_rate = run(spool, events)
+            spool.close()
+            print(f"{'spool fsync=' + fsync:<22} {put_rate:>10.0f} {get_rate:>10.0f}")
+
+        if args.manager:
+            for backend in ('memory', 'spool'):
+                put_rate, get_rate = run_via_manager(backend, os.path.join(workdir, 'manager'), min(args.events, 5000))
+                print(f"{backend + ' via manager':<22} {put_rate:>10.0f} {get_rate:>10.0f}")
+
+        ok, replayed = check_replay(workdir)
+        print(f"\nReplay after restart: {replayed} events, {'in order' if ok else 'MISMATCH'}")
+        if not ok:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
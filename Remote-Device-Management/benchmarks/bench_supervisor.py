@@ -0,0 +1,210 @@
+"""
+Memory and start-up time of the per-service layout against the
+single-process supervisor (supervisor.py).
+
+Each service is stood in for by a fresh interpreter that does what the real
+one does before its main loop: the script's own top-level imports (read
+from the script with ast, so the list stays current), load_dotenv(),
+setup_logging() and, where the service makes one at import, an S3 client.
+Hardware, AWS and MQTT connections are not made. The layouts:
+
+    services    one interpreter per script in SERVICES, all started at once
+    supervisor  one interpreter with the imports of all of them, one
+                logging setup and the S3 clients its components create
+
+For each interpreter the time from spawn to ready, RSS and PSS (RSS with
+shared pages split between the processes sharing them, so PSS adds up) are
+read once every interpreter of the layout is ready. The median of
+--repeats runs is reported. Modules that are not installed here (the
+Adafruit stack off a Pi) are listed; each layout would import them once.
+
+Part 2 checks Supervisor's restart handling with stand-in components: one
+that raises twice, one that calls sys.exit() once and one that runs
+throughout. Exits 1 if any is not running again, or the steady one was
+disturbed, within the expected backoff.
+
+Usage:
+    python benchmarks/bench_supervisor.py [--repeats 3]
+"""
+import argparse
+import ast
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+MODULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules')
+sys.path.insert(0, MODULES)
+
+from supervisor import Supervisor
+
+# Script -> S3 clients it creates at import
+SERVICES = {
+    'queue_server.py': 0,
+    'adc_batch_generation.py': 0,
+    's3_event_manager.py': 1,
+    'pubsub2.py': 0,
+}
+
+CHILD = """
+import os, sys, json
+sys.path.insert(0, sys.argv[1])
+statements, clients = json.loads(sys.argv[2]), int(sys.argv[3])
+missing = []
+for statement in statements:
+    try:
+        exec(statement)
+    except ImportError as e:
+        missing.append(e.name or statement)
+from dotenv import load_dotenv
+load_dotenv()
+from log_setup import setup_logging
+setup_logging('bench', 'bench.log')
+if clients:
+    from s3_uploader import create_s3_client
+    s3_clients = [create_s3_client() for _ in range(clients)]
+print(json.dumps(sorted(set(missing))), flush=True)
+sys.stdin.read()
+"""
+
+
+def top_level_imports(script):
+    with open(os.path.join(MODULES, script)) as f:
+        tree = ast.parse(f.read())
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+def proc_kb(pid, path, field):
+    with open(f"/proc/{pid}/{path}") as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def start_layout(layout, env):
+    """Starts the interpreters of a layout together; returns [(name, seconds to ready, rss KB, pss KB)], missing."""
+    started = []
+    for name, (statements, clients) in layout.items():
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, '-c', CHILD, MODULES, json.dumps(statements), str(clients)],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env)
+        started.append((name, start, proc))
+    ready = []
+    missing = set()
+    for name, start, proc in started:
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"{name} stand-in exited with {proc.wait()}")
+        ready.append(time.perf_counter() - start)
+        missing.update(json.loads(line))
+    results = []
+    for (name, _, proc), seconds in zip(started, ready):
+        results.append((name, seconds, proc_kb(proc.pid, 'status', 'VmRSS'), proc_kb(proc.pid, 'smaps_rollup', 'Pss')))
+    for _, _, proc in started:
+        proc.stdin.close()
+        proc.wait()
+    return results, missing
+
+
+def footprint(args, env):
+    services = {os.path.splitext(script)[0]: (top_level_imports(script), clients) for script, clients in SERVICES.items()}
+    union = []
+    for statements, _ in services.values():
+        union.extend(s for s in statements if s not in union)
+    layouts = {
+        "services": services,
+        "supervisor": {"supervisor": (union + top_level_imports('supervisor.py'), sum(SERVICES.values()))},
+    }
+
+    missing = set()
+    print(f"{'layout':>10} {'process':>22} {'ready s':>8} {'RSS MB':>8} {'PSS MB':>8}")
+    totals = {}
+    for label, layout in layouts.items():
+        runs = []
+        for _ in range(args.repeats):
+            results, run_missing = start_layout(layout, env)
+            missing |= run_missing
+            runs.append(results)
+        for i, name in enumerate(layout):
+            seconds = statistics.median(run[i][1] for run in runs)
+            rss = statistics.median(run[i][2] for run in runs) / 1024
+            pss = statistics.median(run[i][3] for run in runs) / 1024
+            print(f"{label:>10} {name:>22} {seconds:>8.2f} {rss:>8.1f} {pss:>8.1f}")
+        totals[label] = (
+            statistics.median(max(r[1] for r in run) for run in runs),
+            statistics.median(sum(r[2] for r in run) for run in runs) / 1024,
+            statistics.median(sum(r[3] for r in run) for run in runs) / 1024,
+        )
+    print()
+    for label, (seconds, rss, pss) in totals.items():
+        print(f"{label:>10} {'total (all ready)':>22} {seconds:>8.2f} {rss:>8.1f} {pss:>8.1f}")
+    if missing:
+        print(f"\nnot installed here, imported by neither layout: {', '.join(sorted(missing))}")
+
+
+def restart_check(delay):
+    runs = {"flaky": 0, "exiting": 0, "steady": 0}
+    running = {name: threading.Event() for name in runs}
+
+    def flaky(stop_event):
+        runs["flaky"] += 1
+        if runs["flaky"] <= 2:
+            raise RuntimeError("stand-in failure")
+        running["flaky"].set()
+        stop_event.wait()
+
+    def exiting(stop_event):
+        runs["exiting"] += 1
+        if runs["exiting"] == 1:
+            sys.exit(1)
+        running["exiting"].set()
+        stop_event.wait()
+
+    def steady(stop_event):
+        runs["steady"] += 1
+        running["steady"].set()
+        stop_event.wait()
+
+    supervisor = Supervisor({"flaky": flaky, "exiting": exiting, "steady": steady},
+                            restart_delay=delay, max_restart_delay=delay * 8, healthy_after=60.0)
+    supervisor.logger.setLevel(logging.CRITICAL)
+    start = time.perf_counter()
+    supervisor.start()
+    # flaky waits delay + 2 * delay before its third run
+    recovered = all(event.wait(delay * 3 + 2.0) for event in running.values())
+    elapsed = time.perf_counter() - start
+    supervisor.stop()
+    left = supervisor.join(5.0)
+    print(f"\nrestart check (delay {delay}s): runs {runs}, restarts {supervisor.restarts}, "
+          f"all running after {elapsed:.2f}s, stopped cleanly: {not left}")
+    return recovered and runs["steady"] == 1 and not left and supervisor.restarts == {"flaky": 2, "exiting": 1, "steady": 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--restart-delay', type=float, default=0.2)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_supervisor_')
+    # Stand-ins for what .env provides on a device, where not set here
+    env = dict(S3_EVENTS_ID='s3_events', IOT_EVENTS_ID='iot_events', FILE_EVENTS_ID='file_events',
+               AWS_REGION='us-east-1', BASE_DIRECTORY=workdir)
+    env.update(os.environ, LOG_DIRECTORY=workdir)
+    try:
+        footprint(args, env)
+    finally:
+        shutil.rmtree(workdir)
+    ok = restart_check(args.restart_delay)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
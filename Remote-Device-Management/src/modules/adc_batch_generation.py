@@ -1,9 +1,6 @@
 import numpy as np
-from decimal import Decimal, ROUND_HALF_UP
 import time
-import csv
 import os
-import logging
 from board import SCL, SDA
 from busio import I2C
 import adafruit_ads1x15.ads1015 as ADS
@@ -12,7 +9,13 @@ from datetime import datetime
 import pytz
 import json
 from dotenv import load_dotenv, set_key
-from queue_server import QueueManager
+from queue_server import connect_queue
+from batch_format import BINARY_EXTENSION
+from batch_catalog import BatchCatalog
+from adc_sampler import BatchSampler, DoubleBufferedSampler, SingleShotBackend, ContinuousBackend
+from leak_detector import NPWDetector, BatchClassifier, LEAKED
+from log_setup import setup_logging
+import metrics
 import re
 import threading
 from collections import deque
@@ -22,85 +25,154 @@ from collections import deque
 # Load environment variables from .env file
 load_dotenv()
 
-manager = QueueManager(address=(os.getenv('QUEUE_HOST'), int(os.getenv('QUEUE_PORT'))), authkey=os.getenv('AUTH_KEY').encode())
-manager.connect()
-
-# Configure logging
-log_dir = os.getenv('LOG_DIRECTORY')
-log_file = os.getenv('LOG_FILE_ADC')
-os.makedirs(log_dir, exist_ok=True)
-log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
-log_level = getattr(logging, log_level, logging.INFO)
-
-logger = logging.getLogger(os.getenv('LOGGER_ADC'))
-logger.setLevel(log_level)
-file_handler_adc = logging.FileHandler(os.path.join(log_dir, log_file))
-file_handler_adc.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
-logger.addHandler(file_handler_adc)
-samples_lcd=[]
-def get_last_batch_number(backup_adc_batches):
-    batch_files=[f for f in os.listdir(backup_adc_batches) if re.match(r"BFA1_Batch(\d+)_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}\.csv", f)]
-    batch_numbers = [int(re.search(r"BFA1_Batch(\d+)", file).group(1)) for file in batch_files]
-    return max(batch_numbers) if batch_numbers else 0
-
-
-try:
-    i2c = I2C(SCL, SDA)
-
-    # Initialize ADC (ADS1015)
-    logger.debug("Initializing ADS1015...")
-    ads = ADS.ADS1015(i2c, data_rate=3300)
-    chan = AnalogIn(ads, ADS.P1)
-    logger.info("ADS1015 initialized successfully.")
-    
-
-
-    
-   
-
-    # Batch and sampling setup
-    backup_adc_batches=os.getenv('FILE_DIRECTORY_ADC_BATCHES_BACKUP')
-    output_folder = os.getenv('FILE_DIRECTORY_ADC_BATCHES')
-    batch_number = get_last_batch_number(output_folder) + 1
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-        logger.info(f"Output folder created: {output_folder}")
+# Connect once per queue; with the manager transport every manager.s3_events() call opens
+# and authenticates a new connection. iot_events is connected on first use.
+event_queues = {os.getenv('S3_EVENTS_ID'): connect_queue(os.getenv('S3_EVENTS_ID'))}
 
-    batch_size = int(os.getenv('BATCH_SIZE'))
-    sampling_interval = float(os.getenv('SAMPLING_RATE'))
-    ist_tz = pytz.timezone(os.getenv('TIMEZONE'))
-   
+# Configure logging; records are written by a background thread so the sampling loop never waits on the SD card
+logger = setup_logging(os.getenv('LOGGER_ADC'), os.getenv('LOG_FILE_ADC'))
+samples_lcd=[]
 
-    # Main data collection loop
-    while True:
+# Metrics are recorded on the writer thread, once per batch; the sampling loop itself is not touched
+metrics.start_metrics(os.getenv('METRICS_PORT_ADC'), os.getenv('METRICS_FILE_ADC'), log=logger)
+batches_persisted = metrics.counter('adc_batches_total', 'Batches written and published')
+batch_write_seconds = metrics.histogram('adc_batch_write_seconds', 'Time to write a batch file')
+batch_classify_seconds = metrics.histogram('adc_batch_classify_seconds', 'Time to run the leak detector on a batch')
+event_publish_seconds = metrics.histogram('adc_event_publish_seconds', 'Time to put an event on a queue_server queue')
+batch_latency_seconds = metrics.histogram('adc_batch_latency_seconds', 'From the last sample of a batch to its s3 event being published')
+sample_jitter_seconds = metrics.histogram(
+    'adc_sample_jitter_seconds', 'Deviation of each sample interval from the sampling interval',
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1),
+)
+
+def publish_event(queue_id, event_message):
+    if queue_id not in event_queues:
+        event_queues[queue_id] = connect_queue(queue_id)
+    with event_publish_seconds.timer():
         try:
-            logger.info(f"Starting collection for batch {batch_number}.")
-            samples = []
-            start_time = time.time()
-            
-            for i in range(batch_size):
-                current_time = time.time()
-                formatted_timestamp = datetime.fromtimestamp(current_time).strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
-                voltage = "{:.6f}".format(Decimal(str(chan.voltage)).quantize(Decimal('0.000000'),rounding=ROUND_HALF_UP))
-                # voltage2 = chan.voltage
-                # resistor_value = int(os.getenv('RESISTOR_VALUE'))
-                # pressure_kg_cm2 = voltage_to_pressure(voltage2,resistor_value)
-                samples.append([formatted_timestamp, voltage])
-                # # Add voltage to moving average queue
-                # moving_avg_queue.append(voltage)
-                # samples_lcd.append(pressure_kg_cm2)
-
-                time.sleep(max(0, sampling_interval - (time.time() - current_time)))
-
-            # Save batch to CSV
-            ist_timestamp = datetime.now(ist_tz).strftime('%Y-%m-%d_%H-%M-%S')
-            batch_file = os.path.join(output_folder, f"BFA1_Batch{batch_number}_{ist_timestamp}.csv")
-
-            with open(batch_file, mode='w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(["Timestamp", "Voltage"])
-                writer.writerows(samples)
-            logger.info(f"Batch {batch_number} saved: {batch_file}")
+            event_queues[queue_id].put(json.dumps(event_message))
+        except (ConnectionError, EOFError) as e:
+            # queue_server restarted and the cached proxy is dead; reconnect and retry once
+            logger.warning(f"Lost connection to queue server ({e}), reconnecting.")
+            event_queues[queue_id] = connect_queue(queue_id)
+            event_queues[queue_id].put(json.dumps(event_message))
+
+def publish_s3_event(event_message):
+    publish_event(os.getenv('S3_EVENTS_ID'), event_message)
+
+
+def main(stop_event=None):
+    """
+    Initializes the ADC and samples batches until stop_event is set (never,
+    when run as a service). Returns early, with the error logged, if
+    initialization fails.
+    """
+    try:
+        i2c = I2C(SCL, SDA)
+
+        # Initialize ADC (ADS1015)
+        logger.debug("Initializing ADS1015...")
+        ads = ADS.ADS1015(i2c, data_rate=int(os.getenv('ADC_DATA_RATE', '3300')))
+        chan = AnalogIn(ads, ADS.P1)
+        logger.info("ADS1015 initialized successfully.")
+
+
+
+
+
+
+        # Batch and sampling setup
+        backup_adc_batches=os.getenv('FILE_DIRECTORY_ADC_BATCHES_BACKUP')
+        output_folder = os.getenv('FILE_DIRECTORY_ADC_BATCHES')
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+            logger.info(f"Output folder created: {output_folder}")
+
+        # The catalog keeps the last batch number, so startup doesn't rescan the batch directory.
+        # The directory is only listed once, to seed the catalog on first run.
+        catalog = BatchCatalog()
+        if catalog.last_batch_number("BFA1") is None:
+            imported = catalog.import_directory(output_folder, backup_adc_batches)
+            logger.info(f"Batch catalog created at {catalog.path} with {imported} existing batches.")
+        batch_number = catalog.next_batch_number("BFA1")
+
+        batch_size = int(os.getenv('BATCH_SIZE'))
+        sampling_interval = float(os.getenv('SAMPLING_RATE'))
+        ist_tz = pytz.timezone(os.getenv('TIMEZONE'))
+        # 'csv' keeps the text batches, 'binary' writes the columnar .adcb format (see batch_format.py)
+        binary_batches = os.getenv('BATCH_FORMAT', 'csv').lower() == 'binary'
+
+        # 'single' reads one single-shot conversion per SAMPLING_RATE tick; 'continuous' lets the
+        # ADS1015 free-run and reads its conversion register at ADC_SAMPLE_RATE Hz
+        if os.getenv('ACQUISITION_MODE', 'single').lower() == 'continuous':
+            backend = ContinuousBackend(ads, chan, sample_rate=float(os.getenv('ADC_SAMPLE_RATE', ads.data_rate)))
+            logger.info(f"Continuous-conversion acquisition at {backend.sample_rate:.0f} Hz.")
+            # Continuous samples are stamped from the grid, so falling behind shows up here rather than as jitter
+            metrics.gauge('adc_overruns', 'Times continuous acquisition fell a block behind and re-anchored',
+                          func=lambda: backend.overruns)
+        else:
+            backend = SingleShotBackend(chan, sampling_interval)
+        sampler = BatchSampler(backend, batch_size)
+
+        # On-device NPW leak detection; each batch is classified as it is persisted and the
+        # result goes to iot_events as a MONITORING event. LEAK_DETECTION=off disables it.
+        leak_classifier = None
+        if os.getenv('LEAK_DETECTION', 'npw').lower() == 'npw':
+            leak_classifier = BatchClassifier(NPWDetector(
+                sampler.sample_rate,
+                threshold=float(os.getenv('NPW_THRESHOLD', '6.0')),
+                min_drop=float(os.getenv('NPW_MIN_DROP', '0.03')),
+                holdoff=float(os.getenv('NPW_HOLDOFF', '10.0')),
+            ))
+
+
+        # Writes, .env updates and queue publishing run on a writer thread while sampling continues
+        def persist_batch(sample_buffer):
+            nonlocal batch_number
+            # Claim the number up front so a failed publish doesn't reuse it for the next batch
+            number = batch_number
+            batch_number += 1
+
+            # Name the batch after its last sample rather than the time the writer got to it
+            last_sample = datetime.fromtimestamp(float(sample_buffer.wall_timestamps()[-1]), ist_tz)
+            ist_timestamp = last_sample.strftime('%Y-%m-%d_%H-%M-%S')
+
+            intervals = np.diff(sample_buffer.timestamps[:sample_buffer.count])
+            sample_jitter_seconds.observe_many(np.abs(intervals - sampler.sampling_interval))
+
+            # Save batch to CSV or binary
+            with batch_write_seconds.timer():
+                if binary_batches:
+                    batch_file = os.path.join(output_folder, f"BFA1_Batch{number}_{ist_timestamp}{BINARY_EXTENSION}")
+                    sample_buffer.write_binary(batch_file, number, "BFA1", sampler.sample_rate)
+                else:
+                    batch_file = os.path.join(output_folder, f"BFA1_Batch{number}_{ist_timestamp}.csv")
+                    sample_buffer.write_csv(batch_file)
+            logger.info(f"Batch {number} saved: {batch_file}")
+            wall = sample_buffer.wall_timestamps()
+
+            classification = None
+            if leak_classifier is not None:
+                with batch_classify_seconds.timer():
+                    classification, detections = leak_classifier.classify(wall, sample_buffer.voltages[:sample_buffer.count])
+                if detections:
+                    logger.warning(f"Leak detected in batch {number}: {detections}")
+            # Cataloged before any publish, so a failed one can't hide the file from catch-up and
+            # retention; the classification lets the catch-up uploader drain flagged batches first
+            catalog.add_batch("BFA1", number, batch_file, float(wall[0]), float(wall[-1]), classification=classification)
+
+            if leak_classifier is not None:
+                try:
+                    publish_event(os.getenv('IOT_EVENTS_ID'), {
+                        "event_type": "MONITORING",
+                        "LEAK": "YES" if classification == LEAKED else "NO",
+                        "classification": classification,
+                        "file_path": batch_file,
+                        "detections": [{"time": d.time, "drop": round(d.drop, 4)} for d in detections],
+                    })
+                except Exception as e:
+                    # The S3 event below still goes out
+                    logger.error(f"Failed to publish the MONITORING event for batch {number}: {e}")
 
             # Update .env with Device ID
             match = re.search(r"BFA\d+", os.path.basename(batch_file))
@@ -115,14 +187,28 @@ try:
                 "file_path": batch_file,
                 "event_type": os.getenv('ADC_BATCH_CREATED_EVENT'),
             }
-            manager.s3_events().put(json.dumps(event_message))
-            logger.info(f"Event published to queue for batch {batch_number}.")
-
-            batch_number += 1
-
-        except Exception as e:
-            logger.error(f"An error occurred during data collection: {e}", exc_info=True)
-            time.sleep(5)  # Retry after a delay
-
-except Exception as e:
-    logger.error(f"Initialization failed: {e}")
\ No newline at end of file
+            if classification is not None:
+                event_message["classification"] = classification
+            publish_s3_event(event_message)
+            batches_persisted.inc()
+            batch_latency_seconds.observe(time.monotonic() - sample_buffer.timestamps[sample_buffer.count - 1])
+            logger.info(f"Event published to queue for batch {number}.")
+
+        # Main data collection loop: samples go into preallocated buffers and are only
+        # formatted when the writer persists them
+        acquisition = DoubleBufferedSampler(
+            sampler,
+            persist_batch,
+            buffers=int(os.getenv('SAMPLE_BUFFERS', '2')),
+            stop_event=stop_event,
+            log=logger,
+        )
+        logger.info(f"Starting collection at batch {batch_number}.")
+        acquisition.run()
+
+    except Exception as e:
+        logger.error(f"Initialization failed: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+import csv
+import time
+import queue
+import random
+import logging
+import threading
+from datetime import datetime
+import numpy as np
+from batch_format import write_batch
+import metrics
+
+logger = logging.getLogger(__name__)
+
+buffer_waits = metrics.counter('adc_buffer_waits_total', 'Times sampling paused because the batch writer held every buffer')
+sampling_errors = metrics.counter('adc_sampling_errors_total', 'Partial batches dropped after an acquisition error')
+write_errors = metrics.counter('adc_batch_write_errors_total', 'Batches the writer failed to persist')
+
+# adafruit_ads1x15.ads1x15.Mode values, so this module imports without the Adafruit stack
+ADS_MODE_CONTINUOUS = 0x0000
+ADS_MODE_SINGLE = 0x0100
+
+
+class SimulatedChannel:
+    """
+    Stand-in for adafruit_ads1x15.analog_in.AnalogIn, so the sampler can be
+    exercised without I2C hardware.
+
+    Args:
+        baseline (float): Mean voltage.
+        noise (float): Standard deviation of the Gaussian noise added to each read.
+        read_delay (float): Seconds each read blocks for, mimicking the I2C transaction.
+        resolution (float): Voltage step of the converter (ADS1015 at gain 1 is 2 mV).
+    """
+
+    def __init__(self, baseline=0.6, noise=0.02, read_delay=0.0, resolution=0.002):
+        self.baseline = baseline
+        self.noise = noise
+        self.read_delay = read_delay
+        self.resolution = resolution
+
+    @property
+    def voltage(self):
+        if self.read_delay:
+            time.sleep(self.read_delay)
+        value = random.gauss(self.baseline, self.noise)
+        return round(value / self.resolution) * self.resolution
+
+
+class SampleBuffer:
+    """
+    Preallocated storage for one batch.
+
+    Timestamps are raw time.monotonic() readings; wall_offset converts them to
+    Unix time and is captured once when the buffer starts filling, so all
+    samples of a batch share one clock mapping. Nothing is formatted until
+    the batch is written.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.timestamps = np.empty(size, dtype=np.float64)
+        self.voltages = np.empty(size, dtype=np.float64)
+        self.count = 0
+        self.wall_offset = 0.0
+
+    def reset(self):
+        self.count = 0
+        self.wall_offset = time.time() - time.monotonic()
+
+    def wall_timestamps(self):
+        """Sample times as Unix epoch seconds."""
+        return self.timestamps[:self.count] + self.wall_offset
+
+    def format_rows(self):
+        """
+        Formats the samples as the CSV batches have always stored them:
+        local '%Y-%m-%d %H:%M:%S,%f' to the millisecond and 6-decimal volts.
+        """
+        wall = self.wall_timestamps()
+        if not len(wall):
+            return []
+        # One UTC offset for the whole ~30 s batch, as datetime.fromtimestamp() would apply
+        utc_offset = datetime.fromtimestamp(wall[0]).astimezone().utcoffset().total_seconds()
+        local_ms = np.floor((wall + utc_offset) * 1000).astype('int64').astype('datetime64[ms]')
+        timestamps = [s.replace('T', ' ').replace('.', ',') for s in np.datetime_as_string(local_ms, unit='ms')]
+        voltages = ["{:.6f}".format(v) for v in self.voltages[:self.count].tolist()]
+        return list(zip(timestamps, voltages))
+
+    def write_csv(self, path):
+        with open(path, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Timestamp", "Voltage"])
+            writer.writerows(self.format_rows())
+
+    def write_binary(self, path, batch_number, device, sample_rate):
+        write_batch(path, self.wall_timestamps(), self.voltages[:self.count], batch_number, device, sample_rate)
+
+
+class SingleShotBackend:
+    """
+    Acquisition backend that reads channel.voltage once per sample and paces
+    itself with sleeps, as the sampler always has (ADS1015 single-shot mode).
+
+    Pacing uses absolute deadlines (start + i * interval) rather than sleeping
+    "interval minus elapsed", so read-time variation does not accumulate as
+    drift. If the loop falls more than one interval behind (e.g. the process
+    was descheduled) it re-anchors instead of bursting to catch up.
+
+    Args:
+        channel: Object with a `voltage` attribute, e.g. AnalogIn or SimulatedChannel.
+        sampling_interval (float): Seconds between samples.
+    """
+
+    def __init__(self, channel, sampling_interval):
+        self.channel = channel
+        self.sampling_interval = sampling_interval
+        self.sample_rate = 1.0 / sampling_interval if sampling_interval else 0.0
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def read_into(self, timestamps, voltages, count, next_deadline=None):
+        """
+        Fills timestamps[:count] (time.monotonic()) and voltages[:count].
+
+        Returns:
+            float: Deadline for the sample after the last one read.
+        """
+        channel = self.channel
+        interval = self.sampling_interval
+        clock = time.monotonic
+        sleep = time.sleep
+
+        if next_deadline is None:
+            next_deadline = clock()
+
+        for i in range(count):
+            delay = next_deadline - clock()
+            if delay > 0:
+                sleep(delay)
+            elif delay < -interval:
+                # Too far behind to keep the grid; restart it from now
+                next_deadline = clock()
+            timestamps[i] = clock()
+            voltages[i] = channel.voltage
+            next_deadline += interval
+
+        return next_deadline
+
+
+class ContinuousBackend:
+    """
+    Acquisition backend for the ADS1015 in continuous-conversion mode.
+
+    The converter free-runs at `data_rate`, so each sample is a single fast
+    read of the conversion register (no config write, no polling of the
+    conversion-ready bit). Reads are issued back-to-back on a grid of
+    1 / sample_rate seconds, spinning for sub-millisecond waits where
+    time.sleep() is too coarse, and samples are timestamped from that grid
+    rather than by reading the clock per sample. The grid is re-anchored to
+    the clock if it falls behind by more than one block.
+
+    Args:
+        ads: ADS1015 instance.
+        channel (AnalogIn): Channel to read.
+        sample_rate (float): Output rate in Hz, at most the ADC data rate.
+        block_size (int): Samples read per burst between clock checks.
+    """
+
+    # Waits shorter than this are spun instead of slept
+    SPIN_THRESHOLD = 0.002
+
+    def __init__(self, ads, channel, sample_rate=None, block_size=64):
+        self.ads = ads
+        self.channel = channel
+        self.sample_rate = float(min(sample_rate or ads.data_rate, ads.data_rate))
+        self.sampling_interval = 1.0 / self.sample_rate
+        self.block_size = block_size
+        self.overruns = 0
+
+    def start(self):
+        self.ads.mode = ADS_MODE_CONTINUOUS
+        # The first read selects the pin and starts conversions; later reads only fetch the result
+        self.channel.voltage
+
+    def stop(self):
+        self.ads.mode = ADS_MODE_SINGLE
+
+    def read_into(self, timestamps, voltages, count, next_deadline=None):
+        channel = self.channel
+        interval = self.sampling_interval
+        clock = time.perf_counter
+        mono = time.monotonic
+        sleep = time.sleep
+        spin = self.SPIN_THRESHOLD
+
+        if next_deadline is None:
+            next_deadline = mono()
+        # perf_counter paces the reads, the monotonic grid timestamps them
+        offset = next_deadline - mono()
+        tick = clock() + offset
+
+        for block_start in range(0, count, self.block_size):
+            block_end = min(count, block_start + self.block_size)
+            lag = clock() - tick
+            if lag > self.block_size * interval:
+                self.overruns += 1
+                tick = clock()
+                next_deadline = mono()
+            for i in range(block_start, block_end):
+                delay = tick - clock()
+                if delay > spin:
+                    sleep(delay - spin)
+                while clock() < tick:
+                    pass
+                voltages[i] = channel.voltage
+                timestamps[i] = next_deadline
+                next_deadline += interval
+                tick += interval
+
+        return next_deadline
+
+
+class SimulatedBackend:
+    """
+    Simulated ADC behind the same interface as the hardware backends, for
+    tests and benchmarks. Samples are generated in bulk on an exact grid of
+    1 / sample_rate and, when `realtime` is set, delivered no faster than a
+    real converter would produce them.
+
+    Args:
+        sample_rate (float): Rate in Hz.
+        channel (SimulatedChannel): Source of the simulated voltages.
+        realtime (bool): Sleep so reads take as long as the real acquisition.
+    """
+
+    def __init__(self, sample_rate, channel=None, realtime=True):
+        self.sample_rate = float(sample_rate)
+        self.sampling_interval = 1.0 / self.sample_rate
+        self.channel = channel or SimulatedChannel()
+        self.realtime = realtime
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def read_into(self, timestamps, voltages, count, next_deadline=None):
+        if next_deadline is None:
+            next_deadline = time.monotonic()
+        timestamps[:count] = next_deadline + np.arange(count) * self.sampling_interval
+        channel = self.channel
+        for i in range(count):
+            voltages[i] = channel.voltage
+        next_deadline += count * self.sampling_interval
+        if self.realtime:
+            delay = next_deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return next_deadline
+
+
+class BatchSampler:
+    """
+    Fills SampleBuffers from an acquisition backend.
+
+    The hot loop only stores a monotonic timestamp and the raw float voltage
+    into preallocated arrays; formatting happens when the batch is written.
+
+    Args:
+        source: An acquisition backend (SingleShotBackend, ContinuousBackend,
+            SimulatedBackend), or an object with a `voltage` attribute, which
+            is read in single-shot mode.
+        batch_size (int): Samples per batch.
+        sampling_interval (float): Seconds between samples for a single-shot
+            source; backends carry their own rate.
+    """
+
+    def __init__(self, source, batch_size, sampling_interval=None):
+        if not hasattr(source, 'read_into'):
+            source = SingleShotBackend(source, sampling_interval)
+        self.backend = source
+        self.batch_size = batch_size
+        self.sampling_interval = source.sampling_interval
+        self.sample_rate = source.sample_rate
+
+    def new_buffer(self):
+        return SampleBuffer(self.batch_size)
+
+    def fill(self, buffer, next_deadline=None):
+        """
+        Samples until the buffer is full.
+
+        Args:
+            buffer (SampleBuffer): Buffer to fill; it is reset first.
+            next_deadline (float): time.monotonic() at which to take the first
+                sample, normally the value returned by the previous fill() so
+                consecutive batches stay on one sampling grid. Starts
+                immediately when not given.
+
+        Returns:
+            float: Deadline for the first sample of the next batch.
+        """
+        buffer.reset()
+        next_deadline = self.backend.read_into(buffer.timestamps, buffer.voltages, self.batch_size, next_deadline)
+        buffer.count = self.batch_size
+        return next_deadline
+
+
+class DoubleBufferedSampler:
+    """
+    Keeps sampling into one buffer while a writer thread persists and
+    publishes the previous one, so batch boundaries leave no gap in the signal.
+
+    Buffers cycle through a small ring: the sampler takes a free buffer, fills
+    it, hands it to the writer and immediately takes the next free one,
+    continuing on the same deadline grid. The first sample of batch k+1 is
+    therefore one sampling interval after the last sample of batch k, as long
+    as the writer finishes a batch within (buffers - 1) batch durations. If
+    it falls further behind the sampler has to wait for a buffer, and that
+    wait is logged as a gap.
+
+    Args:
+        sampler (BatchSampler): Sampler that fills the buffers.
+        writer (callable): Called with each full SampleBuffer on the writer thread.
+        buffers (int): Number of buffers in the ring, at least 2.
+        stop_event (threading.Event): Shutdown signal; a new one is created when not given.
+        log (logging.Logger): Service logger to report to.
+    """
+
+    def __init__(self, sampler, writer, buffers=2, stop_event=None, log=None):
+        self.sampler = sampler
+        self.writer = writer
+        self.stop_event = stop_event or threading.Event()
+        self.logger = log or logger
+        self._free = queue.Queue()
+        self._full = queue.Queue()
+        for _ in range(max(2, buffers)):
+            self._free.put(sampler.new_buffer())
+
+    def _write_loop(self):
+        while True:
+            buffer = self._full.get()
+            if buffer is None:
+                return
+            try:
+                self.writer(buffer)
+            except Exception as e:
+                write_errors.inc()
+                self.logger.error(f"Failed to write batch: {e}", exc_info=True)
+            finally:
+                self._free.put(buffer)
+
+    def run(self, retry_delay=5):
+        """
+        Samples until stop_event is set, then waits for the writer to drain.
+        Errors while sampling (e.g. I2C failures) drop the partial batch and
+        restart sampling after retry_delay seconds.
+        """
+        writer_thread = threading.Thread(target=self._write_loop, name='batch_writer', daemon=True)
+        writer_thread.start()
+        self.sampler.backend.start()
+        next_deadline = None
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    buffer = self._free.get_nowait()
+                except queue.Empty:
+                    buffer_waits.inc()
+                    self.logger.warning("Batch writer is behind; sampling paused until a buffer is free.")
+                    buffer = self._free.get()
+                    next_deadline = None
+                try:
+                    next_deadline = self.sampler.fill(buffer, next_deadline)
+                except Exception as e:
+                    self._free.put(buffer)
+                    sampling_errors.inc()
+                    self.logger.error(f"An error occurred during data collection: {e}", exc_info=True)
+                    next_deadline = None
+                    self.stop_event.wait(retry_delay)
+                    continue
+                self._full.put(buffer)
+        finally:
+            self.sampler.backend.stop()
+            self._full.put(None)
+            writer_thread.join()
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,184 @@
+import os
+import io
+import json
+import time
+import tarfile
+import logging
+from datetime import datetime
+from s3_uploader import BATCH_FILE_PATTERN
+from batch_format import read_batch, BINARY_EXTENSION
+
+logger = logging.getLogger(__name__)
+
+
+def batch_number_of(file_name):
+    """Returns N from BFAx_BatchN_<timestamp>, or 0 for other names."""
+    match = BATCH_FILE_PATTERN.search(file_name)
+    return int(match.group(2)[len("Batch"):]) if match else 0
+
+
+def read_time_range(file_path):
+    """
+    Returns the first and last sample timestamps and the sample count of a
+    batch (CSV or binary) without parsing every row.
+    """
+    if file_path.endswith(BINARY_EXTENSION):
+        header, timestamps, _ = read_batch(file_path)
+        if not header["count"]:
+            return None, None, 0
+        start, end = (datetime.fromtimestamp(float(t)).strftime('%Y-%m-%d %H:%M:%S,%f')[:-3] for t in (timestamps[0], timestamps[-1]))
+        return start, end, header["count"]
+
+    with open(file_path, 'rb') as f:
+        lines = f.read().splitlines()
+    rows = [line for line in lines[1:] if line.strip()]
+    if not rows:
+        return None, None, 0
+
+    def timestamp(row):
+        # Rows look like "2025-03-13 14:07:54,294",0.594000
+        return row.decode().rsplit(',', 1)[0].strip('"')
+
+    return timestamp(rows[0]), timestamp(rows[-1]), len(rows)
+
+
+class BatchArchiver:
+    """
+    Packs several ADC batches into one gzip-compressed tar object so a
+    cellular link pays for one request and TLS handshake per archive instead
+    of one per 30 s batch.
+
+    Each archive holds the batch files and a manifest.json listing every
+    batch's number, file name, sample count and time range. Archives are
+    uploaded under the same BFAx/ prefix as single batches:
+    BFAx/archives/BFAx_Batch<first>-<last>_<timestamp>.tar.gz
+
+    Args:
+        uploader (S3Uploader): Uploader the archives are submitted to.
+        staging_dir (str): Directory archives are built in before upload.
+        max_batches (int): Flush once this many batches of a device are pending.
+        max_age (float): Flush once the oldest pending batch is this many seconds old.
+        log (logging.Logger): Service logger to report to.
+    """
+
+    def __init__(self, uploader, staging_dir, max_batches=10, max_age=300.0, log=None):
+        self.uploader = uploader
+        self.staging_dir = staging_dir
+        self.max_batches = max(1, int(max_batches))
+        self.max_age = max_age
+        self.logger = log or logger
+        self._pending = {}
+        self._first_added = {}
+        os.makedirs(staging_dir, exist_ok=True)
+
+    def add(self, file_path):
+        """
+        Adds a batch to its device's pending archive, flushing it if full.
+        Files that are not named like a batch are uploaded on their own.
+        """
+        match = BATCH_FILE_PATTERN.search(os.path.basename(file_path))
+        if not match:
+            self.logger.warning(f"{file_path} is not a batch file, uploading it on its own.")
+            return self.uploader.submit(file_path)
+
+        device = match.group(1)
+        self._pending.setdefault(device, []).append(file_path)
+        self._first_added.setdefault(device, time.monotonic())
+        if len(self._pending[device]) >= self.max_batches:
+            return self.flush(device)
+        return None
+
+    def flush_if_due(self):
+        """Flushes every device whose oldest pending batch is older than max_age."""
+        now = time.monotonic()
+        for device, first_added in list(self._first_added.items()):
+            if now - first_added >= self.max_age:
+                self.flush(device)
+
+    def flush(self, device=None):
+        """
+        Builds and submits the archive for one device, or for all devices
+        when device is None.
+
+        Returns:
+            concurrent.futures.Future: Upload of the last archive built, or
+            None if nothing was pending.
+        """
+        devices = [device] if device else list(self._pending)
+        future = None
+        for dev in devices:
+            paths = self._pending.pop(dev, [])
+            self._first_added.pop(dev, None)
+            if paths:
+                future = self._submit_archive(dev, paths)
+        return future
+
+    def build_archive(self, device, paths):
+        """
+        Writes the archive for the given batches into staging_dir.
+
+        Returns:
+            tuple: (archive path, S3 key, manifest dict)
+        """
+        batches = []
+        for path in paths:
+            file_name = os.path.basename(path)
+            start, end, samples = read_time_range(path)
+            batches.append({
+                "batch_number": batch_number_of(file_name),
+                "file_name": file_name,
+                "start": start,
+                "end": end,
+                "samples": samples,
+            })
+        batches.sort(key=lambda b: b["batch_number"])
+        manifest = {"device": device, "created": time.time(), "batches": batches}
+
+        first = batches[0]
+        timestamp = BATCH_FILE_PATTERN.search(first["file_name"]).group(3)
+        archive_name = f"{device}_Batch{first['batch_number']}-{batches[-1]['batch_number']}_{timestamp}.tar.gz"
+        archive_path = os.path.join(self.staging_dir, archive_name)
+
+        manifest_bytes = json.dumps(manifest, indent=2).encode('utf-8')
+        with tarfile.open(archive_path, 'w:gz') as tar:
+            info = tarfile.TarInfo('manifest.json')
+            info.size = len(manifest_bytes)
+            info.mtime = int(manifest["created"])
+            tar.addfile(info, io.BytesIO(manifest_bytes))
+            for path in sorted(paths, key=lambda p: batch_number_of(os.path.basename(p))):
+                tar.add(path, arcname=os.path.basename(path))
+
+        return archive_path, f"{device}/archives/{archive_name}", manifest
+
+    def _submit_archive(self, device, paths):
+        try:
+            archive_path, s3_key, manifest = self.build_archive(device, paths)
+        except (OSError, tarfile.TarError) as e:
+            self.logger.error(f"Failed to build archive for {device}, uploading batches individually: {e}")
+            for path in paths:
+                self.uploader.submit(path)
+            return None
+
+        self.logger.info(f"Archived {len(paths)} batches of {device} into {archive_path}")
+        future = self.uploader.submit(archive_path, s3_key)
+
+        def remove_staged(f):
+            # The batches stay on disk; the staged archive is removed either way. After a
+            # failure its batches are still pending in the catalog and catch-up sends them.
+            try:
+                uploaded = f.result()
+            except Exception as e:
+                self.logger.error(f"Archive upload of {archive_path} raised: {e!r}")
+                uploaded = False
+            if uploaded:
+                for path in paths:
+                    self.uploader.mark_uploaded(path)
+            else:
+                self.logger.error(f"Archive upload failed, its {len(paths)} batches are left to catch-up: {archive_path}")
+            try:
+                os.remove(archive_path)
+            except OSError as e:
+                self.logger.warning(f"Could not remove staged archive {archive_path}: {e}")
+
+        future.add_done_callback(remove_staged)
+        return future
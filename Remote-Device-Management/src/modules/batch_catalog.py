@@ -0,0 +1,326 @@
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+BATCH_NAME_PATTERN = re.compile(r"(BFA\d+)_Batch(\d+)_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.(csv|adcb)$")
+
+# Upload states
+PENDING = 'pending'
+UPLOADED = 'uploaded'
+# Batches found on disk when the catalog was first built; their upload state is unknown
+LEGACY = 'legacy'
+# Kept on the device by S3_UPLOAD_POLICY (only the summary was uploaded)
+LOCAL = 'local'
+# Deleted from the device by the retention manager after upload
+EVICTED = 'evicted'
+
+# Path of a batch rolled into a daily archive: <archive path>#<member name>
+ARCHIVE_MEMBER_SEPARATOR = '#'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    device TEXT NOT NULL,
+    batch_number INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    start_time REAL,
+    end_time REAL,
+    created_at REAL NOT NULL,
+    state TEXT NOT NULL,
+    uploaded_at REAL,
+    classification TEXT,
+    PRIMARY KEY (device, batch_number)
+);
+CREATE INDEX IF NOT EXISTS batches_path ON batches (path);
+CREATE INDEX IF NOT EXISTS batches_state ON batches (state, end_time);
+CREATE TABLE IF NOT EXISTS counters (
+    device TEXT PRIMARY KEY,
+    last_batch INTEGER NOT NULL
+);
+"""
+
+
+def parse_batch_filename(file_name):
+    """
+    Parses BFAx_BatchN_<YYYY-MM-DD_HH-MM-SS>.(csv|adcb).
+
+    Returns:
+        tuple: (device, batch number, timestamp string), or None if the name
+        is not a batch file.
+    """
+    match = BATCH_NAME_PATTERN.search(file_name)
+    if not match:
+        return None
+    return match.group(1), int(match.group(2)), match.group(3)
+
+
+_COLUMNS = "device, batch_number, path, start_time, end_time, created_at, state, uploaded_at, classification"
+
+
+def default_catalog_path():
+    return os.getenv('BATCH_CATALOG_PATH') or os.path.join(os.getenv('BASE_DIRECTORY', '.'), 'data', 'batch_catalog.sqlite3')
+
+
+class BatchCatalog:
+    """
+    Persistent index of ADC batches shared by the sampler and the uploaders.
+
+    Records each batch's device, number, path, time range and upload state in
+    SQLite (WAL mode, so the sampler and uploader processes can use it at the
+    same time). The last batch number per device is kept in its own row, so
+    finding the next number at startup is a single primary-key lookup instead
+    of listing and regex-matching the whole batch directory.
+
+    Args:
+        path (str): SQLite database file, default_catalog_path() when not given.
+        timeout (float): Seconds to wait for another process's write lock.
+    """
+
+    def __init__(self, path=None, timeout=10.0):
+        self.path = path or default_catalog_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # Catalogs created before batches had a classification column
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(batches)")}
+        if "classification" not in columns:
+            self._conn.execute("ALTER TABLE batches ADD COLUMN classification TEXT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def last_batch_number(self, device):
+        """Returns the highest batch number recorded for device, or None."""
+        rows = self._execute("SELECT last_batch FROM counters WHERE device = ?", (device,))
+        return rows[0][0] if rows else None
+
+    def next_batch_number(self, device):
+        last = self.last_batch_number(device)
+        return (last or 0) + 1
+
+    def add_batch(self, device, batch_number, path, start_time=None, end_time=None, state=PENDING, classification=None):
+        """Records a newly written batch and advances the device's counter."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO batches (device, batch_number, path, start_time, end_time, created_at, state, classification) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (device, batch_number, path, start_time, end_time, time.time(), state, classification),
+                )
+                self._conn.execute(
+                    "INSERT INTO counters (device, last_batch) VALUES (?, ?) "
+                    "ON CONFLICT(device) DO UPDATE SET last_batch = MAX(last_batch, excluded.last_batch)",
+                    (device, batch_number),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def mark_uploaded(self, path):
+        """
+        Marks the batch stored at path as uploaded.
+
+        Returns:
+            bool: False if the path is not in the catalog.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE batches SET state = ?, uploaded_at = ? WHERE path = ?",
+                (UPLOADED, time.time(), path),
+            )
+            return cursor.rowcount > 0
+
+    def mark_local(self, path):
+        """Marks a pending batch as kept on the device, not to be uploaded."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE batches SET state = ? WHERE path = ? AND state = ?",
+                (LOCAL, path, PENDING),
+            )
+            return cursor.rowcount > 0
+
+    def update_path(self, old_path, new_path):
+        """Follows a batch that was moved, e.g. into the backup directory."""
+        self._execute("UPDATE batches SET path = ? WHERE path = ?", (new_path, old_path))
+
+    def update_paths(self, moves):
+        """update_path() for many (old_path, new_path) pairs in one transaction."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("UPDATE batches SET path = ? WHERE path = ?", [(new, old) for old, new in moves])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def mark_evicted(self, paths):
+        """Marks batches deleted from the device. Only uploaded or LOCAL batches are changed."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "UPDATE batches SET state = ? WHERE path = ? AND state IN (?, ?)",
+                    [(EVICTED, path, UPLOADED, LOCAL) for path in paths],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def retained(self, states, suffix=None, exclude_suffix=None, created_before=None, limit=None):
+        """
+        Lists batches in any of states still stored as loose files (not in a
+        daily archive), oldest first. Used by the retention manager.
+
+        Args:
+            states (iterable): Upload states to include.
+            suffix (str): Only paths ending in suffix, e.g. '.gz'.
+            exclude_suffix (str): Leave out paths ending in this suffix.
+            created_before (float): Only batches cataloged before this time.
+            limit (int): Maximum number of batches returned.
+        """
+        states = list(states)
+        sql = (f"SELECT {_COLUMNS} FROM batches WHERE state IN ({', '.join('?' * len(states))}) "
+               f"AND instr(path, '{ARCHIVE_MEMBER_SEPARATOR}') = 0")
+        params = states
+        if suffix is not None:
+            sql += " AND path LIKE ?"
+            params.append('%' + suffix)
+        if exclude_suffix is not None:
+            sql += " AND path NOT LIKE ?"
+            params.append('%' + exclude_suffix)
+        if created_before is not None:
+            sql += " AND created_at < ?"
+            params.append(created_before)
+        sql += " ORDER BY end_time, batch_number"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def archived(self, archive_path):
+        """Returns the paths of the batches recorded in a daily archive."""
+        # A range on the path index: every '<archive>#...' sorts between '<archive>#' and '<archive>$'
+        start = archive_path + ARCHIVE_MEMBER_SEPARATOR
+        end = archive_path + chr(ord(ARCHIVE_MEMBER_SEPARATOR) + 1)
+        rows = self._execute("SELECT path FROM batches WHERE path >= ? AND path < ?", (start, end))
+        return [row[0] for row in rows]
+
+    def get(self, path):
+        """Returns the catalog row for path as a dict, or None."""
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT {_COLUMNS} FROM batches WHERE path = ?", (path,))
+            columns = [c[0] for c in cursor.description]
+            row = cursor.fetchone()
+        return dict(zip(columns, row)) if row else None
+
+    def batches(self, state=None, limit=None):
+        """Lists batches, optionally filtered by state, oldest first."""
+        sql = f"SELECT {_COLUMNS} FROM batches"
+        params = []
+        if state is not None:
+            sql += " WHERE state = ?"
+            params.append(state)
+        sql += " ORDER BY end_time, batch_number"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def upload_backlog(self, limit=None, skip_normal=False, created_before=None):
+        """
+        Lists pending batches in the order they should be uploaded: batches
+        the leak detector flagged first, then newest first.
+
+        Args:
+            limit (int): Maximum number of batches returned.
+            skip_normal (bool): Leave out batches classified NORMAL.
+            created_before (float): Only batches cataloged before this time.
+        """
+        sql = f"SELECT {_COLUMNS} FROM batches WHERE state = ?"
+        params = [PENDING]
+        if skip_normal:
+            sql += " AND classification IS NOT 'NORMAL'"
+        if created_before is not None:
+            sql += " AND created_at < ?"
+            params.append(created_before)
+        sql += " ORDER BY classification IS 'LEAKED' DESC, end_time DESC, batch_number DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def count(self, state, classification=None):
+        """Returns the number of batches in state (and with classification, if given)."""
+        if classification is None:
+            rows = self._execute("SELECT COUNT(*) FROM batches WHERE state = ?", (state,))
+        else:
+            rows = self._execute("SELECT COUNT(*) FROM batches WHERE state = ? AND classification = ?", (state, classification))
+        return rows[0][0]
+
+    def import_directory(self, *directories):
+        """
+        Adds batch files found on disk that the catalog does not know yet,
+        in state LEGACY. Used once to build the catalog from an existing
+        batch directory; costs one directory listing.
+
+        Returns:
+            int: Number of batches added.
+        """
+        rows = []
+        for directory in directories:
+            if not directory or not os.path.isdir(directory):
+                continue
+            for file_name in os.listdir(directory):
+                parsed = parse_batch_filename(file_name)
+                if parsed:
+                    device, batch_number, _ = parsed
+                    rows.append((device, batch_number, os.path.join(directory, file_name)))
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO batches (device, batch_number, path, created_at, state) VALUES (?, ?, ?, ?, ?)",
+                    [(device, n, path, now, LEGACY) for device, n, path in rows],
+                )
+                added = self._conn.total_changes - before
+                self._conn.execute(
+                    "INSERT INTO counters (device, last_batch) "
+                    "SELECT device, MAX(batch_number) FROM batches WHERE true GROUP BY device "
+                    "ON CONFLICT(device) DO UPDATE SET last_batch = MAX(last_batch, excluded.last_batch)"
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return added
@@ -0,0 +1,212 @@
+"""
+Disk retention for the batch directories.
+
+The sampler writes a batch every ~30 s forever; left alone that fills the SD
+card and stops acquisition. RetentionManager keeps the disk below a high
+watermark, in three steps per run:
+
+    compress  uploaded batches older than compress_after are gzipped in
+              place (BFA1_BatchN_<time>.csv -> .csv.gz)
+    roll      compressed batches from past days are appended to one
+              uncompressed tar per device and day (<archive_dir>/BFA1_<day>.tar,
+              appendable when a late upload lands), and the loose files removed
+    evict     above high_watermark, daily archives and then loose uploaded
+              batches are deleted oldest first until usage is below
+              low_watermark
+
+Only batches the catalog records as UPLOADED are compressed, archived or
+deleted. LOCAL batches (kept on the device by S3_UPLOAD_POLICY, only their
+summary uploaded) were never uploaded at full resolution, so they are left
+alone unless evict_local is set. PENDING and LEGACY batches are never
+touched; if they alone keep the disk above the low watermark, that is logged.
+"""
+import os
+import re
+import gzip
+import time
+import shutil
+import tarfile
+import logging
+from collections import defaultdict
+from batch_catalog import UPLOADED, LOCAL, ARCHIVE_MEMBER_SEPARATOR
+
+logger = logging.getLogger(__name__)
+
+GZIP_SUFFIX = '.gz'
+_BATCH_DAY = re.compile(r"(BFA\d+)_Batch\d+_(\d{4}-\d{2}-\d{2})_")
+_ARCHIVE_NAME = re.compile(r"(BFA\d+)_(\d{4}-\d{2}-\d{2})\.tar$")
+
+
+class RetentionManager:
+    """
+    Args:
+        catalog (BatchCatalog): Catalog recording upload state and paths.
+        directory (str): Batch directory whose filesystem is watched.
+        archive_dir (str): Where daily archives are written.
+        high_watermark (float): Used fraction of the disk that starts eviction.
+        low_watermark (float): Used fraction eviction stops at.
+        compress_after (float): Seconds after cataloging before a batch is compressed.
+        evict_local (bool): Also compress, archive and evict LOCAL batches,
+            whose full data exists only on the device.
+        gzip_level (int): Compression level, 1 (fast) to 9 (small).
+        batch_limit (int): Most batches compressed per run.
+        disk_usage (callable): shutil.disk_usage or a stand-in returning (total, used, free).
+        clock (callable): Wall clock, for compress_after and the current day.
+        log (logging.Logger): Service logger to report to.
+    """
+
+    def __init__(self, catalog, directory, archive_dir, high_watermark=0.85, low_watermark=0.70, compress_after=600.0,
+                 evict_local=False, gzip_level=6, batch_limit=1000, disk_usage=shutil.disk_usage, clock=time.time, log=None):
+        if not 0 < low_watermark < high_watermark <= 1:
+            raise ValueError("watermarks must satisfy 0 < low < high <= 1")
+        self.catalog = catalog
+        self.directory = directory
+        self.archive_dir = archive_dir
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.compress_after = compress_after
+        self.states = (UPLOADED, LOCAL) if evict_local else (UPLOADED,)
+        self.gzip_level = gzip_level
+        self.batch_limit = batch_limit
+        self.disk_usage = disk_usage
+        self.clock = clock
+        self.logger = log or logger
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def run_once(self):
+        """
+        Compresses, rolls and (above the high watermark) evicts.
+
+        Returns:
+            dict: What this run did.
+        """
+        return {
+            "compressed": self.compress(),
+            "archived": self.roll_daily_archives(),
+            "freed_bytes": self.evict(),
+        }
+
+    # Compression
+
+    def _gzip(self, path):
+        tmp_path = path + GZIP_SUFFIX + '.tmp'
+        with open(path, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=self.gzip_level) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp_path, path + GZIP_SUFFIX)
+        return path + GZIP_SUFFIX
+
+    def compress(self):
+        """Gzips uploaded batches in place. Returns the number compressed."""
+        rows = self.catalog.retained(self.states, exclude_suffix=GZIP_SUFFIX,
+                                     created_before=self.clock() - self.compress_after, limit=self.batch_limit)
+        moves = []
+        for row in rows:
+            try:
+                moves.append((row["path"], self._gzip(row["path"])))
+            except OSError as e:
+                self.logger.warning(f"Could not compress {row['path']}: {e}")
+        if moves:
+            # Catalog first: a crash before the originals are removed only leaves a file to recompress
+            self.catalog.update_paths(moves)
+            for path, _ in moves:
+                os.remove(path)
+            self.logger.info(f"Compressed {len(moves)} uploaded batches")
+        return len(moves)
+
+    # Daily archives
+
+    def _day(self, row):
+        match = _BATCH_DAY.search(os.path.basename(row["path"]))
+        if match:
+            return match.group(1), match.group(2)
+        if row["end_time"] is not None:
+            return row["device"], time.strftime('%Y-%m-%d', time.localtime(row["end_time"]))
+        return None
+
+    def archive_path(self, device, day):
+        return os.path.join(self.archive_dir, f"{device}_{day}.tar")
+
+    def roll_daily_archives(self):
+        """Moves compressed batches of past days into daily archives. Returns the number moved."""
+        today = time.strftime('%Y-%m-%d', time.localtime(self.clock()))
+        days = defaultdict(list)
+        for row in self.catalog.retained(self.states, suffix=GZIP_SUFFIX):
+            key = self._day(row)
+            if key is not None and key[1] < today:
+                days[key].append(row["path"])
+
+        archived = 0
+        for (device, day), paths in sorted(days.items(), key=lambda item: item[0][1]):
+            archive = self.archive_path(device, day)
+            moves = []
+            with tarfile.open(archive, 'a') as tar:
+                for path in paths:
+                    try:
+                        tar.add(path, arcname=os.path.basename(path))
+                    except OSError as e:
+                        self.logger.warning(f"Could not archive {path}: {e}")
+                        continue
+                    moves.append((path, archive + ARCHIVE_MEMBER_SEPARATOR + os.path.basename(path)))
+            with open(archive, 'rb') as f:
+                os.fsync(f.fileno())
+            self.catalog.update_paths(moves)
+            for path, _ in moves:
+                os.remove(path)
+            archived += len(moves)
+            self.logger.info(f"Rolled {len(moves)} batches into {archive}")
+        return archived
+
+    # Eviction
+
+    def usage(self):
+        total, used, _ = self.disk_usage(self.directory)
+        return used / total if total else 0.0
+
+    def evict(self):
+        """
+        Deletes archives, then loose uploaded batches, oldest first while
+        the disk is above the high watermark. Returns the bytes freed.
+        """
+        total, used, _ = self.disk_usage(self.directory)
+        if not total or used / total < self.high_watermark:
+            return 0
+        to_free = used - self.low_watermark * total
+        freed = 0
+
+        archives = []
+        for name in os.listdir(self.archive_dir):
+            match = _ARCHIVE_NAME.match(name)
+            if match:
+                archives.append((match.group(2), os.path.join(self.archive_dir, name)))
+        for _, archive in sorted(archives):
+            if freed >= to_free:
+                break
+            size = os.path.getsize(archive)
+            members = self.catalog.archived(archive)
+            os.remove(archive)
+            self.catalog.mark_evicted(members)
+            freed += size
+            self.logger.info(f"Evicted {archive} ({len(members)} batches, {size} bytes)")
+
+        while freed < to_free:
+            rows = self.catalog.retained(self.states, limit=self.batch_limit)
+            if not rows:
+                break
+            evicted = []
+            for row in rows:
+                if freed >= to_free:
+                    break
+                try:
+                    size = os.path.getsize(row["path"])
+                    os.remove(row["path"])
+                except FileNotFoundError:
+                    size = 0
+                evicted.append(row["path"])
+                freed += size
+            self.catalog.mark_evicted(evicted)
+            self.logger.info(f"Evicted {len(evicted)} uploaded batches")
+
+        if freed < to_free:
+            self.logger.warning(f"Disk still above the {self.low_watermark:.0%} low watermark; "
+                                f"the remaining batches are not uploaded yet")
+        return freed
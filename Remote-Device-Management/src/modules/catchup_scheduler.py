@@ -0,0 +1,191 @@
+"""
+Catch-up uploads of batches that missed the live upload path.
+
+Batches written while the network, the queue server or s3_event_manager was
+down are left PENDING in the batch catalog. CatchUpScheduler drains them in
+slices: batches the leak detector flagged first, then newest first (recent
+data is the most useful if the link drops again). Under the 'flagged' upload
+policy, batches classified NORMAL are marked LOCAL instead of uploaded, as
+s3_event_manager would have done.
+
+Catch-up uploads are paced by a bandwidth budget and give way to live
+uploads: while live_busy() reports work (and for live_grace seconds after),
+the slice ends and the rest waits for the next one. Batches younger than
+min_age are left alone: the live path may have taken them off the queue
+and still be uploading them or holding them for an archive.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from batch_catalog import PENDING
+
+logger = logging.getLogger(__name__)
+
+
+class BandwidthBudget:
+    """
+    Token bucket in bytes: refills at `rate` bytes/s up to `burst` bytes,
+    starting empty. An upload larger than the bucket takes it into debt, so
+    the next one waits until it is paid off.
+
+    Args:
+        rate (float): Bytes per second, 0 or None for no limit.
+        burst (float): Bucket size in bytes, one second's worth by default.
+        clock (callable): Monotonic time source.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate or 0)
+        self.burst = float(burst if burst is not None else self.rate)
+        self._clock = clock
+        self._tokens = 0.0
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self):
+        """Seconds until the budget allows another upload."""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        return max(0.0, -self._tokens / self.rate)
+
+    def consume(self, nbytes):
+        if self.rate:
+            self._refill()
+            self._tokens -= nbytes
+
+
+class CatchUpScheduler:
+    """
+    Drains the catalog's upload backlog.
+
+    Args:
+        catalog (BatchCatalog): Catalog to take PENDING batches from.
+        upload (callable): Uploads one file and records it (marks it
+            uploaded, moves it); returns True on success.
+        bandwidth (float): Catch-up budget in bytes/s, 0 for no limit.
+        live_busy (callable): Returns True while live uploads are waiting.
+        live_grace (float): Seconds to keep yielding after live work was seen.
+        min_age (float): Seconds since a batch was cataloged before catch-up
+            takes it; should exceed the time the live path can hold one.
+        upload_policy (str): 'flagged' keeps NORMAL batches local, 'all'
+            uploads them too.
+        page_size (int): Batches read from the catalog per query.
+        rate_window (float): Seconds the drain rate is averaged over.
+        stop_event (threading.Event): Ends a slice early when set.
+        log (logging.Logger): Service logger to report to.
+    """
+
+    def __init__(self, catalog, upload, bandwidth=0, live_busy=None, live_grace=10.0, min_age=0.0, upload_policy='flagged',
+                 page_size=64, rate_window=300.0, stop_event=None, log=None):
+        self.catalog = catalog
+        self.upload = upload
+        self.budget = BandwidthBudget(bandwidth)
+        self.live_busy = live_busy or (lambda: False)
+        self.live_grace = live_grace
+        self.min_age = min_age
+        self.skip_normal = upload_policy == 'flagged'
+        self.page_size = page_size
+        self.rate_window = rate_window
+        self.stop_event = stop_event or threading.Event()
+        self.logger = log or logger
+        self._last_live = float('-inf')
+        self._recent = deque()
+        self._attempted = set()
+        self.stats = {"uploaded": 0, "uploaded_bytes": 0, "failed": 0, "kept_local": 0, "missing": 0, "yields": 0}
+
+    def _live(self):
+        try:
+            busy = self.live_busy()
+        except Exception as e:
+            self.logger.debug(f"Live upload check failed: {e}")
+            busy = False
+        now = time.monotonic()
+        if busy:
+            self._last_live = now
+        return now - self._last_live < self.live_grace
+
+    def _next_batches(self):
+        # Each batch is tried once per slice; one that failed (or stayed PENDING) waits for the next slice
+        created_before = time.time() - self.min_age if self.min_age else None
+        rows = self.catalog.upload_backlog(limit=self.page_size + len(self._attempted), created_before=created_before)
+        return [row for row in rows if row["path"] not in self._attempted][:self.page_size]
+
+    def run_once(self, max_seconds=None):
+        """
+        Drains the backlog until it is empty, live uploads need the link,
+        the time slice is used up or stop_event is set.
+
+        Returns:
+            int: Batches uploaded in this slice.
+        """
+        deadline = time.monotonic() + max_seconds if max_seconds else float('inf')
+        self._attempted.clear()
+        uploaded = 0
+        while not self.stop_event.is_set():
+            batches = self._next_batches()
+            if not batches:
+                break
+            for batch in batches:
+                if self.stop_event.is_set() or time.monotonic() >= deadline:
+                    return uploaded
+                if self._live():
+                    self.stats["yields"] += 1
+                    self.logger.debug("Live uploads pending, pausing catch-up")
+                    return uploaded
+                path = batch["path"]
+                if self.skip_normal and batch["classification"] == 'NORMAL':
+                    self.catalog.mark_local(path)
+                    self.stats["kept_local"] += 1
+                    continue
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    self.logger.warning(f"Pending batch {path} is missing; leaving it out of the catch-up")
+                    self.stats["missing"] += 1
+                    self._attempted.add(path)
+                    continue
+
+                wait = self.budget.wait_time()
+                if wait > 0 and self.stop_event.wait(min(wait, max(0.0, deadline - time.monotonic()))):
+                    return uploaded
+                if self.budget.wait_time() > 0:
+                    continue
+                self.budget.consume(size)
+                self._attempted.add(path)
+                if self.upload(path):
+                    uploaded += 1
+                    self.stats["uploaded"] += 1
+                    self.stats["uploaded_bytes"] += size
+                    self._recent.append((time.monotonic(), size))
+                else:
+                    self.stats["failed"] += 1
+        return uploaded
+
+    def metrics(self):
+        """Backlog size and drain rate, for logs and the metrics file."""
+        now = time.monotonic()
+        while self._recent and now - self._recent[0][0] > self.rate_window:
+            self._recent.popleft()
+        backlog = self.catalog.count(PENDING)
+        leaked = self.catalog.count(PENDING, 'LEAKED')
+        if self._recent:
+            elapsed = max(now - self._recent[0][0], 1.0)
+            rate = len(self._recent) / elapsed
+            byte_rate = sum(size for _, size in self._recent) / elapsed
+        else:
+            rate = byte_rate = 0.0
+        return dict(
+            self.stats,
+            backlog=backlog,
+            backlog_leaked=leaked,
+            drain_per_min=round(rate * 60, 2),
+            drain_bytes_per_s=round(byte_rate),
+            eta_s=round(backlog / rate) if rate else None,
+        )
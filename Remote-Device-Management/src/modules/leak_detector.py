@@ -0,0 +1,168 @@
+"""
+Streaming negative pressure wave (NPW) leak detector.
+
+A leak shows up at the pressure transducer as a sudden, sustained drop in
+line pressure. The detector follows the signal with three filters whose
+state is carried from one call to the next, so samples can be fed in blocks
+of any size (one batch, or one acquisition block) with the same result:
+
+    signal    low-pass at signal_cutoff Hz; removes the ~50 Hz mains pickup
+              aliased near Nyquist in the 100 Hz batches
+    baseline  low-pass at baseline_cutoff Hz; the slowly moving line pressure
+    noise     running mean of |baseline - signal| at noise_cutoff Hz
+
+A detection is raised where the signal falls below the baseline by more than
+max(min_drop, threshold x noise), outside the warm-up period and the
+hold-off after the previous detection. All filtering is vectorized with
+scipy.signal.sosfilt / lfilter; only the (rare) threshold crossings are
+looked at in Python.
+"""
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi, lfilter
+
+# MONITORING event values
+LEAKED = 'LEAKED'
+NORMAL = 'NORMAL'
+
+
+class Detection:
+    __slots__ = ('index', 'time', 'drop', 'threshold')
+
+    def __init__(self, index, time, drop, threshold):
+        self.index = index
+        self.time = time
+        self.drop = drop
+        self.threshold = threshold
+
+    def __repr__(self):
+        return f"Detection(index={self.index}, time={self.time}, drop={self.drop:.3f}, threshold={self.threshold:.3f})"
+
+
+class NPWDetector:
+    """
+    Streaming NPW detector for one sensor channel.
+
+    Args:
+        sample_rate (float): Sample rate of the voltages in Hz.
+        signal_cutoff (float): Signal low-pass cutoff in Hz.
+        baseline_cutoff (float): Baseline low-pass cutoff in Hz.
+        noise_cutoff (float): Cutoff of the noise level estimate in Hz.
+        threshold (float): Drop needed, in multiples of the noise level.
+        min_drop (float): Smallest drop (volts) reported regardless of noise.
+        holdoff (float): Seconds after a detection in which no other is raised.
+        warmup (float): Seconds of signal needed before detecting, while the
+            baseline and noise estimates settle.
+    """
+
+    def __init__(self, sample_rate, signal_cutoff=5.0, baseline_cutoff=0.05, noise_cutoff=0.02,
+                 threshold=6.0, min_drop=0.03, holdoff=10.0, warmup=20.0):
+        nyquist = sample_rate / 2.0
+        self.sample_rate = float(sample_rate)
+        self.threshold = threshold
+        self.min_drop = min_drop
+        self.holdoff_samples = int(holdoff * sample_rate)
+        self.warmup_samples = int(warmup * sample_rate)
+
+        self._signal_sos = butter(2, min(signal_cutoff, 0.45 * sample_rate) / nyquist, output='sos')
+        self._baseline_sos = butter(1, min(baseline_cutoff, 0.45 * sample_rate) / nyquist, output='sos')
+        # One-pole low-pass for the noise level: y[n] = a x[n] + (1 - a) y[n-1]
+        alpha = 1.0 - np.exp(-2.0 * np.pi * noise_cutoff / sample_rate)
+        self._noise_b = np.array([alpha])
+        self._noise_a = np.array([1.0, alpha - 1.0])
+        self.reset()
+
+    def reset(self):
+        """Forgets the filter state, e.g. after a gap in acquisition."""
+        self._signal_zi = None
+        self._baseline_zi = None
+        self._noise_zi = None
+        self._noise_level = 0.0
+        self.samples_seen = 0
+        self._last_detection = -self.holdoff_samples - 1
+
+    def _start(self, first_value):
+        self._signal_zi = sosfilt_zi(self._signal_sos) * first_value
+        self._baseline_zi = sosfilt_zi(self._baseline_sos) * first_value
+        self._noise_zi = np.zeros(1)
+
+    def process(self, voltages, timestamps=None):
+        """
+        Feeds the next block of samples.
+
+        Args:
+            voltages (array-like): Samples in volts.
+            timestamps (array-like): Optional sample times, reported in the
+                detections.
+
+        Returns:
+            list: Detection objects for this block, index being the sample's
+            position in the block.
+        """
+        voltages = np.asarray(voltages, dtype=np.float64)
+        if voltages.size == 0:
+            return []
+        if self._signal_zi is None:
+            self._start(voltages[0])
+
+        signal, self._signal_zi = sosfilt(self._signal_sos, voltages, zi=self._signal_zi)
+        baseline, self._baseline_zi = sosfilt(self._baseline_sos, signal, zi=self._baseline_zi)
+        drop = baseline - signal
+        noise, self._noise_zi = lfilter(self._noise_b, self._noise_a, np.abs(drop), zi=self._noise_zi)
+
+        # Compare each sample with the noise level before it, so a drop doesn't raise its own threshold
+        previous_noise = np.empty_like(noise)
+        previous_noise[0] = self._noise_level
+        previous_noise[1:] = noise[:-1]
+        self._noise_level = noise[-1]
+        limit = np.maximum(self.min_drop, self.threshold * previous_noise)
+
+        start = self.samples_seen
+        self.samples_seen += voltages.size
+        candidates = np.flatnonzero(drop > limit)
+        detections = []
+        for i in candidates:
+            position = start + i
+            if position < self.warmup_samples or position - self._last_detection <= self.holdoff_samples:
+                continue
+            self._last_detection = position
+            detections.append(Detection(
+                int(i),
+                float(timestamps[i]) if timestamps is not None else None,
+                float(drop[i]),
+                float(limit[i]),
+            ))
+        return detections
+
+
+class BatchClassifier:
+    """
+    Runs an NPWDetector over consecutive batches and classifies each one.
+
+    Filter state carries across batches, so a drop at a batch boundary is
+    seen like any other. If a batch doesn't follow on from the previous one
+    (the sampler restarted, or batches were skipped) the detector is reset
+    and warms up again.
+
+    Args:
+        detector (NPWDetector): Detector to feed.
+        max_gap (float): Largest gap in seconds between batches still treated
+            as continuous.
+    """
+
+    def __init__(self, detector, max_gap=1.0):
+        self.detector = detector
+        self.max_gap = max_gap
+        self._last_time = None
+
+    def classify(self, timestamps, voltages):
+        """
+        Returns:
+            tuple: (LEAKED or NORMAL, list of Detection)
+        """
+        if len(timestamps) == 0:
+            return NORMAL, []
+        if self._last_time is not None and not 0 <= timestamps[0] - self._last_time <= self.max_gap:
+            self.detector.reset()
+        self._last_time = float(timestamps[-1])
+        detections = self.detector.process(voltages, timestamps)
+        return (LEAKED if detections else NORMAL), detections
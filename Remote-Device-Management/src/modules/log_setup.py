@@ -0,0 +1,155 @@
+"""
+Logging setup shared by the datalogger services.
+
+setup_logging() is called once per process, from the service's entry
+module. Records from every logger (the service logger, module loggers such
+as spool_queue and boto3's) go through a QueueHandler on the root logger to a
+QueueListener thread, which does the formatting and the disk writes. A
+logging call in the sampling loop or an awscrt callback only resolves the
+message and puts the record on an in-memory queue.
+
+Environment:
+    LOG_DIRECTORY      directory for the log files
+    LOG_LEVEL          default level (INFO)
+    LOG_LEVELS         per-logger levels, e.g. "botocore=DEBUG,spool_queue=WARNING";
+                       boto3/botocore/s3transfer/urllib3/awscrt default to WARNING
+    LOG_FORMAT         'text' (default) or 'json' for one JSON object per line
+    LOG_MAX_BYTES      size a log file rotates at (10 MB)
+    LOG_BACKUP_COUNT   rotated files kept (5)
+"""
+import os
+import sys
+import json
+import atexit
+import logging
+import logging.handlers
+from queue import SimpleQueue
+from datetime import datetime, timezone
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Libraries that log every request at DEBUG/INFO
+QUIET_LOGGERS = ('boto3', 'botocore', 's3transfer', 'urllib3', 'awscrt', 'awsiot')
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and, if any, exception."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # The stock prepare() copies the record and formats all of it in the
+    # calling thread. Only the message (and any traceback) has to be resolved
+    # there, while the arguments and exception are still valid; the listener
+    # formats the rest. The record is changed in place: this handler sits on
+    # the root logger, the last (and only) one to see it.
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_levels(spec):
+    """Parses "name=LEVEL,name=LEVEL" into {name: level number}."""
+    levels = {}
+    for item in (spec or '').split(','):
+        name, _, level = item.strip().partition('=')
+        if name and level:
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return {name: level for name, level in levels.items() if isinstance(level, int)}
+
+
+def make_formatter(log_format=None, text_format=TEXT_FORMAT):
+    if (log_format or os.getenv('LOG_FORMAT', 'text')).lower() == 'json':
+        return JsonFormatter()
+    return logging.Formatter(text_format, datefmt=DATE_FORMAT)
+
+
+def setup_logging(logger_name, log_file, console=False, text_format=TEXT_FORMAT):
+    """
+    Sends all logging in this process to LOG_DIRECTORY/log_file through a
+    background writer thread and returns the service logger.
+
+    Args:
+        logger_name (str): Name of the service logger, e.g. os.getenv('LOGGER_ADC').
+        log_file (str): File name in LOG_DIRECTORY.
+        console (bool): Also write to stderr.
+        text_format (str): Record format when LOG_FORMAT is 'text'.
+
+    Returns:
+        logging.Logger: The service logger.
+    """
+    global _listener
+    logger = logging.getLogger(logger_name)
+    if _listener is not None:
+        return logger
+
+    level = logging.getLevelName(os.getenv('LOG_LEVEL', 'INFO').upper())
+    level = level if isinstance(level, int) else logging.INFO
+    formatter = make_formatter(text_format=text_format)
+
+    log_dir = os.getenv('LOG_DIRECTORY', '.')
+    os.makedirs(log_dir, exist_ok=True)
+    handlers = [logging.handlers.RotatingFileHandler(
+        os.path.join(log_dir, log_file),
+        maxBytes=int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+        backupCount=int(os.getenv('LOG_BACKUP_COUNT', '5')),
+        encoding='utf-8',
+    )]
+    if console:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # Neither format uses the caller's file/line or process names; skip looking them up on every call
+    logging._srcfile = None
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    records = SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(records))
+    root.setLevel(level)
+    logger.setLevel(level)
+
+    levels = {name: logging.WARNING for name in QUIET_LOGGERS}
+    levels.update(parse_levels(os.getenv('LOG_LEVELS')))
+    for name, name_level in levels.items():
+        logging.getLogger(name).setLevel(name_level)
+
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return logger
+
+
+def stop_logging():
+    """Writes out queued records and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,361 @@
+"""
+Counters, gauges and histograms for the datalogger services.
+
+Modules define their metrics once, at import, the way they get their logger:
+
+    batches_written = metrics.counter('adc_batches_total', 'Batches persisted')
+    write_seconds = metrics.histogram('adc_batch_write_seconds', 'Time to write a batch file')
+
+and update them where the work happens (inc(), set(), observe(), timer()).
+An update is a lock and an add, well under a microsecond; formatting only
+happens when the metrics are read. Counters and gauges can also be given a
+function, called at read time, for values the code already tracks (queue
+depths, in-flight counts, stats dicts) so they cost nothing in between.
+
+Each service process has its own registry and exposes it with
+start_metrics(): Prometheus text format over HTTP on a local port and/or a
+snapshot file rewritten every METRICS_INTERVAL seconds (in the format of
+node_exporter's textfile collector, so either can be scraped).
+
+Environment:
+    METRICS_HOST       address the HTTP endpoint binds to (127.0.0.1)
+    METRICS_DIRECTORY  directory for snapshot files given as bare names (.)
+    METRICS_INTERVAL   seconds between snapshot writes (15)
+"""
+import os
+import math
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans a spool fsync to a multipart upload
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter:
+    """Monotonically increasing count; read from func at collection time if one is given."""
+
+    kind = 'counter'
+
+    def __init__(self, func=None):
+        self.value = 0
+        self.func = func
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        if self.func is None:
+            return [(name, labels, self.value)]
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.debug(f"Metric {name} unavailable: {e}")
+            return []
+        return [] if value is None else [(name, labels, value)]
+
+
+class Gauge(Counter):
+    """Value that goes up and down; read from func at collection time if one is given."""
+
+    kind = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets, with their sum
+    and count, as Prometheus histograms are exposed.
+
+    Args:
+        buckets (tuple): Upper bounds of the buckets, ascending; +Inf is added.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def observe_many(self, values):
+        """Observes every value of an array at once, e.g. the sample intervals of a batch."""
+        import numpy as np
+        values = np.asarray(values, dtype=np.float64)
+        if not values.size:
+            return
+        counts = np.bincount(np.searchsorted(self.buckets, values, side='left'), minlength=len(self._counts))
+        total = float(values.sum())
+        with self._lock:
+            for index, count in enumerate(counts.tolist()):
+                self._counts[index] += count
+            self._sum += total
+
+    def timer(self):
+        """Context manager that observes the seconds its with-block took."""
+        return _Timer(self)
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            result.append((name + '_bucket', labels + (('le', _format_value(bound)),), cumulative))
+        result.append((name + '_sum', labels, total))
+        result.append((name + '_count', labels, cumulative))
+        return result
+
+
+class _Timer:
+    # A plain class rather than @contextmanager, which costs several times more per block
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    """
+    The metrics of one process, by name and label set. Asking for a metric
+    that already exists returns it, so modules can define theirs at import.
+    """
+
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = (cls.kind, help, {})
+            elif family[0] != cls.kind:
+                raise ValueError(f"Metric {name} is already registered as a {family[0]}")
+            series = family[2]
+            if key not in series:
+                series[key] = cls(**kwargs)
+            return series[key]
+
+    def counter(self, name, help, labels=None, func=None):
+        return self._with_func(self._get(Counter, name, help, labels), func)
+
+    def gauge(self, name, help, labels=None, func=None):
+        return self._with_func(self._get(Gauge, name, help, labels), func)
+
+    @staticmethod
+    def _with_func(metric, func):
+        # The latest owner of the series reports it, e.g. a queue reopened under the same name
+        if func is not None:
+            metric.func = func
+        return metric
+
+    def histogram(self, name, help, labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        with self._lock:
+            families = [(name, kind, help, list(series.items())) for name, (kind, help, series) in sorted(self._families.items())]
+        lines = []
+        for name, kind, help, series in families:
+            lines.append(f"# HELP {name} {_escape_help(help)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in series:
+                for sample_name, sample_labels, value in metric.samples(name, labels):
+                    lines.append(f"{sample_name}{_format_labels(sample_labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    value = float(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+# The process-wide registry used by the module-level helpers
+REGISTRY = Registry()
+
+_exporter = None
+_exporter_started = False
+
+
+def counter(name, help, labels=None, func=None):
+    return REGISTRY.counter(name, help, labels, func)
+
+
+def gauge(name, help, labels=None, func=None):
+    return REGISTRY.gauge(name, help, labels, func)
+
+
+def histogram(name, help, labels=None, buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, help, labels, buckets)
+
+
+# Exposition
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would otherwise print every request to stderr
+        logger.debug("Metrics request: " + format % args)
+
+
+class MetricsExporter:
+    """
+    Serves a registry over HTTP and/or writes it to a snapshot file, each
+    from a daemon thread.
+
+    Args:
+        registry (Registry): Metrics to expose.
+        port (int): Port for the HTTP endpoint; no endpoint when not given.
+        host (str): Address to bind the endpoint to.
+        snapshot_file (str): File rewritten every interval; none when not given.
+        interval (float): Seconds between snapshot writes.
+        log (logging.Logger): Service logger to report to.
+    """
+
+    def __init__(self, registry=REGISTRY, port=None, host='127.0.0.1', snapshot_file=None, interval=15.0, log=None):
+        self.registry = registry
+        self.snapshot_file = snapshot_file
+        self.interval = interval
+        self.logger = log or logger
+        self.server = None
+        self._stop = threading.Event()
+        self._threads = []
+        if port is not None:
+            handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+            self.server = ThreadingHTTPServer((host, int(port)), handler)
+            self.server.daemon_threads = True
+            self._threads.append(threading.Thread(target=self.server.serve_forever, name='metrics_http', daemon=True))
+            self.logger.info(f"Metrics served on http://{host}:{self.server.server_port}/metrics")
+        if snapshot_file:
+            os.makedirs(os.path.dirname(os.path.abspath(snapshot_file)), exist_ok=True)
+            self._threads.append(threading.Thread(target=self._snapshot_loop, name='metrics_snapshot', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def write_snapshot(self):
+        """Replaces the snapshot file atomically, so a reader never sees half of it."""
+        tmp_path = self.snapshot_file + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.registry.render())
+        os.replace(tmp_path, self.snapshot_file)
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                self.logger.warning(f"Could not write metrics snapshot {self.snapshot_file}: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.snapshot_file:
+            try:
+                self.write_snapshot()
+            except OSError:
+                pass
+
+
+def start_metrics(port=None, snapshot_file=None, log=None):
+    """
+    Exposes this process's metrics, configured from the environment. Only
+    the first call in a process does anything (services run together by
+    supervisor.py share its exporter); later calls return its result.
+
+    Args:
+        port (str|int): HTTP port, e.g. os.getenv('METRICS_PORT_ADC'); none when empty.
+        snapshot_file (str): Snapshot file, e.g. os.getenv('METRICS_FILE_ADC'),
+            relative to METRICS_DIRECTORY; none when empty.
+        log (logging.Logger): Service logger to report to.
+
+    Returns:
+        MetricsExporter: Or None when neither is configured.
+    """
+    global _exporter, _exporter_started
+    if _exporter_started:
+        return _exporter
+    _exporter_started = True
+    if not port and not snapshot_file:
+        return None
+    if snapshot_file:
+        snapshot_file = os.path.join(os.getenv('METRICS_DIRECTORY', '.'), snapshot_file)
+    try:
+        _exporter = MetricsExporter(
+            REGISTRY,
+            port=int(port) if port else None,
+            host=os.getenv('METRICS_HOST', '127.0.0.1'),
+            snapshot_file=snapshot_file,
+            interval=float(os.getenv('METRICS_INTERVAL', '15')),
+            log=log,
+        )
+    except OSError as e:
+        # A taken port shouldn't stop the service itself
+        (log or logger).error(f"Could not start metrics exporter: {e}")
+    return _exporter
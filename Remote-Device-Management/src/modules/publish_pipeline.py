@@ -0,0 +1,247 @@
+import time
+import logging
+import threading
+from collections import deque
+from queue import Empty
+from spool_queue import SpoolQueue
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ack_seconds = metrics.histogram('mqtt_publish_ack_seconds', 'From publish to PUBACK')
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class PublishPipeline:
+    """
+    Bounded in-flight QoS1 publishing on an awscrt MQTT connection.
+
+    At most max_inflight publishes wait for their PUBACK at any time; a
+    publish that can't get a slot within publish_timeout, or that is made
+    while the connection is down, is spilled to an on-disk outbox (a
+    SpoolQueue) instead of piling up inside awscrt. When the connection comes
+    back the outbox is drained in order on a background thread, and new
+    publishes queue behind it until it is empty. A publish whose future fails
+    is spilled again, behind anything newer; for a topic with a failure
+    handler (see set_failure_handler) it is handed back to its sender instead.
+
+    The outbox keeps at most outbox_max messages; beyond that the oldest are
+    dropped and counted.
+
+    Args:
+        connection: awscrt mqtt.Connection (anything with a publish(topic,
+            payload, qos) that returns (future, packet_id)).
+        outbox_dir (str): Directory of the on-disk outbox.
+        max_inflight (int): Publishes allowed to await a PUBACK at once.
+        publish_timeout (float): Seconds to wait for a free slot before
+            spilling to the outbox.
+        outbox_max (int): Maximum messages kept in the outbox.
+        latency_window (int): Number of recent ack latencies kept for the
+            percentiles in metrics().
+        log (logging.Logger): Service logger to report to.
+    """
+
+    def __init__(self, connection, outbox_dir, max_inflight=10, publish_timeout=5.0, outbox_max=10000, latency_window=1024, log=None):
+        self.connection = connection
+        self.max_inflight = max_inflight
+        self.publish_timeout = publish_timeout
+        self.outbox_max = outbox_max
+        self.logger = log or logger
+        self.outbox = SpoolQueue(outbox_dir, name='outbox')
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._lock = threading.Lock()
+        self._connected = False
+        self._draining = False
+        self._stopped = False
+        self._inflight = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._failure_handlers = {}
+        self._counters = {"published": 0, "acked": 0, "failed": 0, "spilled": 0, "dropped": 0}
+        for name in self._counters:
+            metrics.counter('mqtt_publishes_total', 'MQTT publishes, by what happened to them', {"event": name},
+                            func=lambda name=name: self._counters[name])
+        metrics.gauge('mqtt_inflight', 'Publishes awaiting a PUBACK', func=lambda: self._inflight)
+        metrics.gauge('mqtt_outbox_messages', 'Messages waiting in the on-disk outbox', func=self.outbox.qsize)
+
+    # Connection state, called from the awscrt connection callbacks
+
+    def on_connected(self):
+        """Marks the connection usable and drains the outbox if it has anything in it."""
+        with self._lock:
+            self._connected = True
+            start = self._claim_drain()
+        if start:
+            self._start_drain()
+
+    def on_disconnected(self):
+        with self._lock:
+            self._connected = False
+
+    def set_failure_handler(self, topic, handler):
+        """
+        Calls handler(payload) for a publish to topic that is not
+        acknowledged, instead of spilling it to the outbox again. For senders
+        of deltas, like the shadow, where a failed update replayed behind a
+        newer one would undo it. The handler runs on the connection's event
+        loop and must not block.
+        """
+        with self._lock:
+            self._failure_handlers[topic] = handler
+
+    # Publishing
+
+    def publish(self, topic, payload, qos, block=True):
+        """
+        Publishes payload, or spills it to the outbox while the connection is
+        down, the outbox is draining, or no in-flight slot frees up in time.
+
+        Args:
+            block (bool): Wait up to publish_timeout for a slot. Pass False
+                from the connection's own callbacks, which must not block.
+        """
+        with self._lock:
+            direct = self._connected and not self._draining and self.outbox.qsize() == 0
+            if not direct:
+                # Keep the order: anything new goes behind what is already in the outbox
+                self._spill(topic, payload, qos)
+                start = self._claim_drain()
+        if direct:
+            if self._send(topic, payload, qos, self.publish_timeout if block else 0):
+                return
+            with self._lock:
+                self._spill(topic, payload, qos)
+                start = self._claim_drain()
+        if start:
+            self._start_drain()
+
+    def _send(self, topic, payload, qos, timeout):
+        if not self._slots.acquire(timeout=timeout):
+            return False
+        with self._lock:
+            self._inflight += 1
+        sent_at = time.monotonic()
+        try:
+            future, _ = self.connection.publish(topic=topic, payload=payload, qos=qos)
+        except Exception as e:
+            self._done(sent_at, e)
+            self.logger.error(f"Publish to {topic} failed: {e}")
+            return False
+        future.add_done_callback(lambda f: self._on_ack(f, topic, payload, qos, sent_at))
+        with self._lock:
+            self._counters["published"] += 1
+        return True
+
+    def _on_ack(self, future, topic, payload, qos, sent_at):
+        error = future.exception()
+        self._done(sent_at, error)
+        if error is None:
+            return
+        with self._lock:
+            handler = self._failure_handlers.get(topic)
+            if handler is None:
+                self.logger.error(f"Publish to {topic} was not acknowledged ({error}), spilling to the outbox.")
+                self._spill(topic, payload, qos)
+                return
+        self.logger.error(f"Publish to {topic} was not acknowledged ({error}), handing it back to its sender.")
+        try:
+            handler(payload)
+        except Exception as e:
+            self.logger.error(f"Failure handler for {topic} raised: {e}")
+
+    def _done(self, sent_at, error):
+        with self._lock:
+            self._inflight -= 1
+            if error is None:
+                self._counters["acked"] += 1
+                latency = time.monotonic() - sent_at
+                self._latencies.append(latency)
+                ack_seconds.observe(latency)
+            else:
+                self._counters["failed"] += 1
+        self._slots.release()
+
+    def _spill(self, topic, payload, qos):
+        # Called with the lock held
+        while self.outbox.qsize() >= self.outbox_max:
+            try:
+                # Not get_nowait() and task_done(): that would acknowledge a message the drain has in flight
+                self.outbox.discard_oldest()
+            except Empty:
+                break
+            self._counters["dropped"] += 1
+        try:
+            self.outbox.put((topic, bytes(payload), int(qos)))
+        except ValueError:
+            # Outbox already closed during shutdown
+            self._counters["dropped"] += 1
+            return
+        self._counters["spilled"] += 1
+
+    def _claim_drain(self):
+        # Called with the lock held; True if the caller should start the drain thread
+        if not self._connected or self._draining or self._stopped or self.outbox.qsize() == 0:
+            return False
+        self._draining = True
+        return True
+
+    def _start_drain(self):
+        threading.Thread(target=self._drain, name='mqtt_outbox_drain', daemon=True).start()
+
+    def _drain(self):
+        drained = 0
+        while True:
+            with self._lock:
+                if not self._connected or self._stopped:
+                    self._draining = False
+                    break
+                try:
+                    topic, payload, qos = self.outbox.get_nowait()
+                except Empty:
+                    self._draining = False
+                    break
+            if self._send(topic, payload, qos, self.publish_timeout):
+                self.outbox.task_done()
+                drained += 1
+            else:
+                # Link still too slow or down again: put it back at the head and wait for the next resume
+                self.outbox.requeue_unacked()
+                with self._lock:
+                    self._draining = False
+                break
+        if drained:
+            self.logger.info(f"Drained {drained} messages from the outbox, {self.outbox.qsize()} left.")
+
+    # Metrics
+
+    def metrics(self):
+        """
+        Returns a snapshot: in-flight count, outbox size, counters and the
+        p50/p95/p99 PUBACK latency in milliseconds over recent publishes.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            snapshot = dict(self._counters)
+            snapshot["inflight"] = self._inflight
+        snapshot["outbox"] = self.outbox.qsize()
+        for q in (50, 95, 99):
+            value = _percentile(latencies, q)
+            snapshot[f"ack_latency_p{q}_ms"] = round(value * 1e3, 2) if value is not None else None
+        return snapshot
+
+    def close(self, timeout=10.0):
+        """Waits up to timeout for in-flight publishes, then closes the outbox."""
+        with self._lock:
+            self._stopped = True
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._inflight == 0:
+                    break
+            time.sleep(0.05)
+        self.outbox.close()
@@ -5,47 +5,34 @@ from awscrt import mqtt, http
 from awsiot import mqtt_connection_builder
 import sys
 import os
-import re
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-import logging
 import threading
 import time
 import json
 import subprocess
-from queue_server import QueueManager
+from queue_server import connect_queue
+from queue_consumer import QueueConsumer, install_signal_handlers
+from shadow_publisher import ShadowPublisher
+from shadow_payloads import encode_document, gps_fragment, monitoring_fragment, account_fragment
+from publish_pipeline import PublishPipeline
+from log_setup import setup_logging
+import metrics
 #from utils.command_line_utils import CommandLineUtils
 from dotenv import load_dotenv
 
 
 
-manager = QueueManager(address=(os.getenv('QUEUE_HOST'), int(os.getenv('QUEUE_PORT'))), authkey=os.getenv('AUTH_KEY').encode())
-manager.connect()
-
-# Get the queues
-iot_events_queue = manager.iot_events()
+# Connect to the queue server (QueueManager proxy or local socket, see QUEUE_TRANSPORT)
+iot_events_queue = connect_queue(os.getenv('IOT_EVENTS_ID'))
 
 load_dotenv()
 
-# Configure logging
-log_dir = os.getenv('LOG_DIRECTORY')  # Replace with your desired directory
-log_file = os.getenv('LOG_FILE_IOT')
-os.makedirs(log_dir, exist_ok=True)
-log_level = os.getenv('LOG_LEVEL', 'INFO').upper()  # Default to INFO if not set
-log_level = getattr(logging, log_level, logging.INFO)  # Default to logger.INFO if invalid
+# Configure logging (shared setup in log_setup.py; awscrt callbacks only enqueue records)
 #id_serial_number = {"1420224231781" : 'BFA-2', "1420224232263" : 'BFA-3', "1420224231942" : 'BFA-1'}
-try:
-    logger = logging.getLogger(os.getenv('LOGGER_IOT'))
-    logger.setLevel(log_level)  # Set the log 
-
-    file_handler_file_watcher = logging.FileHandler(os.path.join(log_dir, log_file))
-    file_handler_file_watcher.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s', datefmt="%Y-%m-%d %H:%M:%S"))
-    
-    # Add handlers to the ADC logger
-    logger.addHandler(file_handler_file_watcher)
-except Exception as e:
-    logger.error(f"Logging setup failed: {e}")
+logger = setup_logging(os.getenv('LOGGER_IOT'), os.getenv('LOG_FILE_IOT'))
+metrics.start_metrics(os.getenv('METRICS_PORT_IOT'), os.getenv('METRICS_FILE_IOT'), log=logger)
 
 # Get the serial number of the Jetson Nano
 try:
@@ -75,17 +62,11 @@ active_payload = {
   }
 }
 
-serial_number_payload = {
-    "state" : {
-        "reported" : {
-            "ACCOUNT" : {
-                "SERIAL_NO" : serial_number,
-                "DEVICE_NAME" : id_serial_number[serial_number]
-            }
-        }
+# The constant documents are encoded once and reused on every connect and resume
+lwt_payload_bytes = encode_document(lwt_payload)
+active_payload_bytes = encode_document(active_payload)
 
-    }
-}
+account_reported = account_fragment(serial_number, id_serial_number[serial_number])
 
 message_topic = os.getenv('IOT_UPDATE_TOPIC')
 message_topic = message_topic.replace("$$macid", serial_number)
@@ -99,7 +80,7 @@ logger.info(lwt_topic)
 
 willfunction=mqtt.Will(
         topic=lwt_topic,
-        payload=json.dumps(lwt_payload).encode('utf-8'),
+        payload=lwt_payload_bytes,
         qos=mqtt.QoS.AT_LEAST_ONCE,
         retain=False
         )
@@ -122,6 +103,8 @@ received_all_event = threading.Event()
 # Callback when connection is accidentally lost.
 def on_connection_interrupted(connection, error, **kwargs):
     logger.error("Connection interrupted. error: {}".format(error))
+    # Publishes go to the outbox until the connection is back
+    pipeline.on_disconnected()
 
 
 # Callback when an interrupted connection is re-established.
@@ -130,6 +113,8 @@ def on_connection_resumed(connection, return_code, session_present, **kwargs):
 
     if return_code == mqtt.ConnectReturnCode.ACCEPTED and not session_present:
         logger.error("Session did not persist. Resubscribing to existing topics...")
+        # Updates in flight with the old session may be lost; report everything again
+        shadow.forget()
         resubscribe_future, _ = connection.resubscribe_existing_topics()
 
 
@@ -137,10 +122,13 @@ def on_connection_resumed(connection, return_code, session_present, **kwargs):
         # evaluate result with a callback instead.
         resubscribe_future.add_done_callback(on_resubscribe_complete)
     if return_code == mqtt.ConnectReturnCode.ACCEPTED:
-      mqtt_connection.publish(
+      # Drains the outbox in order; block=False since this runs on the connection's event loop
+      pipeline.on_connected()
+      pipeline.publish(
                 topic=message_topic,
-                payload=json.dumps(active_payload).encode('utf-8'),
-                qos=mqtt.QoS.AT_LEAST_ONCE)
+                payload=active_payload_bytes,
+                qos=mqtt.QoS.AT_LEAST_ONCE,
+                block=False)
       
 
 
@@ -165,10 +153,12 @@ def on_message_received(topic, payload, dup, qos, retain, **kwargs):
 # Callback when the connection successfully connects
 def on_connection_success(connection, callback_data):
     assert isinstance(callback_data, mqtt.OnConnectionSuccessData)
-    mqtt_connection.publish(
+    pipeline.on_connected()
+    pipeline.publish(
                 topic=message_topic,
-                payload=json.dumps(active_payload).encode('utf-8'),
-                qos=mqtt.QoS.AT_LEAST_ONCE)
+                payload=active_payload_bytes,
+                qos=mqtt.QoS.AT_LEAST_ONCE,
+                block=False)
     logger.info("Connection Successful with return code: {} session present: {}".format(callback_data.return_code, callback_data.session_present))
 
 # Callback when a connection attempt fails
@@ -180,7 +170,57 @@ def on_connection_failure(connection, callback_data):
 def on_connection_closed(connection, callback_data):
     logger.info("Connection closed")
 
-if __name__ == '__main__':
+# Sends one coalesced shadow document (see ShadowPublisher)
+def publish_shadow(payload):
+    pipeline.publish(
+        topic=message_topic,
+        payload=payload,
+        qos=mqtt.QoS.AT_LEAST_ONCE)
+
+# Logs the publish pipeline metrics every MQTT_METRICS_INTERVAL seconds and, if
+# MQTT_METRICS_FILE is set, writes them there as JSON
+last_metrics_report = time.monotonic()
+def report_publish_metrics_if_due():
+    global last_metrics_report
+    now = time.monotonic()
+    if now - last_metrics_report < float(os.getenv('MQTT_METRICS_INTERVAL', '60')):
+        return
+    last_metrics_report = now
+    publish_metrics = pipeline.metrics()
+    logger.info(f"Publish metrics: {publish_metrics}")
+    metrics_file = os.getenv('MQTT_METRICS_FILE')
+    if metrics_file:
+        with open(metrics_file + '.tmp', 'w') as f:
+            json.dump(publish_metrics, f)
+        os.replace(metrics_file + '.tmp', metrics_file)
+
+def on_consumer_idle():
+    shadow.flush_if_due()
+    report_publish_metrics_if_due()
+
+# Handles a single message from iot_events; shadow updates are merged and sent on flush
+def process_iot_event(message):
+    # Parse the JSON message
+    event_data = json.loads(message)
+    event_type = event_data.get("event_type")
+
+    # Validate message content
+    if not event_data or not event_type:
+        logger.error(f"Invalid message format: {message}")
+        return
+
+    if(event_type=='GPS_UPDATE'):
+      shadow.update(gps_fragment(event_data))
+    elif(event_type=='MONITORING'):
+      shadow.update(monitoring_fragment(event_data))
+      shadow.update(account_reported)
+
+def main(stop_event=None):
+    """
+    Connects to AWS IoT and publishes iot_events until stop_event is set, or
+    until SIGTERM/SIGINT when no stop_event is given (run as a service).
+    """
+    global pipeline, shadow
     # Create the proxy options if the data is present in cmdData
     proxy_options = None
     # if cmdData.input_proxy_host is not None and cmdData.input_proxy_port != 0:
@@ -212,140 +252,78 @@ if __name__ == '__main__':
         will=willfunction
     )
 
+    # At most MQTT_MAX_INFLIGHT publishes await a PUBACK; the rest wait in the on-disk outbox
+    pipeline = PublishPipeline(
+        mqtt_connection,
+        outbox_dir=os.getenv('MQTT_OUTBOX_DIRECTORY') or os.path.join(os.getenv('BASE_DIRECTORY'), 'data', 'outbox'),
+        max_inflight=int(os.getenv('MQTT_MAX_INFLIGHT', '10')),
+        publish_timeout=float(os.getenv('MQTT_PUBLISH_TIMEOUT', '5.0')),
+        outbox_max=int(os.getenv('MQTT_OUTBOX_MAX', '10000')),
+        log=logger,
+    )
+
+    shadow = ShadowPublisher(
+        publish_shadow,
+        flush_window=float(os.getenv('SHADOW_FLUSH_WINDOW', '1.0')),
+        max_rate=float(os.getenv('SHADOW_MAX_PUBLISH_RATE', '1.0')),
+        log=logger,
+    )
+    # A shadow update that isn't acknowledged goes back to the ShadowPublisher, which resends
+    # it unless a newer value went out meanwhile, instead of being replayed behind that value
+    pipeline.set_failure_handler(message_topic, shadow.requeue)
+
     # if not cmdData.input_is_ci:
     #     logger.debug(f"Connecting to {os.getenv('IOT_ENDPOINT')} with client ID '{os.getenv('IOT_CLIENT_ID')}'...")
     # else:
     #     logger.info("Connecting to endpoint with client ID")
-    connect_future = mqtt_connection.connect()
-
-    # Future.result() waits until a result is available
-    connect_future.result()
-    logger.info("Connected")
-
-    message_count = int(os.getenv('COUNT'))
-    
-    logger.info(message_topic)
-    message_string = 'Hello World'
-
-    # Subscribe
-    logger.debug("Subscribing to topic '{}'...".format(message_topic))
-    subscribe_future, packet_id = mqtt_connection.subscribe(
-        topic=message_topic,
-        qos=mqtt.QoS.AT_LEAST_ONCE,
-        callback=on_message_received)
-
-    subscribe_result = subscribe_future.result()
-    logger.info("Subscribed with {}".format(str(subscribe_result['qos'])))
-
-    while True:
-      try:
-          if not iot_events_queue.empty():
-              message = iot_events_queue.get()
-
-              # Parse the JSON message
-              event_data = json.loads(message)
-              event_type = event_data.get("event_type")
-              
-              
-              
-
-              if(event_type=='GPS_UPDATE'):
-                last_reported_time = event_data.get("time")
-                latitude = event_data.get("latitude")
-                longitude = event_data.get("longitude")
-                maps_link = event_data.get("maps_link")
-                gps_payload = {
-                    "state": {
-                        "reported": {
-                            "GPS": {
-                                "LAST_REPORTED": last_reported_time,  # Replace $$time with current time
-                                "LATITUDE": latitude,           # Replace $$latitude with actual latitude
-                                "LONGITUDE": longitude,         # Replace $$longitude with actual longitude
-                                "MAPS_LINK": maps_link         # Replace $$mapsLink with generated maps link
-                            }
-                        }
-                    }
-                }
-                mqtt_connection.publish(
-                topic=message_topic,
-                payload=json.dumps(gps_payload).encode('utf-8'),
-                qos=mqtt.QoS.AT_LEAST_ONCE)
-              elif(event_type=='MONITORING'):
-                status = event_data.get("LEAK")
-                classified_batch_dir = event_data.get("file_path")
-                classification = event_data.get("classification")
-                classified_batch = os.path.basename(classified_batch_dir)
-                pattern = r"(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})"
-                match = re.search(pattern,classified_batch)
-
-                if classification == 'LEAKED':
-                    date_time = match.group(1)
-                else:
-                    date_time = "NO LEAK"
-
-
-                status_payload = {
-                    "state": {
-                        "reported": {
-                            "MONITORING": {
-                                "LEAK": status,  # Replace $$time with current time
-                                "LAST_LEAK_REPORTED_TIME" : date_time
-
-                            }
-                        }
-                    }
-                }
-                mqtt_connection.publish(
-                topic=message_topic,
-                payload=json.dumps(status_payload).encode('utf-8'),
-                qos=mqtt.QoS.AT_LEAST_ONCE)
-                mqtt_connection.publish(
-                topic=message_topic,
-                payload=json.dumps(serial_number_payload).encode('utf-8'),
-                qos=mqtt.QoS.AT_LEAST_ONCE)
-
-        
-              # Validate message content
-              if not data or not event_type:
-                  logger.error(f"Invalid message format: {message}")
-                  continue
-          else:
-              continue
-
-      except Exception as e:
-          logger.error(f"Subscriber encountered an error: {e}")
-
-    # Publish message to server desired number of times.
-    # This step is skipped if message is blank.
-    # This step loops forever if count was set to 0.
-    if message_string:
-        if message_count == 0:
-            logger.info("Sending messages until program killed")
-        else:
-            logger.info("Sending {} message(s)".format(message_count))
-
-        publish_count = 1
-        # while (publish_count <= message_count) or (message_count == 0):
-        #     message = "{} [{}]".format(message_string, publish_count)
-        #     logger.debug("Publishing message to topic '{}': {}".format(message_topic, message))
-        #     message_json = json.dumps(message)
-        #     mqtt_connection.publish(
-        #         topic=message_topic,
-        #         payload=message_json,
-        #         qos=mqtt.QoS.AT_LEAST_ONCE)
-        #     time.sleep(1)
-        #     publish_count += 1
-
-    # Wait for all messages to be received.
-    # This waits forever if count was set to 0.
-    if message_count != 0 and not received_all_event.is_set():
-        logger.debug("Waiting for all messages to be received...")
-
-    received_all_event.wait()
-    logger.debug("Waiting for all messages to be received...")
+    try:
+        connect_future = mqtt_connection.connect()
+
+        # Future.result() waits until a result is available
+        connect_future.result()
+        logger.info("Connected")
+
+        message_count = int(os.getenv('COUNT'))
+
+        logger.info(message_topic)
+        message_string = 'Hello World'
+
+        # Subscribe
+        logger.debug("Subscribing to topic '{}'...".format(message_topic))
+        subscribe_future, packet_id = mqtt_connection.subscribe(
+            topic=message_topic,
+            qos=mqtt.QoS.AT_LEAST_ONCE,
+            callback=on_message_received)
+
+        subscribe_result = subscribe_future.result()
+        logger.info("Subscribed with {}".format(str(subscribe_result['qos'])))
+
+        # Block on iot_events instead of spinning on empty(); SIGTERM stops the loop cleanly.
+        # Shadow fragments are flushed from the idle hook, at most SHADOW_MAX_PUBLISH_RATE per second.
+        consumer = QueueConsumer(
+            iot_events_queue,
+            process_iot_event,
+            max_batch=int(os.getenv('QUEUE_MAX_BATCH', '32')),
+            timeout=float(os.getenv('QUEUE_GET_TIMEOUT', '1.0')),
+            stop_event=stop_event,
+            on_idle=on_consumer_idle,
+            log=logger,
+        )
+        if stop_event is None:
+            install_signal_handlers(consumer.stop_event)
+        consumer.run()
+        shadow.flush()
+    finally:
+        # Closed on failure too, so a restart by supervisor.py can reopen the outbox
+        pipeline.close()
+    logger.info(f"Publish metrics: {pipeline.metrics()}")
 
     # Disconnect
     logger.info("Disconnecting...")
     disconnect_future = mqtt_connection.disconnect()
     disconnect_future.result()
-    logger.info("Disconnected!")
\ No newline at end of file
+    logger.info("Disconnected!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import time
+import signal
+import threading
+import logging
+from queue import Empty
+import metrics
+
+logger = logging.getLogger(__name__)
+
+messages_handled = metrics.counter('queue_consumer_messages_total', 'Messages taken off the queue and handled')
+handler_errors = metrics.counter('queue_consumer_errors_total', 'Messages whose handler raised')
+handle_seconds = metrics.histogram('queue_consumer_handle_seconds', 'Time to handle and acknowledge one message')
+
+
+class QueueConsumer:
+    """
+    Blocking, batched consumer for a queue served by QueueManager.
+
+    Instead of spinning on queue.empty(), the consumer parks in a blocking
+    get() on the queue proxy (one round-trip to queue_server.py per wait) and
+    then drains whatever else is already queued, up to max_batch messages.
+    The get timeout bounds how long a stop request can go unnoticed.
+
+    Each message is acknowledged with task_done() once its handler returns,
+    so the durable queues in queue_server.py only drop an event after it has
+    been handled. Events a previous consumer received but never acknowledged
+    are requeued when the consumer starts.
+
+    Args:
+        queue: Queue or QueueManager proxy (e.g. manager.s3_events()).
+        handler (callable): Called with each message, in arrival order.
+        max_batch (int): Maximum number of messages handled per wake-up.
+        timeout (float): Seconds to block waiting for the first message.
+        stop_event (threading.Event): Shared shutdown signal. A new one is
+            created when not given.
+        on_idle (callable): Optional hook called after each wake-up, whether
+            or not messages arrived. Useful for time-based flushing.
+        log (logging.Logger): Service logger to report to.
+    """
+
+    def __init__(self, queue, handler, max_batch=32, timeout=1.0, stop_event=None, on_idle=None, log=None):
+        self.queue = queue
+        self.handler = handler
+        self.max_batch = max(1, int(max_batch))
+        self.timeout = timeout
+        self.stop_event = stop_event or threading.Event()
+        self.on_idle = on_idle
+        self.logger = log or logger
+
+    def get_batch(self):
+        """
+        Blocks for up to `timeout` seconds for one message, then drains the
+        queue without blocking until `max_batch` messages are collected.
+
+        Returns:
+            list: Messages received, empty if the timeout expired.
+        """
+        try:
+            batch = [self.queue.get(True, self.timeout)]
+        except Empty:
+            return []
+
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def run(self):
+        """
+        Consumes messages until stop() is called or a shutdown signal arrives.
+        Exceptions raised by the handler are logged and do not stop the loop.
+        """
+        self.logger.info("Queue consumer started.")
+        self.requeue_unacked()
+        while not self.stop_event.is_set():
+            for message in self.get_batch():
+                start = time.perf_counter()
+                try:
+                    self.handler(message)
+                except Exception as e:
+                    handler_errors.inc()
+                    self.logger.error(f"Handler failed for message {message}: {e}", exc_info=True)
+                finally:
+                    # Failed messages are acknowledged too, so one bad event can't block the queue
+                    self.queue.task_done()
+                    messages_handled.inc()
+                    handle_seconds.observe(time.perf_counter() - start)
+
+            if self.on_idle is not None:
+                try:
+                    self.on_idle()
+                except Exception as e:
+                    self.logger.error(f"Idle hook failed: {e}", exc_info=True)
+        self.logger.info("Queue consumer stopped.")
+
+    def requeue_unacked(self):
+        # Only the durable spool queues track unacknowledged events
+        requeue = getattr(self.queue, 'requeue_unacked', None)
+        if requeue is None:
+            return
+        count = requeue()
+        if count:
+            self.logger.info(f"Requeued {count} events left unacknowledged by the previous consumer.")
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def install_signal_handlers(stop_event, signals=(signal.SIGTERM, signal.SIGINT)):
+    """
+    Sets stop_event on SIGTERM/SIGINT so systemd stops and Ctrl+C let the
+    current batch finish instead of killing the consumer mid-event.
+    """
+    def _handle(signum, frame):
+        logger.info(f"Received signal {signum}, shutting down.")
+        stop_event.set()
+
+    for sig in signals:
+        signal.signal(sig, _handle)
@@ -1,43 +1,120 @@
 from multiprocessing.managers import BaseManager
 from queue import Queue
 import os
+import sys
+import signal
+import threading
 from dotenv import load_dotenv
 import logging
+from spool_queue import SpoolQueue
+from queue_socket import SocketQueueServer, SocketQueueClient
+from log_setup import setup_logging
+import metrics
 # Load environment variables from .env file
 load_dotenv()
  
 
-# Logging Config
-log_dir = os.getenv('LOG_DIRECTORY')  # Replace with your desired directory
-log_file = os.getenv('LOG_FILE_QUEUE_SERVER')
-os.makedirs(log_dir, exist_ok=True)
-log_level = os.getenv('LOG_LEVEL', 'INFO').upper()  # Default to INFO if not set
-log_level = getattr(logging, log_level, logging.INFO)  # Default to logging.INFO if invalid
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    handlers=[
-        logging.FileHandler(os.path.join(log_dir, log_file)),  # Logs to file
-        logging.StreamHandler()  # Logs to console
-    ],
-)
-
-# Define queues for the event system
-file_events_queue = Queue()
-iot_events_queue = Queue()
-s3_events_queue = Queue()
+# Logging is configured in __main__ only: every service imports this module for
+# connect_queue, and configuring the root logger here sent their (and boto's)
+# debug output to queue_server.log
+logger = logging.getLogger('queue_server')
+
+# 'spool' keeps s3_events and iot_events in durable on-disk queues (see spool_queue.py)
+# so a restart of this service replays them; 'memory' uses plain in-process queues
+queue_backend = os.getenv('QUEUE_BACKEND', 'spool').lower()
+spool_directory = os.getenv('SPOOL_DIRECTORY') or os.path.join(os.getenv('BASE_DIRECTORY', '.'), 'data', 'spool')
+
+# 'manager' talks to the queues through QueueManager proxies over TCP; 'socket' uses the
+# Unix domain socket transport in queue_socket.py. The server always serves the manager,
+# and serves the socket as well in 'socket' mode, so services can be switched one at a time.
+# 'local' hands out the queues of this process directly; supervisor.py runs every service
+# in one process that way, with no queue server.
+queue_transport = os.getenv('QUEUE_TRANSPORT', 'manager').lower()
+queue_socket_path = os.getenv('QUEUE_SOCKET_PATH') or os.path.join(os.getenv('BASE_DIRECTORY', '.'), 'data', 'queue.sock')
+
+# Define queues for the event system. They are created on first use, which only
+# happens in the server process; clients import this module just for QueueManager.
+_queues = {}
+_queues_lock = threading.Lock()
+
+def get_queue(name, durable=False):
+    with _queues_lock:
+        if name not in _queues:
+            if durable and queue_backend == 'spool':
+                _queues[name] = SpoolQueue(
+                    os.path.join(spool_directory, name),
+                    fsync=os.getenv('SPOOL_FSYNC', 'batch').lower(),
+                    fsync_interval=float(os.getenv('SPOOL_FSYNC_INTERVAL', '0.05')),
+                    segment_bytes=int(os.getenv('SPOOL_SEGMENT_BYTES', str(4 * 1024 * 1024))),
+                    name=name,
+                )
+                logger.info(f"Queue '{name}' spooled to {_queues[name].directory}.")
+            else:
+                _queues[name] = Queue()
+            metrics.gauge('queue_depth', 'Events waiting in a queue_server queue', {"queue": name}, func=_queues[name].qsize)
+        return _queues[name]
+
+def close_queues():
+    with _queues_lock:
+        for queue in _queues.values():
+            if isinstance(queue, SpoolQueue):
+                queue.close()
 
 class QueueManager(BaseManager):
     pass
 
+# Queue id (as the services know it) -> queue name and whether it is spooled
+QUEUES = {
+    os.getenv('FILE_EVENTS_ID'): ('file_events', False),
+    os.getenv('IOT_EVENTS_ID'): ('iot_events', True),
+    os.getenv('S3_EVENTS_ID'): ('s3_events', True),
+}
+
 # Register the queues with the manager
-QueueManager.register(os.getenv('FILE_EVENTS_ID'), callable=lambda: file_events_queue)
-QueueManager.register(os.getenv('IOT_EVENTS_ID'), callable=lambda: iot_events_queue)
-QueueManager.register(os.getenv('S3_EVENTS_ID'), callable=lambda: s3_events_queue)
+for queue_id, (name, durable) in QUEUES.items():
+    QueueManager.register(queue_id, callable=lambda name=name, durable=durable: get_queue(name, durable=durable))
+
+def connect_queue(queue_id):
+    """
+    Returns a client for the queue registered as queue_id (e.g.
+    os.getenv('S3_EVENTS_ID')) over the transport set by QUEUE_TRANSPORT,
+    or with 'local' the queue itself. All of them have the same
+    put/get/task_done methods.
+    """
+    if queue_transport == 'local':
+        name, durable = QUEUES[queue_id]
+        return get_queue(name, durable=durable)
+    if queue_transport == 'socket':
+        return SocketQueueClient(queue_socket_path, queue_id)
+    manager = QueueManager(address=(os.getenv('QUEUE_HOST'), int(os.getenv('QUEUE_PORT'))), authkey=os.getenv('AUTH_KEY').encode())
+    manager.connect()
+    return getattr(manager, queue_id)()
 
 if __name__ == "__main__":
+    # Level from LOG_LEVEL (and LOG_LEVELS) instead of the DEBUG basicConfig used to force
+    logger = setup_logging('queue_server', os.getenv('LOG_FILE_QUEUE_SERVER'), console=True)
+    metrics.start_metrics(os.getenv('METRICS_PORT_QUEUE_SERVER'), os.getenv('METRICS_FILE_QUEUE_SERVER'), log=logger)
     manager = QueueManager(address=(os.getenv('QUEUE_HOST'), int(os.getenv('QUEUE_PORT'))), authkey=os.getenv('AUTH_KEY').encode())
     server = manager.get_server()
-    logging.info("QueueManager server started.")
-    server.serve_forever()
+    # Open the spools now so pending events are replayed before the first client connects
+    get_queue('iot_events', durable=True)
+    get_queue('s3_events', durable=True)
+
+    socket_server = None
+    if queue_transport == 'socket':
+        socket_server = SocketQueueServer(queue_socket_path, {
+            queue_id: get_queue(name, durable=durable) for queue_id, (name, durable) in QUEUES.items()
+        })
+        threading.Thread(target=socket_server.serve_forever, name='queue_socket', daemon=True).start()
+        logger.info(f"Queue socket listening on {queue_socket_path}.")
+    # serve_forever() exits via SystemExit; turn systemd's SIGTERM into one so the spools get flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logger.info("QueueManager server started.")
+    try:
+        server.serve_forever()
+    finally:
+        if socket_server is not None:
+            socket_server.shutdown()
+            socket_server.server_close()
+        close_queues()
+        logger.info("QueueManager server stopped.")
@@ -0,0 +1,228 @@
+"""
+Unix domain socket transport for the queues in queue_server.py.
+
+The QueueManager proxies pay for a generic RPC on every call: method
+dispatch by name, a pickled request and reply tuple and an HMAC handshake
+per connection, over TCP. All the services run on the same device, so this
+transport serves the same queues on a local socket with a minimal protocol:
+
+    frame    = length (u32, big-endian) | payload
+    request  = op (u8) | name length (u8) | queue name | arguments
+    reply    = status (u8) | body
+
+Items are pickled; everything else is packed with struct. Access is limited
+by the socket file's permissions (owner only) instead of the authkey.
+SocketQueueClient has the queue methods the services use, so it can replace
+a manager proxy without changing producer or consumer code.
+"""
+import os
+import pickle
+import socket
+import struct
+import logging
+import threading
+import socketserver
+from queue import Empty
+
+logger = logging.getLogger(__name__)
+
+# Request ops
+PUT = 1
+GET = 2
+QSIZE = 3
+EMPTY = 4
+TASK_DONE = 5
+REQUEUE_UNACKED = 6
+
+# Reply statuses
+OK = 0
+QUEUE_EMPTY = 1
+ERROR = 2
+
+_LENGTH = struct.Struct('>I')
+_GET_ARGS = struct.Struct('<?d')
+_COUNT = struct.Struct('<q')
+_OK = bytes([OK])
+
+
+def _recv_exactly(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        chunk = sock.recv_into(view[received:])
+        if chunk == 0:
+            raise EOFError("Queue socket closed")
+        received += chunk
+    return buf
+
+
+def recv_frame(sock):
+    (length,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    return _recv_exactly(sock, length)
+
+
+def send_frame(sock, payload):
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+
+class _QueueRequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        queues = self.server.queues
+        sock = self.request
+        while True:
+            try:
+                request = recv_frame(sock)
+            except (EOFError, ConnectionError):
+                return
+            name_end = 2 + request[1]
+            queue = queues.get(bytes(request[2:name_end]).decode())
+            try:
+                reply = self.dispatch(request[0], queue, memoryview(request)[name_end:])
+            except Empty:
+                reply = bytes([QUEUE_EMPTY])
+            except Exception as e:
+                try:
+                    reply = bytes([ERROR]) + pickle.dumps(e)
+                except Exception:
+                    reply = bytes([ERROR]) + pickle.dumps(RuntimeError(str(e)))
+            try:
+                send_frame(sock, reply)
+            except (BrokenPipeError, ConnectionError):
+                return
+
+    def dispatch(self, op, queue, args):
+        if queue is None:
+            raise KeyError("Unknown queue")
+        if op == PUT:
+            queue.put(pickle.loads(args))
+            return _OK
+        if op == GET:
+            block, timeout = _GET_ARGS.unpack(args)
+            item = queue.get(block, timeout if timeout >= 0 else None)
+            return _OK + pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        if op == QSIZE:
+            return _OK + _COUNT.pack(queue.qsize())
+        if op == EMPTY:
+            return _OK + _COUNT.pack(int(queue.empty()))
+        if op == TASK_DONE:
+            queue.task_done()
+            return _OK
+        if op == REQUEUE_UNACKED:
+            requeue = getattr(queue, 'requeue_unacked', None)
+            return _OK + _COUNT.pack(requeue() if requeue else 0)
+        raise ValueError(f"Unknown queue op {op}")
+
+
+class SocketQueueServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves queues on a Unix domain socket, one thread per connection.
+
+    Args:
+        path (str): Socket file. A stale file from a previous run is replaced.
+        queues (dict): Queue objects by the name clients ask for (the
+            QueueManager register IDs).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, queues):
+        self.path = path
+        self.queues = dict(queues)
+        if os.path.exists(path):
+            os.remove(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        super().__init__(path, _QueueRequestHandler)
+        os.chmod(path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class SocketQueueClient:
+    """
+    Client for one queue served by SocketQueueServer, with the queue methods
+    the services call on a manager proxy: put, put_nowait, get, get_nowait,
+    qsize, empty, task_done and requeue_unacked.
+
+    Like a proxy, each thread gets its own connection, so a consumer blocked
+    in get() doesn't hold up a producer thread. A broken connection raises
+    ConnectionError and is reopened on the next call.
+
+    Args:
+        path (str): Socket file of the queue server.
+        name (str): Queue name, e.g. os.getenv('S3_EVENTS_ID').
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        encoded = name.encode()
+        if len(encoded) > 255:
+            raise ValueError("Queue name too long")
+        self._prefix = bytes([len(encoded)]) + encoded
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+        return sock
+
+    def _call(self, op, args=b''):
+        sock = self._connection()
+        try:
+            send_frame(sock, bytes([op]) + self._prefix + args)
+            reply = recv_frame(sock)
+        except (OSError, EOFError) as e:
+            self.close()
+            raise ConnectionError(f"Lost connection to queue server at {self.path}: {e}") from e
+        status = reply[0]
+        if status == OK:
+            return memoryview(reply)[1:]
+        if status == QUEUE_EMPTY:
+            raise Empty
+        raise pickle.loads(reply[1:])
+
+    def close(self):
+        """Closes the calling thread's connection."""
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            self._local.sock = None
+            sock.close()
+
+    def put(self, item, block=True, timeout=None):
+        self._call(PUT, pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        body = self._call(GET, _GET_ARGS.pack(block, -1.0 if timeout is None else timeout))
+        return pickle.loads(body)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return _COUNT.unpack(self._call(QSIZE))[0]
+
+    def empty(self):
+        return bool(_COUNT.unpack(self._call(EMPTY))[0])
+
+    def task_done(self):
+        self._call(TASK_DONE)
+
+    def requeue_unacked(self):
+        return _COUNT.unpack(self._call(REQUEUE_UNACKED))[0]
@@ -0,0 +1,319 @@
+"""
+Resumable S3 uploads with retries.
+
+Files below multipart_threshold are sent with one put_object call, which
+raises S3's ClientError as it is; boto3's upload_file would wrap it in an
+S3UploadFailedError that hides the error code retries are decided on.
+Larger files (packed archives, long batches) are uploaded as a multipart
+upload driven here, with a checkpoint file that
+records the upload id and the ETag of every part that reached S3. After a
+crash, reboot or lost link, the next attempt reads the checkpoint, asks S3
+which parts it holds (list_parts) and only sends the rest. The checkpoint is
+removed once the upload is completed.
+
+Every S3 call is retried with capped exponential backoff and full jitter
+(a random delay in [0, min(max_delay, base_delay * 2^attempt)]), so devices
+that lose the link together don't retry in lockstep when it returns.
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import BotoCoreError, ClientError
+from s3_uploader import record_upload, uploads_failed
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# S3 accepts parts of 5 MB and up (except the last) and at most 10000 of them
+MIN_PART_SIZE = 5 * MB
+MAX_PARTS = 10000
+CHECKPOINT_EXTENSION = '.upload.json'
+
+# Errors retrying can't fix
+FATAL_ERROR_CODES = {
+    'AccessDenied', 'NoSuchBucket', 'InvalidAccessKeyId', 'SignatureDoesNotMatch',
+    'InvalidBucketName', 'AllAccessDisabled', 'NoSuchUpload', 'EntityTooSmall', 'InvalidPart',
+}
+
+
+def error_code(error):
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code')
+    return None
+
+
+def is_retryable(error):
+    if isinstance(error, ClientError):
+        return error_code(error) not in FATAL_ERROR_CODES
+    return isinstance(error, BotoCoreError)
+
+
+def backoff_delay(attempt, base_delay, max_delay, rng=random):
+    """Full-jitter delay before retry number `attempt` (0 for the first retry)."""
+    return rng.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class ResumableUploader:
+    """
+    Uploads files to one bucket, resuming interrupted multipart uploads.
+
+    Args:
+        client: S3 client.
+        bucket (str): Name of the S3 bucket.
+        checkpoint_dir (str): Directory for multipart upload checkpoints.
+        part_size (int): Multipart part size in bytes, raised as needed to
+            stay within S3's part limits.
+        multipart_threshold (int): Files of this size and above are uploaded
+            as resumable multipart uploads.
+        max_concurrency (int): Parts uploaded in parallel.
+        max_attempts (int): Attempts per S3 call before giving up.
+        base_delay (float): First retry's maximum delay in seconds.
+        max_delay (float): Cap on the retry delay in seconds.
+        sleep (callable): Used to wait between attempts.
+        log (logging.Logger): Service logger to report to.
+    """
+
+    def __init__(self, client, bucket, checkpoint_dir, part_size=8 * MB, multipart_threshold=16 * MB,
+                 max_concurrency=4, max_attempts=5, base_delay=0.5, max_delay=30.0, sleep=time.sleep, log=None):
+        self.client = client
+        self.bucket = bucket
+        self.checkpoint_dir = checkpoint_dir
+        self.part_size = max(MIN_PART_SIZE, int(part_size))
+        self.multipart_threshold = max(self.part_size, int(multipart_threshold))
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.logger = log or logger
+        self._sleep = sleep
+        self._rng = random.Random()
+        self.stats = {"uploads": 0, "resumed": 0, "parts_sent": 0, "parts_skipped": 0, "retries": 0}
+        self._stats_lock = threading.Lock()
+        metrics.counter('s3_upload_retries_total', 'S3 calls retried after a transient error', func=lambda: self.stats["retries"])
+        metrics.counter('s3_multipart_resumed_total', 'Multipart uploads resumed from a checkpoint', func=lambda: self.stats["resumed"])
+        metrics.counter('s3_multipart_parts_total', 'Multipart parts, by whether they were sent or already in S3',
+                        {"part": "sent"}, func=lambda: self.stats["parts_sent"])
+        metrics.counter('s3_multipart_parts_total', 'Multipart parts, by whether they were sent or already in S3',
+                        {"part": "skipped"}, func=lambda: self.stats["parts_skipped"])
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def call(self, operation, description, *args, **kwargs):
+        """Calls operation, retrying retryable S3 errors with jittered backoff."""
+        for attempt in range(self.max_attempts):
+            try:
+                return operation(*args, **kwargs)
+            except (BotoCoreError, ClientError) as e:
+                if not is_retryable(e) or attempt + 1 == self.max_attempts:
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay, self._rng)
+                self.logger.warning(f"{description} failed ({e}), retry {attempt + 1}/{self.max_attempts - 1} in {delay:.1f}s")
+                self._count("retries")
+                self._sleep(delay)
+
+    def upload(self, file_path, key):
+        """
+        Uploads file_path to key, resuming a checkpointed multipart upload.
+
+        Returns:
+            bool: True if the object is in S3. Failures are logged; a
+            multipart upload keeps its checkpoint for the next attempt.
+        """
+        start = time.perf_counter()
+        try:
+            if os.path.getsize(file_path) >= self.multipart_threshold:
+                self._upload_multipart(file_path, key)
+            else:
+                self.call(self._put, f"Upload of {file_path}", file_path, key)
+        except (BotoCoreError, ClientError, OSError) as e:
+            uploads_failed.inc()
+            self.logger.error(f"Error uploading {file_path} to S3: {e}")
+            return False
+        record_upload(file_path, time.perf_counter() - start)
+        self._count("uploads")
+        self.logger.info(f"Uploaded {file_path} to S3: {self.bucket}/{key}")
+        return True
+
+    def _put(self, file_path, key):
+        # Opened per attempt, so a retry sends the file from its start
+        with open(file_path, 'rb') as f:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=f)
+
+    # Checkpoints
+
+    def checkpoint_path(self, key):
+        digest = hashlib.sha1(f"{self.bucket}/{key}".encode('utf-8')).hexdigest()
+        return os.path.join(self.checkpoint_dir, digest + CHECKPOINT_EXTENSION)
+
+    def _save_checkpoint(self, checkpoint):
+        path = self.checkpoint_path(checkpoint["key"])
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _load_checkpoint(self, key):
+        try:
+            with open(self.checkpoint_path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable upload checkpoint for {key}: {e}")
+            return None
+
+    def _remove_checkpoint(self, key):
+        try:
+            os.remove(self.checkpoint_path(key))
+        except FileNotFoundError:
+            pass
+
+    def pending(self):
+        """Returns the checkpoints of interrupted multipart uploads."""
+        checkpoints = []
+        for name in sorted(os.listdir(self.checkpoint_dir)):
+            if not name.endswith(CHECKPOINT_EXTENSION):
+                continue
+            try:
+                with open(os.path.join(self.checkpoint_dir, name)) as f:
+                    checkpoint = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if checkpoint.get("bucket") == self.bucket:
+                checkpoints.append(checkpoint)
+        return checkpoints
+
+    def resume_pending(self):
+        """
+        Finishes interrupted multipart uploads whose files are still in place.
+
+        Returns:
+            list: (file_path, key, succeeded) for every upload attempted.
+        """
+        results = []
+        for checkpoint in self.pending():
+            file_path, key = checkpoint["file"], checkpoint["key"]
+            if not os.path.isfile(file_path):
+                self.logger.warning(f"{file_path} is gone, aborting its multipart upload to {key}")
+                self._abort(checkpoint)
+                continue
+            results.append((file_path, key, self.upload(file_path, key)))
+        return results
+
+    # Multipart
+
+    def _part_size_for(self, size):
+        # Grow the part size for very large files so they fit in MAX_PARTS
+        part_size = self.part_size
+        while -(-size // part_size) > MAX_PARTS:
+            part_size *= 2
+        return part_size
+
+    def _abort(self, checkpoint):
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=checkpoint["key"], UploadId=checkpoint["upload_id"])
+        except (BotoCoreError, ClientError) as e:
+            self.logger.warning(f"Could not abort multipart upload {checkpoint['upload_id']}: {e}")
+        self._remove_checkpoint(checkpoint["key"])
+
+    def _uploaded_parts(self, checkpoint):
+        # The parts S3 holds for the upload; None if the upload no longer exists
+        parts = {}
+        kwargs = {"Bucket": self.bucket, "Key": checkpoint["key"], "UploadId": checkpoint["upload_id"]}
+        while True:
+            try:
+                response = self.call(self.client.list_parts, f"Listing parts of {checkpoint['key']}", **kwargs)
+            except ClientError as e:
+                if error_code(e) == 'NoSuchUpload':
+                    return None
+                raise
+            for part in response.get("Parts", []):
+                parts[str(part["PartNumber"])] = part["ETag"]
+            if not response.get("IsTruncated"):
+                return parts
+            kwargs["PartNumberMarker"] = response["NextPartNumberMarker"]
+
+    def _resume(self, file_path, key, stat):
+        checkpoint = self._load_checkpoint(key)
+        if checkpoint is None:
+            return None
+        if (checkpoint.get("file") != file_path or checkpoint.get("size") != stat.st_size
+                or checkpoint.get("mtime") != stat.st_mtime):
+            self.logger.info(f"{file_path} changed since its upload to {key} began, starting over")
+            self._abort(checkpoint)
+            return None
+        parts = self._uploaded_parts(checkpoint)
+        if parts is None:
+            self.logger.info(f"Multipart upload of {file_path} expired in S3, starting over")
+            self._remove_checkpoint(key)
+            return None
+        # S3's list is the source of truth; a part sent after the last checkpoint write still counts
+        checkpoint["parts"] = parts
+        self._count("resumed")
+        self.logger.info(f"Resuming upload of {file_path}: {len(parts)}/{checkpoint['part_count']} parts already in S3")
+        return checkpoint
+
+    def _upload_multipart(self, file_path, key):
+        stat = os.stat(file_path)
+        checkpoint = self._resume(file_path, key, stat)
+        if checkpoint is None:
+            part_size = self._part_size_for(stat.st_size)
+            response = self.call(self.client.create_multipart_upload, f"Starting upload of {file_path}",
+                                 Bucket=self.bucket, Key=key)
+            checkpoint = {
+                "bucket": self.bucket,
+                "key": key,
+                "file": file_path,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "part_size": part_size,
+                "part_count": max(1, -(-stat.st_size // part_size)),
+                "upload_id": response["UploadId"],
+                "parts": {},
+            }
+            self._save_checkpoint(checkpoint)
+
+        missing = [n for n in range(1, checkpoint["part_count"] + 1) if str(n) not in checkpoint["parts"]]
+        self._count("parts_skipped", checkpoint["part_count"] - len(missing))
+        lock = threading.Lock()
+
+        def send(part_number):
+            offset = (part_number - 1) * checkpoint["part_size"]
+            with open(file_path, 'rb') as f:
+                f.seek(offset)
+                body = f.read(checkpoint["part_size"])
+            response = self.call(self.client.upload_part, f"Part {part_number} of {file_path}",
+                                 Bucket=self.bucket, Key=key, UploadId=checkpoint["upload_id"],
+                                 PartNumber=part_number, Body=body)
+            with lock:
+                checkpoint["parts"][str(part_number)] = response["ETag"]
+                self._save_checkpoint(checkpoint)
+            self._count("parts_sent")
+
+        if missing:
+            executor = ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(missing)), thread_name_prefix='s3_part')
+            try:
+                futures = [executor.submit(send, n) for n in missing]
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # Parts not started yet are dropped; the checkpoint has the ones that made it
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+            executor.shutdown(wait=True)
+
+        parts = [{"PartNumber": int(n), "ETag": etag} for n, etag in sorted(checkpoint["parts"].items(), key=lambda p: int(p[0]))]
+        self.call(self.client.complete_multipart_upload, f"Completing upload of {file_path}",
+                  Bucket=self.bucket, Key=key, UploadId=checkpoint["upload_id"], MultipartUpload={"Parts": parts})
+        self._remove_checkpoint(key)
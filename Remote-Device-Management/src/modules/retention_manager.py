@@ -0,0 +1,50 @@
+import os
+import threading
+from dotenv import load_dotenv
+from batch_catalog import BatchCatalog
+from batch_retention import RetentionManager
+from queue_consumer import install_signal_handlers
+from log_setup import setup_logging
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure logging (shared setup in log_setup.py)
+logger = setup_logging(os.getenv('LOGGER_RETENTION', 'retention_manager'), os.getenv('LOG_FILE_RETENTION', 'retention_manager.log'))
+
+adc_batches_folder = os.getenv('FILE_DIRECTORY_ADC_BATCHES')
+
+# Keeps the batch filesystem between the low and high watermarks (fractions of the disk used).
+# Only batches the catalog records as uploaded are compressed, archived or deleted; LOCAL batches
+# (never uploaded at full resolution) only with RETENTION_EVICT_LOCAL=on.
+retention = RetentionManager(
+    BatchCatalog(),
+    adc_batches_folder,
+    os.getenv('RETENTION_ARCHIVE_DIRECTORY') or os.path.join(adc_batches_folder, 'daily'),
+    high_watermark=float(os.getenv('RETENTION_HIGH_WATERMARK', '0.85')),
+    low_watermark=float(os.getenv('RETENTION_LOW_WATERMARK', '0.70')),
+    compress_after=float(os.getenv('RETENTION_COMPRESS_AFTER', '600')),
+    evict_local=os.getenv('RETENTION_EVICT_LOCAL', 'off').lower() == 'on',
+    gzip_level=int(os.getenv('RETENTION_GZIP_LEVEL', '6')),
+    log=logger,
+)
+
+def main(stop_event=None):
+    """Runs the retention manager every RETENTION_INTERVAL seconds until stop_event is set."""
+    if stop_event is None:
+        stop_event = threading.Event()
+        install_signal_handlers(stop_event)
+    interval = float(os.getenv('RETENTION_INTERVAL', '300'))
+    logger.info(f"Retention manager started, disk at {retention.usage():.1%}.")
+    while not stop_event.is_set():
+        try:
+            result = retention.run_once()
+            if any(result.values()):
+                logger.info(f"Retention run: {result}, disk at {retention.usage():.1%}")
+        except Exception as e:
+            logger.error(f"Retention run failed: {e}")
+        stop_event.wait(interval)
+
+
+if __name__ == "__main__":
+    main()
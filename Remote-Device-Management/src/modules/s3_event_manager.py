@@ -2,11 +2,16 @@ import os
 import sys
 import json
 import subprocess
-from queue_server import QueueManager
+from queue_server import connect_queue
+from queue_consumer import QueueConsumer, install_signal_handlers
+from s3_uploader import S3Uploader, create_s3_client
+from batch_archiver import BatchArchiver
+from batch_catalog import BatchCatalog
+from batch_summary import summarize_batch, summary_path, write_summary
+from leak_detector import NORMAL
+from log_setup import setup_logging
+import metrics
 from dotenv import load_dotenv
-import time
-import boto3
-import logging
 
 # Load environment variables
 load_dotenv()
@@ -15,12 +20,8 @@ load_dotenv()
 adc_batches_folder = os.getenv('FILE_DIRECTORY_ADC_BATCHES')
 
 
-# Connect to the Queue Manager
-manager = QueueManager(address=(os.getenv('QUEUE_HOST'), int(os.getenv('QUEUE_PORT'))), authkey=os.getenv('AUTH_KEY').encode())
-manager.connect()
-
-# Get the queues
-s3_events_queue = manager.s3_events()
+# Connect to the queue server (QueueManager proxy or local socket, see QUEUE_TRANSPORT)
+s3_events_queue = connect_queue(os.getenv('S3_EVENTS_ID'))
 
 # AWS S3 Configuration
 aws_access_key_id = os.getenv('AWS_ACCESS_KEY_ID')          # Replace with your AWS Access Key ID
@@ -28,54 +29,77 @@ aws_secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')  # Replace with your
 aws_region_name = os.getenv('AWS_REGION')                  # Replace with your AWS Region
 s3_bucket_name = os.getenv('S3_BUCKET_NAME')            # Replace with your S3 bucket name
 dynamodb_table = os.getenv('DYNAMODB_TABLE')
-# Configure logging
-log_dir = os.getenv('LOG_DIRECTORY')  # Replace with your desired directory
-log_file = os.getenv('LOG_FILE_FILE_WATCHER')
-os.makedirs(log_dir, exist_ok=True)
-log_level = os.getenv('LOG_LEVEL', 'INFO').upper()  # Default to INFO if not set
-log_level = getattr(logging, log_level, logging.INFO)  # Default to logging.INFO if invalid
-try:
-    logger = logging.getLogger(os.getenv('LOGGER_FILE_WATCHER'))
-    logger.setLevel(log_level)  # Set the log 
-
-    file_handler_s3_manager = logging.FileHandler(os.path.join(log_dir, log_file))
-    file_handler_s3_manager.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s', datefmt="%Y-%m-%d %H:%M:%S"))
-    
-    # Add handlers to the ADC logger
-    logger.addHandler(file_handler_s3_manager)
-except Exception as e:
-    logger.error(f"Logging setup failed: {e}")
+# Configure logging (shared setup in log_setup.py)
+logger = setup_logging(os.getenv('LOGGER_FILE_WATCHER'), os.getenv('LOG_FILE_FILE_WATCHER'))
+metrics.start_metrics(os.getenv('METRICS_PORT_FILE_WATCHER'), os.getenv('METRICS_FILE_FILE_WATCHER'), log=logger)
+summary_seconds = metrics.histogram('batch_summary_seconds', 'Time to summarize a batch and write the summary')
+batches_kept_local = metrics.counter('s3_batches_kept_local_total', 'Unflagged batches left on the device by S3_UPLOAD_POLICY')
 
 # Ensure directories exist
 for folder in [adc_batches_folder]:
     if not os.path.exists(folder):
         os.makedirs(folder)
 
-s3 = boto3.client('s3',
-                  aws_access_key_id=aws_access_key_id,
-                  aws_secret_access_key=aws_secret_access_key,
-                  region_name=aws_region_name)
-
+# One pooled client and a bounded set of upload threads for the life of the service
+s3_upload_workers = int(os.getenv('S3_UPLOAD_WORKERS', '4'))
+s3 = create_s3_client(max_pool_connections=s3_upload_workers)
+catalog = BatchCatalog()
+uploader = S3Uploader(s3_bucket_name, client=s3, max_workers=s3_upload_workers, catalog=catalog, log=logger)
+
+# 'file' uploads every batch as its own object, 'archive' packs several batches per object
+s3_upload_mode = os.getenv('S3_UPLOAD_MODE', 'file').lower()
+archiver = None
+if s3_upload_mode == 'archive':
+    archiver = BatchArchiver(
+        uploader,
+        os.getenv('ARCHIVE_STAGING_DIRECTORY', os.path.join(adc_batches_folder, 'archives')),
+        max_batches=int(os.getenv('ARCHIVE_MAX_BATCHES', '10')),
+        max_age=float(os.getenv('ARCHIVE_MAX_AGE', '300')),
+        log=logger,
+    )
+
+
+# 'flagged' uploads only batches the leak detector flagged (and any it didn't classify),
+# 'all' uploads every batch
+s3_upload_policy = os.getenv('S3_UPLOAD_POLICY', 'flagged').lower()
+
+# Every batch is also summarized (decimated voltages + min/max envelope) and the
+# summary uploaded, so the cloud side sees the line between leaks; DOWNSAMPLE=off disables it
+downsample_enabled = os.getenv('DOWNSAMPLE', 'on').lower() != 'off'
+summary_folder = os.getenv('SUMMARY_DIRECTORY', os.path.join(adc_batches_folder, 'summaries'))
+summary_options = {
+    "target_rate": float(os.getenv('DOWNSAMPLE_RATE', '10')),
+    "envelope_window": float(os.getenv('ENVELOPE_WINDOW', '1.0')),
+}
+timezone = os.getenv('TIMEZONE')
+if downsample_enabled:
+    os.makedirs(summary_folder, exist_ok=True)
 
 # Python interpreter for script execution
 python_interpreter = os.getenv('PYTHON_INTERPRETER')
 
-# Downsampling and NPW classification script paths
+# Downsampling runs in-process (batch_summary.py); NPW classification runs on the device (leak_detector.py)
 
-s3_upload_script = os.path.join(os.getenv('BASE_DIRECTORY'),'src/modules','s3_upload.py')
 # dynamodb_upload_script = os.path.join(os.getenv('BASE_DIRECTORY'),'src/modules','dynamodb_upload.py')
 
 
 #Function for uploading to S3 
 def upload_to_s3(file_path):
-    file_name = os.path.basename(file_path)
+    # Runs on the uploader's worker pool; the result is logged by the uploader
+    if archiver is not None:
+        return archiver.add(file_path)
+    return uploader.submit(file_path)
+
+def upload_summary(file_path, classification):
+    # A failed summary never holds up the full-resolution upload
     try:
-        subprocess.run([python_interpreter, s3_upload_script, file_path], check=True)
-        logger.info(f"Uploaded {file_name} to S3 bucket: {s3_bucket_name}")
-        return True
+        with summary_seconds.timer():
+            summary = summarize_batch(file_path, classification=classification, tz=timezone, **summary_options)
+            path = write_summary(summary, summary_path(file_path, summary_folder))
     except Exception as e:
-        logger.error(f"Error uploading {file_name} to S3: {e}")
-        return False
+        logger.error(f"Error summarizing {file_path}: {e}")
+        return None
+    return uploader.submit(path, f"{summary['device'] or 'Unclassified'}/summaries/{os.path.basename(path)}")
 
 def upload_to_dynamodb(file_path):
     file_name = os.path.basename(file_path)
@@ -106,32 +130,56 @@ def process_event(event_data):
 
 
     if event_type == os.getenv('ADC_BATCH_CREATED_EVENT'):
+        if downsample_enabled:
+            upload_summary(file_path, event_data.get("classification"))
+        # Batches the on-device leak detector cleared stay local unless S3_UPLOAD_POLICY=all
+        if event_data.get("classification") == NORMAL and s3_upload_policy == 'flagged':
+            logger.info(f"Skipping full-resolution upload of unflagged batch: {file_path}")
+            # Not part of the upload backlog s3_upload.py catches up on
+            catalog.mark_local(file_path)
+            batches_kept_local.inc()
+            return
         logger.info(f"Processing for S3 Upload: {file_path}")
         upload_to_s3(file_path)
     else:
         logger.error(f"Unknown event type: {event_type}")
 
+def handle_message(message):
+    logger.info(f"Event received from s3_events_queue': {message}")
+    try:
+        # Parse the JSON message
+        event_data = json.loads(message)
+    except json.JSONDecodeError as e:
+        logger.error(f"Error parsing JSON data: {e}")
+        sys.exit(1)
+
+    #Process the event
+    process_event(event_data)
+
+def main(stop_event=None):
+    """
+    Handles s3_events until stop_event is set, or until SIGTERM/SIGINT when
+    no stop_event is given (run as a service).
+    """
+    # Block on the queue instead of polling empty() so an idle service uses no CPU
+    consumer = QueueConsumer(
+        s3_events_queue,
+        handle_message,
+        max_batch=int(os.getenv('QUEUE_MAX_BATCH', '32')),
+        timeout=float(os.getenv('QUEUE_GET_TIMEOUT', '1.0')),
+        stop_event=stop_event,
+        on_idle=archiver.flush_if_due if archiver is not None else None,
+        log=logger,
+    )
+    if stop_event is None:
+        install_signal_handlers(consumer.stop_event)
+    consumer.run()
+
+    # Ship partially filled archives and let queued uploads finish before exiting
+    if archiver is not None:
+        archiver.flush()
+    uploader.shutdown(wait=True)
+
 # Main entry point
 if __name__ == "__main__":
-    
-    while True:
-        try:
-            # Listen for events
-            if not s3_events_queue.empty():
-                message = s3_events_queue.get()            
-    
-                logger.info(f"Event received from s3_events_queue': {message}")
-
-                # Parse the JSON message
-                event_data = json.loads(message)
-
-                #Process the event
-                process_event(event_data)
-
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parsing JSON data: {e}")
-            sys.exit(1)
-        except Exception as e:
-            logger.error(f"Event encountered an error: {e}")
-
-
+    main()
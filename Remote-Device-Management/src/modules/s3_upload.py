@@ -1,33 +1,26 @@
-import boto3
 from dotenv import load_dotenv
 import sys
 import os
+import json
+import shutil
 import schedule
-import time
-import logging
-from botocore.exceptions import NoCredentialsError, PartialCredentialsError, BotoCoreError, ClientError
-import re
+import threading
+from botocore.exceptions import NoCredentialsError, PartialCredentialsError
+from s3_uploader import create_s3_client, get_s3_key, DEFAULT_FOLDER_NAMES
+from batch_catalog import BatchCatalog
+from resumable_upload import ResumableUploader, MB
+from catchup_scheduler import CatchUpScheduler
+from queue_server import connect_queue
+from queue_consumer import install_signal_handlers
+from log_setup import setup_logging
+import metrics
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging
-log_dir = os.getenv('LOG_DIRECTORY')  # Replace with your desired directory
-log_file = os.getenv('LOG_FILE_S3_UPLOAD')
-os.makedirs(log_dir, exist_ok=True)
-log_level = os.getenv('LOG_LEVEL', 'INFO').upper()  # Default to INFO if not set
-log_level = getattr(logging, log_level, logging.INFO)  # Default to logging.INFO if invalid
-try:
-    logger = logging.getLogger(os.getenv('LOGGER_S3_UPLOAD'))
-    logger.setLevel(log_level)  # Set the log level
-
-    file_handler_s3 = logging.FileHandler(os.path.join(log_dir, log_file))
-    file_handler_s3.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s', datefmt="%Y-%m-%d %H:%M:%S"))
-    
-    # Add handlers to the ADC logger
-    logger.addHandler(file_handler_s3)
-except Exception as e:
-    logger.error(f"Logging setup failed: {e}")
+# Configure logging (shared setup in log_setup.py)
+logger = setup_logging(os.getenv('LOGGER_S3_UPLOAD'), os.getenv('LOG_FILE_S3_UPLOAD'))
+metrics.start_metrics(os.getenv('METRICS_PORT_S3_UPLOAD'), os.getenv('METRICS_FILE_S3_UPLOAD'), log=logger)
 
 # AWS S3 Configuration
 aws_access_key_id = os.getenv('AWS_ACCESS_KEY_ID')
@@ -39,14 +32,12 @@ backup_folder = os.getenv('FILE_DIRECTORY_LEAKED_BATCHES_BACKUP')
 directory = os.getenv("FILE_DIRECTORY_ADC_BATCHES_BACKUP")
 # os.makedirs(backup_folder, exist_ok=True)
 
+# Parts uploaded in parallel; the client's connection pool is sized to match
+s3_max_concurrency = int(os.getenv('S3_MAX_CONCURRENCY', '4'))
+
 # Create an S3 client using your credentials
 try:
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-        region_name=aws_region_name
-    )
+    s3 = create_s3_client(max_pool_connections=s3_max_concurrency)
     logger.info("S3 client initialized successfully.")
 except Exception as e:
     logger.error(f"Failed to initialize S3 client: {e}")
@@ -74,62 +65,166 @@ def create_folders_in_s3(s3_bucket_name, folder_names):
     except Exception as e:
         logger.error(f"An error occurred: {e}")
 
-s3_bucket_name = os.getenv('S3_BUCKET_NAME')
-folder_names = ["BFA1", "BFA2", "BFA3"]
+folder_names = DEFAULT_FOLDER_NAMES
+
+# Shared with the sampler and s3_event_manager; records which batches reached S3
+catalog = BatchCatalog()
+
+# Files from S3_MULTIPART_THRESHOLD MB up are sent as multipart uploads that resume from a
+# checkpoint after a crash or lost link; every S3 call is retried with jittered backoff
+engine = ResumableUploader(
+    s3,
+    s3_bucket_name,
+    os.getenv('S3_CHECKPOINT_DIRECTORY') or os.path.join(os.getenv('BASE_DIRECTORY', '.'), 'data', 'upload_checkpoints'),
+    part_size=int(float(os.getenv('S3_PART_SIZE_MB', '8')) * MB),
+    multipart_threshold=int(float(os.getenv('S3_MULTIPART_THRESHOLD_MB', '16')) * MB),
+    max_concurrency=s3_max_concurrency,
+    max_attempts=int(os.getenv('S3_MAX_ATTEMPTS', '5')),
+    base_delay=float(os.getenv('S3_RETRY_BASE_DELAY', '0.5')),
+    max_delay=float(os.getenv('S3_RETRY_MAX_DELAY', '30')),
+    log=logger,
+)
+
+def move_to_backup(file_path):
+    """
+    Moves an uploaded batch into FILE_DIRECTORY_ADC_BATCHES_BACKUP (when set)
+    and points its catalog entry at the new path.
 
-create_folders_in_s3(s3_bucket_name, folder_names)
+    Returns:
+        str: Where the file now is.
+    """
+    if not directory or os.path.dirname(os.path.abspath(file_path)) == os.path.abspath(directory):
+        return file_path
+    os.makedirs(directory, exist_ok=True)
+    backup_path = os.path.join(directory, os.path.basename(file_path))
+    shutil.move(file_path, backup_path)
+    catalog.update_path(file_path, backup_path)
+    logger.info(f"Moved {file_path} to {backup_path}")
+    return backup_path
+
+def record_uploaded(file_path):
+    # The object is in S3 either way; a failure here only leaves the file where it was
+    try:
+        catalog.mark_uploaded(file_path)
+        move_to_backup(file_path)
+    except Exception as e:
+        logger.error(f"Uploaded {file_path} but failed to record it: {e}")
 
 def upload_to_s3(leaked_file_path):
     """
-    Uploads a file to the specified S3 bucket with the folder name containing the timestamp.
+    Uploads files to the specified S3 bucket, under the device folder taken from the file name.
+    Uploaded files are marked in the batch catalog and moved to the backup directory.
+
+    Returns:
+        bool: True if every file was uploaded. A failed file doesn't stop the rest.
     """
     if isinstance(leaked_file_path, str):
         leaked_file_path = [leaked_file_path]  # Convert single file path to list
 
+    all_uploaded = True
     for file_path in leaked_file_path:
         file_name = os.path.basename(file_path)
         logger.info(f"Processing file: {file_name}")
 
-        # Extracting BFAx and Timestamp
-        match = re.search(r"(BFA\d+)_(Batch\d+)_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})", file_name)
-        if match:
-            batch_number = match.group(2)
-            main_folder = match.group(1)  # Extract 'BFAx'
-            timestamp = match.group(3)  # Extract 'YYYY-MM-DD_HH-MM-SS'
-            folder_path = f"{main_folder}/{file_name}"  # Folder structure: BFAx/YYYY-MM-DD_HH-MM-SS
-        else:
-            folder_path = "Unclassified"
+        # Folder structure: BFAx/<file_name>
+        s3_key = get_s3_key(file_name)
+        if s3_key.startswith("Unclassified/"):
             logger.warning(f"File {file_name} uploaded to Unclassified folder")
-            batch_number = None
 
-        # Set full path in S3
-        s3_key = folder_path
-
-        try:
-            s3.upload_file(file_path, s3_bucket_name, s3_key)
-            logger.info(f"Uploaded {file_path} to S3: {s3_bucket_name}/{s3_key}")
-            # move_to_backup(file_path)  # Move to backup after successful upload
-        except (BotoCoreError, ClientError) as e:
-            logger.error(f"Error uploading {file_path} to S3: {e}")
-            return False
-
-    return True
-
-
-
-# Check if a filename argument is passed
-if len(sys.argv) == 2:
-    save_path = sys.argv[1]
+        if engine.upload(file_path, s3_key):
+            record_uploaded(file_path)
+        else:
+            all_uploaded = False
 
-    if not os.path.isfile(save_path):
-        logger.error(f"The file {save_path} does not exist.")
-        sys.exit(1)
+    return all_uploaded
 
-    # Upload the specified file
-    upload_to_s3(save_path)
-    sys.exit(0)  # Exit after processing the file
 
-else:
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
\ No newline at end of file
+# Catch-up of batches the live path missed (network, queue server or s3_event_manager down).
+# Paced by S3_CATCHUP_BANDWIDTH_KBPS and paused while s3_event_manager has events to upload.
+# Batches newer than S3_CATCHUP_MIN_AGE seconds are left to s3_event_manager, which may be
+# uploading one or holding it for an archive (ARCHIVE_MAX_AGE) after taking it off the queue.
+live_queue = None
+def live_uploads_pending():
+    global live_queue
+    try:
+        if live_queue is None:
+            live_queue = connect_queue(os.getenv('S3_EVENTS_ID'))
+        return live_queue.qsize() > 0
+    except Exception:
+        # Without a queue server there are no live uploads to give way to
+        live_queue = None
+        return False
+
+catchup = CatchUpScheduler(
+    catalog,
+    upload_to_s3,
+    bandwidth=float(os.getenv('S3_CATCHUP_BANDWIDTH_KBPS', '0')) * 1024,
+    live_busy=live_uploads_pending,
+    live_grace=float(os.getenv('S3_CATCHUP_LIVE_GRACE', '10')),
+    min_age=float(os.getenv('S3_CATCHUP_MIN_AGE') or float(os.getenv('ARCHIVE_MAX_AGE', '300')) + 300),
+    upload_policy=os.getenv('S3_UPLOAD_POLICY', 'flagged').lower(),
+    log=logger,
+)
+
+# The last catch-up metrics, also exposed as gauges
+catchup_metrics = {}
+for key, description in (("backlog", "Batches waiting for catch-up upload"),
+                         ("backlog_leaked", "LEAKED batches waiting for catch-up upload"),
+                         ("drain_per_min", "Catch-up batches uploaded per minute, recent window"),
+                         ("eta_s", "Estimated seconds until the catch-up backlog is drained")):
+    metrics.gauge(f"s3_catchup_{key}", description, func=lambda key=key: catchup_metrics.get(key))
+
+def run_catchup():
+    # One slice per scheduler tick, so a long backlog doesn't hold up the schedule
+    catchup.run_once(max_seconds=float(os.getenv('S3_CATCHUP_SLICE', '60')))
+    catchup_metrics.update(catchup.metrics())
+    logger.info(f"Catch-up metrics: {catchup_metrics}")
+    metrics_file = os.getenv('S3_CATCHUP_METRICS_FILE')
+    if metrics_file:
+        with open(metrics_file + '.tmp', 'w') as f:
+            json.dump(catchup_metrics, f)
+        os.replace(metrics_file + '.tmp', metrics_file)
+
+
+def main(stop_event=None):
+    """
+    Finishes interrupted multipart uploads, then runs the catch-up every
+    S3_CATCHUP_INTERVAL seconds until stop_event is set, or until
+    SIGTERM/SIGINT when no stop_event is given (run as a service).
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+        install_signal_handlers(stop_event)
+    # A slice in progress ends early on stop
+    catchup.stop_event = stop_event
+    create_folders_in_s3(s3_bucket_name, folder_names)
+
+    # Finish multipart uploads a crash or reboot interrupted
+    for file_path, _, uploaded in engine.resume_pending():
+        if uploaded:
+            record_uploaded(file_path)
+
+    run_catchup()
+    scheduler = schedule.Scheduler()
+    scheduler.every(int(os.getenv('S3_CATCHUP_INTERVAL', '60'))).seconds.do(run_catchup)
+    while not stop_event.is_set():
+        scheduler.run_pending()
+        stop_event.wait(1)
+
+
+if __name__ == "__main__":
+    # Check if a filename argument is passed
+    if len(sys.argv) == 2:
+        save_path = sys.argv[1]
+
+        if not os.path.isfile(save_path):
+            logger.error(f"The file {save_path} does not exist.")
+            sys.exit(1)
+
+        # Upload the specified file
+        create_folders_in_s3(s3_bucket_name, folder_names)
+        upload_to_s3(save_path)
+        sys.exit(0)  # Exit after processing the file
+
+    else:
+        main()
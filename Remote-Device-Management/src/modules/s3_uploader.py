@@ -0,0 +1,178 @@
+import os
+import re
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.exceptions import S3UploadFailedError
+from botocore.config import Config
+from botocore.exceptions import NoCredentialsError, PartialCredentialsError, BotoCoreError, ClientError
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Shared with resumable_upload.py; each service process reports its own
+upload_seconds = metrics.histogram('s3_upload_seconds', 'Time to upload one file to S3, retries included')
+uploaded_bytes = metrics.counter('s3_upload_bytes_total', 'Bytes of files uploaded to S3')
+uploads_ok = metrics.counter('s3_uploads_total', 'Files sent to S3, by result', {"result": "ok"})
+uploads_failed = metrics.counter('s3_uploads_total', 'Files sent to S3, by result', {"result": "failed"})
+uploads_pending = metrics.gauge('s3_uploads_pending', 'Uploads submitted to the worker pool and not finished')
+
+# Device folders created in the bucket before the first upload
+DEFAULT_FOLDER_NAMES = ["BFA1", "BFA2", "BFA3"]
+
+BATCH_FILE_PATTERN = re.compile(r"(BFA\d+)_(Batch\d+)_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})")
+
+
+def get_s3_key(file_name):
+    """
+    Returns the S3 key for a batch file: 'BFAx/<file_name>' for files named
+    BFAx_BatchN_<timestamp>, 'Unclassified/<file_name>' for anything else.
+    """
+    match = BATCH_FILE_PATTERN.search(file_name)
+    if match:
+        return f"{match.group(1)}/{file_name}"
+    return f"Unclassified/{file_name}"
+
+
+def create_s3_client(max_pool_connections=10):
+    """
+    Creates an S3 client from the AWS_* environment settings. The connection
+    pool is sized for the number of upload threads that share the client.
+    """
+    return boto3.client(
+        's3',
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        region_name=os.getenv('AWS_REGION'),
+        config=Config(max_pool_connections=max_pool_connections),
+    )
+
+
+def record_upload(file_path, seconds):
+    """Counts a successful upload of file_path that took seconds."""
+    uploads_ok.inc()
+    upload_seconds.observe(seconds)
+    try:
+        uploaded_bytes.inc(os.path.getsize(file_path))
+    except OSError:
+        pass
+
+
+class S3Uploader:
+    """
+    Long-lived upload engine shared by a service process.
+
+    Holds one S3 client (boto3 clients are thread-safe and keep their HTTP
+    connections pooled), a bounded pool of upload threads and creates the
+    device folder markers once per process rather than once per file.
+
+    Args:
+        bucket (str): Name of the S3 bucket.
+        client: S3 client to use. One is created when not given.
+        max_workers (int): Number of upload threads.
+        max_pending (int): Maximum number of submitted uploads not yet
+            finished. submit() blocks once it is reached, which keeps a slow
+            link from building an unbounded backlog in memory.
+        folder_names (list): Folder markers to create before the first upload.
+        catalog (BatchCatalog): Batch catalog to mark uploaded batches in.
+        log (logging.Logger): Service logger to report to.
+    """
+
+    def __init__(self, bucket, client=None, max_workers=4, max_pending=None, folder_names=DEFAULT_FOLDER_NAMES, catalog=None, log=None):
+        self.bucket = bucket
+        self.client = client or create_s3_client(max_pool_connections=max_workers)
+        self.folder_names = list(folder_names)
+        self.catalog = catalog
+        self.logger = log or logger
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='s3_upload')
+        self._pending = threading.BoundedSemaphore(max_pending or 2 * max_workers)
+        self._folders_lock = threading.Lock()
+        self._folders_created = False
+
+    def ensure_folders(self):
+        """
+        Creates the device folder markers in the bucket, once per uploader.
+        A failed attempt is retried on the next upload.
+        """
+        if self._folders_created:
+            return
+        with self._folders_lock:
+            if self._folders_created:
+                return
+            try:
+                for folder_name in self.folder_names:
+                    if not folder_name.endswith('/'):
+                        folder_name += '/'
+                    self.client.put_object(Bucket=self.bucket, Key=folder_name)
+                    self.logger.info(f"Folder '{folder_name}' created successfully in bucket '{self.bucket}'.")
+                self._folders_created = True
+            except NoCredentialsError:
+                self.logger.error("AWS credentials not found. Please configure them.")
+            except PartialCredentialsError:
+                self.logger.error("Incomplete AWS credentials. Please check your configuration.")
+            except (BotoCoreError, ClientError) as e:
+                self.logger.error(f"An error occurred creating folders: {e}")
+
+    def upload_file(self, file_path, s3_key=None):
+        """
+        Uploads one file in the calling thread.
+
+        Args:
+            file_path (str): Local path of the file.
+            s3_key (str): Destination key, derived from the file name by default.
+
+        Returns:
+            bool: True if the upload succeeded.
+        """
+        self.ensure_folders()
+        s3_key = s3_key or get_s3_key(os.path.basename(file_path))
+        start = time.perf_counter()
+        try:
+            self.client.upload_file(file_path, self.bucket, s3_key)
+            self.logger.info(f"Uploaded {file_path} to S3: {self.bucket}/{s3_key}")
+        # upload_file raises S3's errors wrapped in S3UploadFailedError
+        except (S3UploadFailedError, BotoCoreError, ClientError, OSError) as e:
+            uploads_failed.inc()
+            self.logger.error(f"Error uploading {file_path} to S3: {e}")
+            return False
+        record_upload(file_path, time.perf_counter() - start)
+        self.mark_uploaded(file_path)
+        return True
+
+    def mark_uploaded(self, file_path):
+        """Records a batch as uploaded in the catalog, if there is one."""
+        if self.catalog is None:
+            return
+        try:
+            self.catalog.mark_uploaded(file_path)
+        except Exception as e:
+            self.logger.error(f"Failed to mark {file_path} as uploaded in the batch catalog: {e}")
+
+    def submit(self, file_path, s3_key=None):
+        """
+        Queues an upload on the worker pool, blocking while max_pending
+        uploads are already in flight.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the upload_file() result.
+        """
+        self._pending.acquire()
+        uploads_pending.inc()
+        try:
+            future = self._executor.submit(self.upload_file, file_path, s3_key)
+        except Exception:
+            uploads_pending.dec()
+            self._pending.release()
+            raise
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        uploads_pending.dec()
+        self._pending.release()
+
+    def shutdown(self, wait=True):
+        """Waits for queued uploads (if wait) and stops the worker threads."""
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,109 @@
+"""
+Shadow payload encoding for pubsub2.
+
+Constant documents (CONFIG status, LWT) are encoded once with
+encode_document() and reused as bytes. Reported-state updates are encoded by
+ReportedEncoder from cached per-section templates: the field names and JSON
+punctuation are formatted once per section layout, and only the values are
+encoded per update. Output is compact JSON (no spaces), which the shadow
+service accepts like any other JSON.
+"""
+import os
+import re
+import json
+from json.encoder import encode_basestring_ascii
+
+BATCH_TIME_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})")
+
+_DOCUMENT_PREFIX = '{"state":{"reported":{'
+_DOCUMENT_SUFFIX = '}}}'
+
+
+def encode_document(document):
+    """Encodes a constant document once, e.g. the active or LWT payload."""
+    return json.dumps(document, separators=(',', ':')).encode('utf-8')
+
+
+def encode_value(value):
+    """Encodes one JSON scalar; anything else falls back to json.dumps."""
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if type(value) is int:
+        return int.__repr__(value)
+    if type(value) is float and value == value and value not in (float('inf'), float('-inf')):
+        return float.__repr__(value)
+    return json.dumps(value, separators=(',', ':'))
+
+
+class ReportedEncoder:
+    """
+    Encodes {"state": {"reported": {...}}} documents from a reported dict of
+    sections ({"GPS": {...}, "MONITORING": {...}}) using templates cached by
+    section name and field names.
+    """
+
+    def __init__(self):
+        self._templates = {}
+
+    def _template(self, section, keys):
+        template = self._templates.get((section, keys))
+        if template is None:
+            fields = ','.join(f"{encode_basestring_ascii(k).replace('%', '%%')}:%s" for k in keys)
+            template = f"{encode_basestring_ascii(section).replace('%', '%%')}:{{{fields}}}"
+            self._templates[(section, keys)] = template
+        return template
+
+    def encode_section(self, section, fields):
+        keys = tuple(fields)
+        return self._template(section, keys) % tuple([encode_value(fields[k]) for k in keys])
+
+    def encode(self, reported):
+        """Returns the encoded update document for reported as bytes."""
+        sections = ','.join([self.encode_section(section, fields) for section, fields in reported.items()])
+        return (_DOCUMENT_PREFIX + sections + _DOCUMENT_SUFFIX).encode('ascii')
+
+
+def gps_fragment(event_data):
+    """Returns the reported GPS section for a GPS_UPDATE event."""
+    return {
+        "GPS": {
+            "LAST_REPORTED": event_data.get("time"),
+            "LATITUDE": event_data.get("latitude"),
+            "LONGITUDE": event_data.get("longitude"),
+            "MAPS_LINK": event_data.get("maps_link"),
+        }
+    }
+
+
+def monitoring_fragment(event_data):
+    """
+    Returns the reported MONITORING section for a MONITORING event. The leak
+    time is taken from the classified batch's file name.
+    """
+    date_time = "NO LEAK"
+    if event_data.get("classification") == 'LEAKED':
+        match = BATCH_TIME_PATTERN.search(os.path.basename(event_data.get("file_path") or ""))
+        if match:
+            date_time = match.group(1)
+    return {
+        "MONITORING": {
+            "LEAK": event_data.get("LEAK"),
+            "LAST_LEAK_REPORTED_TIME": date_time,
+        }
+    }
+
+
+def account_fragment(serial_number, device_name):
+    """Returns the reported ACCOUNT section with the device's serial number and name."""
+    return {
+        "ACCOUNT": {
+            "SERIAL_NO": serial_number,
+            "DEVICE_NAME": device_name,
+        }
+    }
@@ -0,0 +1,147 @@
+import json
+import time
+import logging
+import threading
+from collections import deque
+from shadow_payloads import ReportedEncoder
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowPublisher:
+    """
+    Coalesces reported-state fragments into one shadow update per flush window.
+
+    Fragments ({"GPS": {...}}, {"MONITORING": {...}}, ...) are merged into a
+    pending document, later values replacing earlier ones. On flush, fields
+    whose value matches what was last published are dropped, and whatever is
+    left goes out as a single {"state": {"reported": ...}} document, encoded
+    from cached templates (see shadow_payloads.ReportedEncoder). Flushes
+    are spaced at least 1 / max_rate seconds apart, so a burst of events costs
+    one QoS1 publish (and one PUBACK) instead of one or two per event.
+
+    A published document that later fails can be handed back with requeue();
+    its fields are sent again with the next flush unless a newer value for
+    them has gone out since.
+
+    Args:
+        publish (callable): Called with the encoded document (bytes); raising
+            keeps the changes pending for the next flush.
+        flush_window (float): Seconds an update may wait for others to merge with.
+        max_rate (float): Maximum shadow updates per second, 0 for no limit.
+        log (logging.Logger): Service logger to report to.
+    """
+
+    def __init__(self, publish, flush_window=1.0, max_rate=1.0, log=None):
+        self._publish = publish
+        self._encoder = ReportedEncoder()
+        self.flush_window = flush_window
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.logger = log or logger
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_since = None
+        self._reported = {}
+        self._last_publish = float('-inf')
+        # Failed documents from requeue(), merged on the next flush
+        self._failed = deque()
+        self.stats = {"updates": 0, "published": 0, "unchanged_fields": 0}
+
+    def update(self, fragment):
+        """Merges a reported-state fragment into the pending document."""
+        with self._lock:
+            for section, fields in fragment.items():
+                self._pending.setdefault(section, {}).update(fields)
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            self.stats["updates"] += 1
+
+    def requeue(self, payload):
+        """
+        Takes back an encoded document whose publish failed. Safe to call
+        from any thread, also from inside the publish callable.
+        """
+        self._failed.append(payload)
+
+    def _merge_failed(self):
+        # Called with the lock held. A failed field is pending again unless a newer
+        # value was reported since or is already pending; replaying it would undo that one
+        while self._failed:
+            try:
+                failed = json.loads(self._failed.popleft())["state"]["reported"]
+            except (ValueError, KeyError, TypeError) as e:
+                self.logger.error(f"Dropping a failed shadow update that can't be decoded: {e}")
+                continue
+            for section, fields in failed.items():
+                reported = self._reported.get(section, {})
+                pending = self._pending.setdefault(section, {})
+                for key, value in fields.items():
+                    if key in reported and reported[key] != value:
+                        continue
+                    reported.pop(key, None)
+                    pending.setdefault(key, value)
+                if not pending:
+                    del self._pending[section]
+            if self._pending and self._pending_since is None:
+                self._pending_since = time.monotonic()
+
+    def forget(self, section=None):
+        """
+        Forgets what was published for section (or everything), so the next
+        flush sends it again even if unchanged.
+        """
+        with self._lock:
+            if section is None:
+                self._reported.clear()
+            else:
+                self._reported.pop(section, None)
+
+    def _changes(self):
+        # Pending fields that differ from what the shadow was last sent
+        changes = {}
+        for section, fields in self._pending.items():
+            reported = self._reported.get(section, {})
+            changed = {k: v for k, v in fields.items() if k not in reported or reported[k] != v}
+            self.stats["unchanged_fields"] += len(fields) - len(changed)
+            if changed:
+                changes[section] = changed
+        return changes
+
+    def flush_if_due(self):
+        """Publishes pending changes once the flush window and rate limit allow it."""
+        now = time.monotonic()
+        with self._lock:
+            self._merge_failed()
+            if self._pending_since is None:
+                return False
+            if now - self._pending_since < self.flush_window or now - self._last_publish < self.min_interval:
+                return False
+        return self.flush()
+
+    def flush(self):
+        """
+        Publishes pending changes now, ignoring the window and rate limit.
+
+        Returns:
+            bool: True if a document was published.
+        """
+        with self._lock:
+            self._merge_failed()
+            changes = self._changes()
+            self._pending = {}
+            self._pending_since = None
+            if not changes:
+                return False
+            payload = self._encoder.encode(changes)
+            try:
+                self._publish(payload)
+            except Exception as e:
+                self.logger.error(f"Shadow update failed, keeping it for the next flush: {e}")
+                self._pending = changes
+                self._pending_since = time.monotonic()
+                return False
+            for section, fields in changes.items():
+                self._reported.setdefault(section, {}).update(fields)
+            self._last_publish = time.monotonic()
+            self.stats["published"] += 1
+            return True
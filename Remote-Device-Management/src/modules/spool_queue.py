@@ -0,0 +1,397 @@
+"""
+Durable, append-only queue backend for queue_server.py.
+
+Each queue lives in its own directory:
+
+    <first seq>.seg   segments of records: seq (u64) | length (u32) | crc32 (u32) | pickled item
+    acked             log of u64 values; the last one is the highest acknowledged seq
+
+Records and acks are flushed to the OS as they are written, so they survive a crash
+of the queue server; they reach the disk on the next fsync, which is batched
+(see SpoolQueue). An item handed out by get() stays on disk until the
+consumer calls task_done(). On startup every record after the last
+acknowledged one is replayed, so events that were queued or in flight when
+the server stopped are delivered again (at-least-once).
+"""
+import os
+import zlib
+import time
+import pickle
+import struct
+import logging
+import threading
+from collections import deque
+from queue import Empty
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.seg'
+ACK_FILE = 'acked'
+
+FSYNC_ALWAYS = 'always'
+FSYNC_BATCH = 'batch'
+FSYNC_NEVER = 'never'
+
+_RECORD = struct.Struct('<QII')
+_ACK = struct.Struct('<Q')
+# Rewrite the ack log once it grows past this many bytes
+_ACK_LOG_LIMIT = 64 * 1024
+
+
+def _segment_name(first_seq):
+    return f"{first_seq:020d}{SEGMENT_SUFFIX}"
+
+
+def _read_segment(path):
+    """
+    Reads the records of one segment.
+
+    Returns:
+        tuple: (list of (seq, item), byte offset of the end of the last
+        valid record). A torn or corrupt tail stops the read.
+    """
+    records = []
+    valid_end = 0
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + _RECORD.size <= len(data):
+        seq, length, crc = _RECORD.unpack_from(data, offset)
+        start = offset + _RECORD.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        try:
+            records.append((seq, pickle.loads(payload)))
+        except Exception:
+            break
+        offset = valid_end = start + length
+    return records, valid_end
+
+
+class SpoolQueue:
+    """
+    Persistent FIFO queue with the queue.Queue interface used by the
+    services (put, get, get_nowait, task_done, qsize, empty, join).
+
+    Acknowledgement follows queue.Queue: every get() must be matched by a
+    task_done() once the item is handled, and task_done() acknowledges the
+    oldest item still in flight. Acknowledged records are dropped with their
+    segment once every record in it is acknowledged.
+
+    Pending items are also kept in memory, so gets never touch the disk; the
+    queues carry small event messages and stay short.
+
+    Args:
+        directory (str): Directory holding this queue's segments.
+        fsync (str): 'batch' fsyncs at most every fsync_interval seconds (or
+            after fsync_batch puts) from a background thread, 'always'
+            fsyncs before put() and task_done() return, 'never' leaves it
+            to the OS.
+        fsync_interval (float): Seconds between batched fsyncs.
+        fsync_batch (int): Puts that trigger an early batched fsync.
+        segment_bytes (int): Size at which a new segment is started.
+        name (str): Name used in log messages.
+    """
+
+    def __init__(self, directory, fsync=FSYNC_BATCH, fsync_interval=0.05, fsync_batch=256, segment_bytes=4 * 1024 * 1024, name=None):
+        if fsync not in (FSYNC_ALWAYS, FSYNC_BATCH, FSYNC_NEVER):
+            raise ValueError(f"Unknown fsync mode: {fsync}")
+        self.directory = directory
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = max(1, int(fsync_batch))
+        self.segment_bytes = segment_bytes
+        self.name = name or os.path.basename(os.path.normpath(directory))
+        os.makedirs(directory, exist_ok=True)
+
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._all_done = threading.Condition(self._mutex)
+        self._ready = deque()
+        self._inflight = deque()
+        # Seqs removed by discard_oldest() and not yet covered by the ack log
+        self._discarded = deque()
+        self._segments = []
+        self._segment_file = None
+        self._segment_size = 0
+        self._unsynced = 0
+        self._closed = False
+
+        self._acked = self._read_acked()
+        self._ack_file = open(os.path.join(directory, ACK_FILE), 'ab')
+        self._next_seq = self._replay()
+        self._open_segment(self._next_seq)
+
+        labels = {"queue": self.name}
+        self._puts = metrics.counter('spool_puts_total', 'Items appended to a spool queue', labels)
+        self._acks = metrics.counter('spool_acks_total', 'Items acknowledged in a spool queue', labels)
+        self._fsync_seconds = metrics.histogram('spool_fsync_seconds', 'Time to fsync a spool segment and ack log', labels)
+        metrics.gauge('spool_unacked', 'Items handed out by a spool queue and not yet acknowledged', labels, func=self.unacked)
+
+        self._sync_wakeup = threading.Event()
+        self._sync_thread = None
+        if self.fsync == FSYNC_BATCH:
+            self._sync_thread = threading.Thread(target=self._sync_loop, name=f'spool_sync_{self.name}', daemon=True)
+            self._sync_thread.start()
+
+    # Startup
+
+    def _read_acked(self):
+        path = os.path.join(self.directory, ACK_FILE)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        # A torn final write leaves a partial value; use the last complete one
+        usable = len(data) - len(data) % _ACK.size
+        if usable == 0:
+            return 0
+        return _ACK.unpack_from(data, usable - _ACK.size)[0]
+
+    def _replay(self):
+        """Loads unacknowledged records and returns the next sequence number."""
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(SEGMENT_SUFFIX))
+        next_seq = self._acked + 1
+        for file_name in names:
+            path = os.path.join(self.directory, file_name)
+            records, valid_end = _read_segment(path)
+            if valid_end < os.path.getsize(path):
+                logger.warning(f"Spool {self.name}: truncating damaged tail of {file_name} at byte {valid_end}.")
+                with open(path, 'r+b') as f:
+                    f.truncate(valid_end)
+            for seq, item in records:
+                if seq > self._acked:
+                    self._ready.append((seq, item))
+                next_seq = max(next_seq, seq + 1)
+            if not records or records[-1][0] <= self._acked:
+                # Fully acknowledged (or empty) before the restart
+                os.remove(path)
+            else:
+                self._segments.append((int(file_name[:-len(SEGMENT_SUFFIX)]), path))
+        if self._ready:
+            logger.info(f"Spool {self.name}: replayed {len(self._ready)} unacknowledged events.")
+        return next_seq
+
+    # Segments
+
+    def _open_segment(self, first_seq):
+        if self._segment_file is not None:
+            self._segment_file.flush()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(self._segment_file.fileno())
+            self._segment_file.close()
+        path = os.path.join(self.directory, _segment_name(first_seq))
+        self._segment_file = open(path, 'ab')
+        self._segment_size = self._segment_file.tell()
+        self._segments.append((first_seq, path))
+
+    def _drop_acked_segments(self):
+        # A segment is done once the seq before the next segment's first is acknowledged;
+        # the active (last) segment is never dropped
+        while len(self._segments) > 1 and self._segments[1][0] - 1 <= self._acked:
+            _, path = self._segments.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # Durability
+
+    def _sync(self):
+        """Flushes and fsyncs the active segment and the ack log. Called with the mutex held."""
+        self._segment_file.flush()
+        self._ack_file.flush()
+        if self.fsync != FSYNC_NEVER:
+            with self._fsync_seconds.timer():
+                os.fsync(self._segment_file.fileno())
+                os.fsync(self._ack_file.fileno())
+        self._unsynced = 0
+
+    def _sync_loop(self):
+        while not self._closed:
+            self._sync_wakeup.wait(self.fsync_interval)
+            self._sync_wakeup.clear()
+            with self._mutex:
+                if self._closed:
+                    break
+                if self._unsynced:
+                    try:
+                        self._sync()
+                    except OSError as e:
+                        logger.error(f"Spool {self.name}: fsync failed: {e}")
+
+    def _written(self):
+        self._unsynced += 1
+        if self.fsync == FSYNC_ALWAYS:
+            self._sync()
+        elif self.fsync == FSYNC_BATCH and self._unsynced >= self.fsync_batch:
+            self._sync_wakeup.set()
+
+    # queue.Queue interface
+
+    def put(self, item, block=True, timeout=None):
+        """Appends item to the spool. The queue is unbounded, so put never blocks."""
+        payload = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._mutex:
+            if self._closed:
+                raise ValueError(f"Spool {self.name} is closed")
+            if self._segment_size >= self.segment_bytes:
+                self._open_segment(self._next_seq)
+            seq = self._next_seq
+            self._next_seq += 1
+            self._segment_file.write(_RECORD.pack(seq, len(payload), zlib.crc32(payload)))
+            self._segment_file.write(payload)
+            # Hand the record to the OS now so a crash of this process can't lose it
+            self._segment_file.flush()
+            self._segment_size += _RECORD.size + len(payload)
+            self._written()
+            self._puts.inc()
+            self._ready.append((seq, item))
+            self._not_empty.notify()
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        """
+        Removes and returns the next item. It stays in the spool, and is
+        replayed after a restart, until task_done() acknowledges it.
+        """
+        with self._not_empty:
+            if not block:
+                if not self._ready:
+                    raise Empty
+            elif timeout is None:
+                while not self._ready:
+                    self._not_empty.wait()
+            else:
+                if timeout < 0:
+                    raise ValueError("'timeout' must be a non-negative number")
+                deadline = time.monotonic() + timeout
+                while not self._ready:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Empty
+                    self._not_empty.wait(remaining)
+            seq, item = self._ready.popleft()
+            self._inflight.append((seq, item))
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self):
+        """Acknowledges the oldest item handed out by get()."""
+        with self._mutex:
+            if not self._inflight:
+                raise ValueError('task_done() called too many times')
+            seq, _ = self._inflight.popleft()
+            self._ack(seq)
+            self._ack_discarded()
+            if not self._ready and not self._inflight:
+                self._all_done.notify_all()
+
+    def discard_oldest(self):
+        """
+        Removes the next item without handing it out, e.g. to drop the oldest
+        when the queue is over a size limit. Items already handed out by get()
+        are left alone. The ack log holds only the highest acknowledged seq,
+        so the discarded record is acknowledged once every item before it is;
+        until then a restart replays it.
+
+        Returns:
+            The discarded item.
+
+        Raises:
+            Empty: Nothing is waiting to be got.
+        """
+        with self._mutex:
+            if not self._ready:
+                raise Empty
+            seq, item = self._ready.popleft()
+            self._discarded.append(seq)
+            self._ack_discarded()
+            if not self._ready and not self._inflight:
+                self._all_done.notify_all()
+            return item
+
+    def _ack(self, seq):
+        # Called with the mutex held; every seq before this one is acknowledged
+        self._acked = seq
+        self._ack_file.write(_ACK.pack(seq))
+        self._ack_file.flush()
+        self._written()
+        self._acks.inc()
+        self._drop_acked_segments()
+        if self._ack_file.tell() > _ACK_LOG_LIMIT:
+            self._compact_ack_log()
+
+    def _ack_discarded(self):
+        # Called with the mutex held; acknowledges discarded seqs older than anything still pending
+        pending = self._inflight or self._ready
+        while self._discarded and (not pending or self._discarded[0] < pending[0][0]):
+            self._ack(self._discarded.popleft())
+
+    def requeue_unacked(self):
+        """
+        Puts items handed out but never acknowledged back at the head of the
+        queue, e.g. when a consumer restarts after dying mid-batch.
+
+        Returns:
+            int: Number of items requeued.
+        """
+        with self._mutex:
+            count = len(self._inflight)
+            while self._inflight:
+                self._ready.appendleft(self._inflight.pop())
+            if count:
+                self._not_empty.notify_all()
+            return count
+
+    def join(self):
+        """Blocks until every item has been got and acknowledged."""
+        with self._all_done:
+            while self._ready or self._inflight:
+                self._all_done.wait()
+
+    def qsize(self):
+        with self._mutex:
+            return len(self._ready)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return False
+
+    def unacked(self):
+        """Returns the number of items handed out and not yet acknowledged."""
+        with self._mutex:
+            return len(self._inflight)
+
+    def _compact_ack_log(self):
+        path = os.path.join(self.directory, ACK_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_ACK.pack(self._acked))
+            f.flush()
+            os.fsync(f.fileno())
+        self._ack_file.close()
+        os.replace(tmp_path, path)
+        self._ack_file = open(path, 'ab')
+
+    def close(self):
+        """Flushes everything to disk and stops the fsync thread."""
+        with self._mutex:
+            if self._closed:
+                return
+            self._closed = True
+            self._sync()
+            self._segment_file.close()
+            self._ack_file.close()
+        self._sync_wakeup.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join()
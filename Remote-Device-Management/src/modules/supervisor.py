@@ -0,0 +1,193 @@
+"""
+Runs the datalogger services as threads of one process.
+
+By default every service is its own systemd unit and Python interpreter
+(queue_server, adc_batch_generation, s3_event_manager, pubsub2, ...), each
+loading .env, setting up logging and importing numpy, boto3 or awscrt on
+its own. This is the optional alternative: one interpreter, one logging and
+metrics setup, and the event queues shared in memory (QUEUE_TRANSPORT=local,
+so there is no queue_server and no socket or TCP hop between services).
+
+Each component is a service's main(stop_event), run in a thread named after
+the component. One that raises, calls sys.exit() or returns while the
+supervisor is running is restarted after a delay that starts at
+SUPERVISOR_RESTART_DELAY, doubles up to SUPERVISOR_MAX_RESTART_DELAY and
+goes back to the start once the component has stayed up for
+SUPERVISOR_HEALTHY_AFTER seconds. A component's modules are imported in
+its thread, so one whose dependencies fail to import is retried the same way
+without holding up the others.
+
+The two layouts are alternatives (datalogger.service conflicts with the
+per-service units). The spooled queues are the same directories, so events
+queued under one layout are delivered under the other.
+
+Environment:
+    SUPERVISOR_COMPONENTS         components to run (sampler,uploader,publisher);
+                                  also catchup and retention, see COMPONENTS
+    SUPERVISOR_RESTART_DELAY      first restart delay in seconds (1)
+    SUPERVISOR_MAX_RESTART_DELAY  longest restart delay in seconds (60)
+    SUPERVISOR_HEALTHY_AFTER      seconds up after which the delay resets (60)
+    SUPERVISOR_STOP_TIMEOUT       seconds to wait for components on shutdown (60)
+    LOG_FILE_SUPERVISOR, METRICS_PORT_SUPERVISOR, METRICS_FILE_SUPERVISOR
+"""
+import os
+import sys
+import time
+import logging
+import importlib
+import threading
+from dotenv import load_dotenv
+from log_setup import setup_logging
+from queue_consumer import install_signal_handlers
+import metrics
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Component name -> module whose main(stop_event) it runs
+COMPONENTS = {
+    "sampler": "adc_batch_generation",
+    "uploader": "s3_event_manager",
+    "catchup": "s3_upload",
+    "publisher": "pubsub2",
+    "retention": "retention_manager",
+}
+
+# The component (thread) name tells the services' records apart in the shared log
+LOG_FORMAT = '%(asctime)s [%(levelname)s] [%(threadName)s] %(message)s'
+
+
+def service_main(module_name):
+    """Returns a component target that imports module_name and runs its main()."""
+    def run(stop_event):
+        importlib.import_module(module_name).main(stop_event)
+    return run
+
+
+class Supervisor:
+    """
+    Runs components in threads and restarts any that fail.
+
+    Args:
+        components (dict): Component name -> callable taking the shared
+            stop_event and returning once it is set.
+        stop_event (threading.Event): Shutdown signal; a new one is created when not given.
+        restart_delay (float): Seconds before the first restart.
+        max_restart_delay (float): Longest delay between restarts.
+        healthy_after (float): Seconds a component must run for the delay to reset.
+        log (logging.Logger): Service logger to report to.
+    """
+
+    def __init__(self, components, stop_event=None, restart_delay=1.0, max_restart_delay=60.0, healthy_after=60.0, log=None):
+        self.components = dict(components)
+        self.stop_event = stop_event or threading.Event()
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.healthy_after = healthy_after
+        self.logger = log or logger
+        self.restarts = {name: 0 for name in self.components}
+        self._threads = {}
+
+    def start(self):
+        for name, target in self.components.items():
+            thread = threading.Thread(target=self._supervise, args=(name, target), name=name, daemon=True)
+            self._threads[name] = thread
+            thread.start()
+        self.logger.info(f"Supervisor started: {', '.join(self.components)}")
+
+    def _supervise(self, name, target):
+        up = metrics.gauge('supervisor_component_up', 'Whether a component is running (1) or waiting to restart (0)',
+                           {"component": name})
+        restarts = metrics.counter('supervisor_restarts_total', 'Component restarts after a failure', {"component": name})
+        delay = self.restart_delay
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            up.set(1)
+            try:
+                target(self.stop_event)
+                if self.stop_event.is_set():
+                    break
+                self.logger.error(f"{name} stopped on its own")
+            except (Exception, SystemExit) as e:
+                if self.stop_event.is_set():
+                    self.logger.warning(f"{name} failed while stopping: {e!r}")
+                    break
+                self.logger.error(f"{name} failed: {e!r}", exc_info=not isinstance(e, SystemExit))
+            finally:
+                up.set(0)
+
+            if time.monotonic() - started >= self.healthy_after:
+                delay = self.restart_delay
+            self.logger.info(f"Restarting {name} in {delay:.1f}s")
+            if self.stop_event.wait(delay):
+                break
+            self.restarts[name] += 1
+            restarts.inc()
+            delay = min(self.max_restart_delay, delay * 2)
+        self.logger.info(f"{name} stopped")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self, timeout=None):
+        """
+        Waits up to timeout seconds for every component to stop.
+
+        Returns:
+            list: Names of the components still running.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads.values():
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return [name for name, thread in self._threads.items() if thread.is_alive()]
+
+    def run(self, stop_timeout=60.0):
+        """Starts the components and blocks until stop_event is set and they have stopped."""
+        self.start()
+        self.stop_event.wait()
+        self.logger.info("Supervisor stopping.")
+        still_running = self.join(stop_timeout)
+        if still_running:
+            self.logger.warning(f"Components still running after {stop_timeout:.0f}s: {', '.join(still_running)}")
+        return still_running
+
+
+def main():
+    # Every service in this process uses the in-memory queues. Set before queue_server is
+    # imported, which reads it; load_dotenv() doesn't override it.
+    os.environ['QUEUE_TRANSPORT'] = 'local'
+    import queue_server
+
+    # Set up first: the services' own setup_logging() and start_metrics() calls then share these
+    log = setup_logging('supervisor', os.getenv('LOG_FILE_SUPERVISOR', 'datalogger.log'), text_format=LOG_FORMAT)
+    metrics.start_metrics(os.getenv('METRICS_PORT_SUPERVISOR'), os.getenv('METRICS_FILE_SUPERVISOR'), log=log)
+
+    names = [n.strip() for n in os.getenv('SUPERVISOR_COMPONENTS', 'sampler,uploader,publisher').split(',') if n.strip()]
+    unknown = [n for n in names if n not in COMPONENTS]
+    if unknown:
+        log.error(f"Unknown SUPERVISOR_COMPONENTS: {', '.join(unknown)} (known: {', '.join(COMPONENTS)})")
+        sys.exit(1)
+
+    # Open the spools now so pending events are replayed before any component starts
+    for name, durable in queue_server.QUEUES.values():
+        queue_server.get_queue(name, durable=durable)
+
+    supervisor = Supervisor(
+        {name: service_main(COMPONENTS[name]) for name in names},
+        restart_delay=float(os.getenv('SUPERVISOR_RESTART_DELAY', '1')),
+        max_restart_delay=float(os.getenv('SUPERVISOR_MAX_RESTART_DELAY', '60')),
+        healthy_after=float(os.getenv('SUPERVISOR_HEALTHY_AFTER', '60')),
+        log=log,
+    )
+    install_signal_handlers(supervisor.stop_event)
+    try:
+        supervisor.run(stop_timeout=float(os.getenv('SUPERVISOR_STOP_TIMEOUT', '60')))
+    finally:
+        queue_server.close_queues()
+        log.info("Supervisor stopped.")
+
+
+if __name__ == "__main__":
+    main()